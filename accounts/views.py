@@ -6,6 +6,11 @@ from django.contrib import messages
 from django.contrib.auth.models import User
 from django.urls import reverse_lazy
 
+from posts.models import BlogPost, Comment, UserStats
+
+PROFILE_POSTS = 6
+PROFILE_COMMENTS = 5
+
 
 def user_login(request):
     if request.user.is_authenticated:
@@ -62,13 +67,27 @@ def user_logout(request):
 
 @login_required
 def user_profile(request):
-    user_posts = request.user.blogpost_set.all().order_by('-created_at')
-    user_comments = request.user.comment_set.all().order_by('-created_at')
+    # Totals come from the stats row; only a bounded slice of posts and comments is loaded
+    stats = UserStats.for_user(request.user)
+    user_posts = (
+        BlogPost.objects.filter(author=request.user)
+        .with_comment_count()
+        .defer('content', 'plain_text', 'rendered_html')
+        .order_by('-created_at', '-id')[:PROFILE_POSTS]
+    )
+    user_comments = (
+        Comment.objects.filter(author=request.user)
+        .select_related('post')
+        .only('content', 'created_at', 'post__id', 'post__title')
+        .order_by('-created_at')[:PROFILE_COMMENTS]
+    )
     
     context = {
+        'stats': stats,
         'user_posts': user_posts,
         'user_comments': user_comments,
-        'total_posts': user_posts.count(),
-        'total_comments': user_comments.count(),
+        'total_posts': stats.post_count,
+        'total_comments': stats.comment_count,
+        'more_comments': max(stats.comment_count - PROFILE_COMMENTS, 0),
     }
     return render(request, 'registration/profile.html', context)
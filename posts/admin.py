@@ -1,5 +1,22 @@
 from django.contrib import admin
+from django.db.models import Case, Count, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
 from .models import BlogPost, Comment, LikeDislike, BlogPostImage
+from .pagination import EstimatedCountPaginator
+from .search import rank_posts
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist settings for tables that grow without bound: no exact
+    COUNT(*) per page view (estimated counts, and no "N total" count next
+    to filtered results) and primary-key ordering, which is always indexed.
+    Foreign keys should use autocomplete or raw-id widgets, since a select
+    box would load every related row.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ['-id']
 
 
 class BlogPostImageInline(admin.TabularInline):
@@ -10,40 +27,78 @@ class BlogPostImageInline(admin.TabularInline):
 
 
 @admin.register(BlogPost)
-class BlogPostAdmin(admin.ModelAdmin):
+class BlogPostAdmin(LargeTableAdmin):
     list_display = ['title', 'author', 'created_at', 'total_likes', 'total_dislikes', 'image_count']
-    list_filter = ['created_at', 'author']
+    list_filter = ['created_at']
+    list_select_related = ['author']
     search_fields = ['title', 'content']
+    autocomplete_fields = ['author']
     prepopulated_fields = {'title': ('title',)}
     date_hierarchy = 'created_at'
-    ordering = ['-created_at']
+    # Served by the feed index
+    ordering = ['-created_at', '-id']
     inlines = [BlogPostImageInline]
 
+    def get_queryset(self, request):
+        # Counted per displayed row by a correlated subquery rather than a GROUP BY over the whole table
+        additional_images = (
+            BlogPostImage.objects.filter(post=OuterRef('pk'))
+            .order_by().values('post').annotate(total=Count('pk')).values('total')
+        )
+        has_main_image = Case(When(Q(image='') | Q(image__isnull=True), then=Value(0)), default=Value(1))
+        return super().get_queryset(request).defer('content', 'plain_text').annotate(
+            image_total=Coalesce(Subquery(additional_images), Value(0)) + has_main_image,
+        )
+
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full-text index instead of LIKE scans over the HTML content
+        if not search_term:
+            return queryset, False
+        matching_ids = rank_posts(search_term).values_list('post_id', flat=True)
+        return queryset.filter(pk__in=matching_ids), False
+
+    def total_likes(self, obj):
+        return obj.likes_count
+    total_likes.short_description = 'Likes'
+    total_likes.admin_order_field = 'likes_count'
+
+    def total_dislikes(self, obj):
+        return obj.dislikes_count
+    total_dislikes.short_description = 'Dislikes'
+    total_dislikes.admin_order_field = 'dislikes_count'
+
     def image_count(self, obj):
-        return len(obj.get_all_images())
+        return obj.image_total
     image_count.short_description = 'Total Images'
+    image_count.admin_order_field = 'image_total'
 
 
 @admin.register(BlogPostImage)
-class BlogPostImageAdmin(admin.ModelAdmin):
+class BlogPostImageAdmin(LargeTableAdmin):
     list_display = ['post', 'caption', 'order', 'uploaded_at']
-    list_filter = ['uploaded_at', 'post']
+    list_filter = ['uploaded_at']
+    list_select_related = ['post']
     list_editable = ['order']
     search_fields = ['post__title', 'caption']
-    date_hierarchy = 'uploaded_at'
+    autocomplete_fields = ['post']
 
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(LargeTableAdmin):
     list_display = ['author', 'post', 'created_at', 'active', 'parent']
     list_filter = ['active', 'created_at']
+    # The parent column renders the parent comment's author and post too
+    list_select_related = ['author', 'post', 'parent__author', 'parent__post']
     search_fields = ['content', 'author__username']
     list_editable = ['active']
-    date_hierarchy = 'created_at'
+    autocomplete_fields = ['author', 'post']
+    raw_id_fields = ['parent']
 
 
 @admin.register(LikeDislike)
-class LikeDislikeAdmin(admin.ModelAdmin):
+class LikeDislikeAdmin(LargeTableAdmin):
     list_display = ['user', 'post', 'is_like', 'created_at']
     list_filter = ['is_like', 'created_at']
+    list_select_related = ['user', 'post']
     search_fields = ['user__username', 'post__title']
+    autocomplete_fields = ['user', 'post']
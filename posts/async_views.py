@@ -0,0 +1,125 @@
+"""
+Async variants of the read and reaction hot paths.
+
+They render the same templates and return the same responses as their
+counterparts in posts.views, but use the async ORM and issue independent
+queries together, so under an ASGI server a worker is not held while a
+request waits on the database. urls.py routes to them when
+POSTS_ASYNC_VIEWS is True.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.http import Http404, JsonResponse
+from django.shortcuts import render
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.http import require_POST
+
+from .caching import attach_cache_versions, get_feed_version, get_post_version
+from .comments import aload_comment_tree, load_comment_tree
+from .forms import CommentForm
+from .models import BlogPost, Follow
+from .page_cache import anonymous_page_cache, feed_version, post_version
+from .pagination import CursorPaginator
+from .reactions import aget_user_reaction, apply_reaction, arecord_reaction, buffered_mode
+from .throttling import throttle
+
+# Fragments of post_detail.html that need the comment tree
+COMMENT_FRAGMENTS = ('post_comments', 'post_info')
+
+arender = sync_to_async(render)
+
+
+async def _nothing():
+    return None
+
+
+def _fragment_cache():
+    # Same lookup as the {% cache %} tag
+    try:
+        return caches['template_fragments']
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+async def _comment_fragments_cached(pk, version):
+    keys = [make_template_fragment_key(name, [pk, version]) for name in COMMENT_FRAGMENTS]
+    return len(await _fragment_cache().aget_many(keys)) == len(keys)
+
+
+@anonymous_page_cache(feed_version)
+async def post_list(request):
+    # Looked up first so replica reads are fresh enough for it (posts.routers)
+    await sync_to_async(get_feed_version)()
+    posts = BlogPost.objects.with_card_data()
+    paginator = CursorPaginator(posts, 6, count_cache_key='post_list')
+    page_obj = await paginator.aget_page(request.GET.get('cursor'))
+    page_obj.object_list = await sync_to_async(attach_cache_versions)(page_obj.object_list, posts)
+    return await arender(request, 'posts/post_list.html', {'page_obj': page_obj})
+
+
+@anonymous_page_cache(post_version)
+async def post_detail(request, pk):
+    user = await request.auser()
+    version = await sync_to_async(get_post_version)(pk)
+    # The comment tree is only needed when its cached fragments have to be re-rendered
+    load_comments = not await _comment_fragments_cached(pk, version)
+
+    try:
+        post, user_reaction, following, comments = await asyncio.gather(
+            BlogPost.objects.select_related('author').aget(pk=pk),
+            aget_user_reaction(user, pk) if user.is_authenticated else _nothing(),
+            Follow.objects.filter(follower=user, author__blogpost=pk).aexists() if user.is_authenticated else _nothing(),
+            aload_comment_tree(pk) if load_comments else _nothing(),
+        )
+    except BlogPost.DoesNotExist:
+        raise Http404('No BlogPost matches the given query.')
+
+    post.cache_version = version
+    if comments is None:
+        # Fragments can still expire before rendering; fall back to a lazy load
+        comments = SimpleLazyObject(lambda: load_comment_tree(post))
+
+    context = {
+        'post': post,
+        'comments': comments,
+        'comment_form': CommentForm(),
+        'user_reaction': user_reaction,
+        'following': bool(following),
+    }
+    return await arender(request, 'posts/post_detail.html', context)
+
+
+@login_required
+@require_POST
+# The same limits as views.like_dislike_post
+@throttle('reaction', user='30/m', ip='120/m')
+async def like_dislike_post(request, pk):
+    action = request.POST.get('action')
+
+    if action not in ['like', 'dislike']:
+        return JsonResponse({'error': 'Invalid action'}, status=400)
+
+    user = await request.auser()
+    if buffered_mode():
+        result = await arecord_reaction(user, pk, action)
+        if result is None:
+            raise Http404('No BlogPost matches the given query.')
+        user_reaction, likes_count, dislikes_count = result
+    else:
+        try:
+            post = await BlogPost.objects.aget(pk=pk)
+        except BlogPost.DoesNotExist:
+            raise Http404('No BlogPost matches the given query.')
+        # Transactions are not available in async code, so the locked toggle runs in a thread
+        user_reaction = await sync_to_async(apply_reaction)(user, post, action)
+        likes_count, dislikes_count = post.likes_count, post.dislikes_count
+
+    return JsonResponse({
+        'likes_count': likes_count,
+        'dislikes_count': dislikes_count,
+        'user_reaction': user_reaction,
+    })
@@ -0,0 +1,76 @@
+"""
+A fast path for the per-request user lookup.
+
+Every page reads request.user (base.html shows the username), which costs
+a session read and a User query. With FAST_AUTH_SETTINGS the session
+lives in the cache (or a signed cookie), flash messages in a cookie, and
+CachedModelBackend serves the user from the cache for up to
+POSTS_AUTH_USER_CACHE_SECONDS, so a page view only queries for its
+content.
+
+The cached user is dropped whenever the User row is saved or deleted
+(which covers password changes and last_login on login) and on logout
+(posts.signals). Changes made with QuerySet.update() bypass the signals
+and show up when the entry expires.
+
+The cache holds whole User objects, password hashes included, so
+POSTS_AUTH_CACHE must only be reachable by the site itself.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db import transaction
+
+USER_KEY = 'auth-user:{}'
+
+# Settings of the fast path. The session engine can also be
+# 'django.contrib.sessions.backends.cached_db', to keep sessions across cache
+# restarts at the cost of a write per session change, or
+# 'django.contrib.sessions.backends.signed_cookies'.
+FAST_AUTH_SETTINGS = {
+    'SESSION_ENGINE': 'django.contrib.sessions.backends.cache',
+    'MESSAGE_STORAGE': 'django.contrib.messages.storage.cookie.CookieStorage',
+    'AUTHENTICATION_BACKENDS': ['posts.auth.CachedModelBackend'],
+}
+
+
+def _cache():
+    return caches[getattr(settings, 'POSTS_AUTH_CACHE', 'default')]
+
+
+def user_cache_seconds():
+    return getattr(settings, 'POSTS_AUTH_USER_CACHE_SECONDS', 60)
+
+
+def forget_user(user_id):
+    """
+    Drop the cached copy of a user, so the next request reads it again.
+    Inside a transaction it is dropped again on commit: until then other
+    requests still read the old row and may cache it again.
+    """
+    key = USER_KEY.format(user_id)
+    _cache().delete(key)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _cache().delete(key))
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend whose get_user(), run for every request with a session, is answered from the cache"""
+
+    def get_user(self, user_id):
+        backend, key = _cache(), USER_KEY.format(user_id)
+        user = backend.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                backend.set(key, user, user_cache_seconds())
+        return user
+
+    async def aget_user(self, user_id):
+        backend, key = _cache(), USER_KEY.format(user_id)
+        user = await backend.aget(key)
+        if user is None:
+            user = await super().aget_user(user_id)
+            if user is not None:
+                await backend.aset(key, user, user_cache_seconds())
+        return user
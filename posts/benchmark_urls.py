@@ -0,0 +1,25 @@
+"""
+URLconf used by the benchmark_async_views command: the project's URLs plus
+both variants of each hot-path view under /__bench__/sync/ and
+/__bench__/async/, so they can be compared in one process.
+"""
+from django.conf import settings
+from django.urls import include, path
+
+from . import async_views, views
+
+
+def _variant(module):
+    return [
+        path('', module.post_list),
+        path('post/<int:pk>/', module.post_detail),
+        path('post/<int:pk>/like-dislike/', module.like_dislike_post),
+    ]
+
+
+urlpatterns = [
+    path('__bench__/sync/', include(_variant(views))),
+    path('__bench__/async/', include(_variant(async_views))),
+    # The command points ROOT_URLCONF here and passes the original in this setting
+    path('', include(settings.POSTS_BENCHMARK_BASE_URLCONF)),
+]
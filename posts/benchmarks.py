@@ -0,0 +1,193 @@
+"""
+View benchmarks driven through the test client.
+
+run_benchmarks() times the hot views (post_list, post_detail,
+like_dislike_post, my_posts and accounts' user_profile) on the current
+database and records latency percentiles and the number of queries per
+request. compare() checks a run against a saved baseline: any increase in
+queries is a regression, and so is a latency increase beyond a relative
+tolerance (ignoring differences too small to be more than noise).
+
+compare_auth_setups() times page views under different session and
+authentication settings (see posts.auth), counting the queries spent on
+the session and the user.
+"""
+import platform
+import statistics
+import time
+from collections import namedtuple
+
+import django
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import BlogPost, Comment
+
+SCENARIOS = ('post_list', 'post_detail', 'like_dislike_post', 'my_posts', 'user_profile')
+
+Targets = namedtuple('Targets', ['post_id', 'author', 'reader'])
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def pick_targets():
+    """
+    The busiest post (most comments), the most prolific author and another
+    user to react as, so every view is measured at its heaviest
+    """
+    busiest = Comment.objects.values('post').annotate(total=Count('pk')).order_by('-total', 'post').first()
+    post_id = busiest['post'] if busiest else BlogPost.objects.order_by('pk').values_list('pk', flat=True).first()
+    prolific = BlogPost.objects.values('author').annotate(total=Count('pk')).order_by('-total', 'author').first()
+    if post_id is None or prolific is None:
+        raise BenchmarkError('The database has no posts; generate a dataset first.')
+    author = User.objects.get(pk=prolific['author'])
+    reader = User.objects.exclude(pk=author.pk).order_by('pk').first() or author
+    return Targets(post_id, author, reader)
+
+
+def _requests(name, targets):
+    """(client user, method, url, data) for a scenario"""
+    if name == 'post_list':
+        return None, 'get', reverse('post_list'), None
+    if name == 'post_detail':
+        return None, 'get', reverse('post_detail', args=[targets.post_id]), None
+    if name == 'like_dislike_post':
+        # The same action toggles the reaction, so an even number of runs leaves the data unchanged
+        return targets.reader, 'post', reverse('like_dislike_post', args=[targets.post_id]), {'action': 'like'}
+    if name == 'my_posts':
+        return targets.author, 'get', reverse('my_posts'), None
+    if name == 'user_profile':
+        return targets.author, 'get', reverse('profile'), None
+    raise BenchmarkError(f'Unknown scenario "{name}"')
+
+
+def percentiles(latencies):
+    if len(latencies) == 1:
+        return {'p50_ms': latencies[0], 'p95_ms': latencies[0], 'p99_ms': latencies[0]}
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {'p50_ms': cuts[49], 'p95_ms': cuts[94], 'p99_ms': cuts[98]}
+
+
+def measure(name, user, method, url, data, iterations):
+    """Send the request ``iterations`` times; returns (latencies in ms, the SQL of each request)"""
+    client = Client()
+    if user is not None:
+        client.force_login(user)
+    send = getattr(client, method)
+
+    # Warm-up: template loading and the fragment caches are not what is measured
+    send(url, data)
+    if method == 'post':
+        send(url, data)
+
+    latencies, request_queries = [], []
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = send(url, data)
+            latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            raise BenchmarkError(f'{name}: {method.upper()} {url} returned {response.status_code}')
+        request_queries.append([query['sql'] for query in queries.captured_queries])
+    return latencies, request_queries
+
+
+def summarize(latencies, iterations):
+    result = {key: round(value, 2) for key, value in percentiles(latencies).items()}
+    result.update(iterations=iterations, mean_ms=round(statistics.fmean(latencies), 2))
+    return result
+
+
+def run_scenario(name, targets, iterations):
+    latencies, request_queries = measure(name, *_requests(name, targets), iterations)
+    result = summarize(latencies, iterations)
+    result['queries'] = max(len(queries) for queries in request_queries)
+    return result
+
+
+def run_benchmarks(scenarios=SCENARIOS, iterations=50, progress=None):
+    """Run each scenario ``iterations`` times; returns {scenario: result}"""
+    targets = pick_targets()
+    # Keeps like_dislike_post from drifting the data when iterations is odd
+    iterations += iterations % 2
+    results = {}
+    for name in scenarios:
+        results[name] = run_scenario(name, targets, iterations)
+        if progress:
+            progress(name, results[name])
+    return results
+
+
+# Page views whose session and user lookups compare_auth_setups measures: (label, scenario, logged in)
+AUTH_SCENARIOS = (
+    ('post_list (anonymous)', 'post_list', False),
+    ('post_list', 'post_list', True),
+    ('post_detail', 'post_detail', True),
+    ('user_profile', 'user_profile', True),
+)
+
+
+def is_auth_query(sql):
+    """Reads or writes of the session, or a User loaded on its own (not joined to content)"""
+    return '"django_session"' in sql or 'FROM "auth_user"' in sql
+
+
+def compare_auth_setups(setups, iterations=50, progress=None):
+    """
+    Time the AUTH_SCENARIOS page views under each of ``setups`` ({name:
+    settings overrides}). Returns {setup: {label: result}}, where each
+    result also counts the queries per request on the session and user
+    tables (``auth_queries``).
+    """
+    targets = pick_targets()
+    results = {}
+    for setup, overrides in setups.items():
+        results[setup] = {}
+        with override_settings(**overrides):
+            for label, name, logged_in in AUTH_SCENARIOS:
+                user, method, url, data = _requests(name, targets)
+                user = (user or targets.reader) if logged_in else None
+                latencies, request_queries = measure(label, user, method, url, data, iterations)
+                result = summarize(latencies, iterations)
+                result['queries'] = max(len(queries) for queries in request_queries)
+                result['auth_queries'] = max(sum(map(is_auth_query, queries)) for queries in request_queries)
+                results[setup][label] = result
+                if progress:
+                    progress(setup, label, result)
+    return results
+
+
+def environment():
+    return {
+        'database': connection.vendor,
+        'django': django.get_version(),
+        'python': platform.python_version(),
+    }
+
+
+def compare(results, baseline, tolerance=0.25, min_delta_ms=5.0):
+    """
+    Regressions of ``results`` against ``baseline`` (both {scenario:
+    result}), as a list of messages. Latency regresses when p50 or p95 grows
+    by more than ``tolerance`` (a fraction) and by at least ``min_delta_ms``.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if current['queries'] > previous['queries']:
+            regressions.append(f'{name}: {current["queries"]} queries per request (baseline {previous["queries"]})')
+        for key in ('p50_ms', 'p95_ms'):
+            limit = max(previous[key] * (1 + tolerance), previous[key] + min_delta_ms)
+            if current[key] > limit:
+                regressions.append(
+                    f'{name}: {key[:3]} {current[key]:.1f} ms (baseline {previous[key]:.1f} ms, limit {limit:.1f} ms)'
+                )
+    return regressions
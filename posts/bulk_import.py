@@ -0,0 +1,297 @@
+"""
+Bulk loading of posts, images, comments and reactions from JSON Lines,
+in the format written by posts.export (plus individual ``reaction``
+records, since exports only carry per-post totals).
+
+Source primary keys of posts and comments are kept, so comment parents
+and reactions can refer to them across chunks, old URLs stay valid, and
+re-running a chunk after a crash skips what was already written. A source
+id already taken by a different local row rejects the chunk, and comments
+and reactions only attach to posts of the import, never to a local post
+that happens to share an id.
+"""
+from collections import Counter, defaultdict
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .caching import bump_post_versions
+from .media import rebuild_references
+from .models import BlogPost, BlogPostImage, Comment, LikeDislike, UserStats
+from .ranking import rescore_recent
+from .reactions import refresh_reaction_counters
+from .storage import is_content_addressed
+
+# Export record types that carry nothing to import
+IGNORED_TYPES = ('reactions', 'watermark')
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+def parse_timestamp(value):
+    if not value:
+        return timezone.now()
+    moment = parse_datetime(value)
+    if moment is None:
+        raise InvalidRecord(f'Invalid date/time "{value}"')
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+def media_name(url):
+    """Storage name for an exported media URL (absolute or relative to MEDIA_URL)"""
+    if not url:
+        return ''
+    path = urlparse(url).path
+    media_path = urlparse(settings.MEDIA_URL).path
+    return path[len(media_path):] if path.startswith(media_path) else path.lstrip('/')
+
+
+def resolve_comment_parents(pending):
+    """
+    Attach comments to their parents. ``pending`` maps comment id -> parent
+    id; a comment is linked once its parent exists on the same post and has
+    a path (the parent may itself be waiting on an ancestor). Returns the
+    entries that still could not be resolved.
+    """
+    segment_length = Comment.PATH_SEGMENT_WIDTH + len(Comment.PATH_SEPARATOR)
+    post_ids = dict(Comment.objects.filter(pk__in=list(pending)).values_list('pk', 'post_id'))
+    while pending:
+        parents = {
+            pk: (post_id, path)
+            for pk, post_id, path in Comment.objects.filter(pk__in=set(pending.values()))
+            .exclude(path='').values_list('pk', 'post_id', 'path')
+        }
+        resolved = []
+        for comment_id, parent_id in pending.items():
+            parent_post_id, parent_path = parents.get(parent_id, (None, None))
+            if parent_path is None or parent_post_id != post_ids.get(comment_id):
+                continue
+            if len(parent_path) // segment_length - 1 >= Comment.MAX_DEPTH:
+                # Same rule as Comment.save(): attach overly deep replies to the deepest allowed ancestor
+                parent_path = parent_path[:Comment.MAX_DEPTH * segment_length]
+                parent_id = int(parent_path[-segment_length:-len(Comment.PATH_SEPARATOR)])
+            resolved.append(Comment(
+                pk=comment_id, parent_id=parent_id, path=parent_path + Comment.path_segment(comment_id),
+            ))
+        if not resolved:
+            break
+        Comment.objects.bulk_update(resolved, ['parent', 'path'], batch_size=500)
+        for comment in resolved:
+            del pending[comment.pk]
+    return pending
+
+
+class BlogImporter:
+    """
+    Imports records chunk by chunk. Each chunk is one transaction: users
+    are looked up (or created) by username, then posts with their images,
+    comments and reactions are written with bulk_create. Counters are not
+    touched per row; call finish() once the whole file is loaded.
+    """
+
+    def __init__(self, pending_parents=None, imported_posts=None, user_ids=None):
+        # Username -> id of the users of this import, including ones loaded before a resume
+        self.user_ids = dict(user_ids or {})
+        self.pending_parents = dict(pending_parents or {})
+        # Ids of the posts of this import, including ones written before a resume
+        self.imported_posts = set(imported_posts or ())
+        self.counts = Counter()
+
+    def import_chunk(self, records):
+        by_type = defaultdict(list)
+        for record in records:
+            record_type = record.get('type')
+            if record_type in IGNORED_TYPES:
+                continue
+            if record_type not in ('post', 'comment', 'reaction'):
+                raise InvalidRecord(f'Unknown record type "{record_type}"')
+            by_type[record_type].append(record)
+
+        try:
+            with transaction.atomic():
+                self._load_users(by_type)
+                posts = self._import_posts(by_type['post'])
+                touched = (
+                    self._import_comments(by_type['comment'], posts)
+                    | self._import_reactions(by_type['reaction'], posts)
+                )
+                self.pending_parents = resolve_comment_parents(self.pending_parents)
+        except KeyError as e:
+            raise InvalidRecord(f'Missing field {e}') from e
+        self.imported_posts |= posts
+
+        # Bulk writes send no signals, so invalidate cached fragments explicitly
+        bump_post_versions(touched | posts, listing=bool(posts))
+
+    def finish(self):
+        """
+        Settle orphaned replies, count the image references, refresh the
+        reaction counters, user stats and post scores, and reset the id
+        sequences
+        """
+        with transaction.atomic():
+            orphans = [
+                Comment(pk=comment_id, parent=None, path=Comment.path_segment(comment_id))
+                for comment_id in self.pending_parents
+            ]
+            Comment.objects.bulk_update(orphans, ['parent', 'path'], batch_size=500)
+            self.counts['orphaned comments'] += len(orphans)
+            self.pending_parents = {}
+
+        post_ids = sorted(self.imported_posts)
+        names = set()
+        for start in range(0, len(post_ids), 1000):
+            batch = post_ids[start:start + 1000]
+            refresh_reaction_counters(BlogPost.objects.filter(pk__in=batch))
+            # bulk_create took no MediaFile references for the images it wrote; count them
+            names.update(BlogPost.objects.filter(pk__in=batch).values_list('image', flat=True))
+            names.update(BlogPostImage.objects.filter(post_id__in=batch).values_list('image', flat=True))
+        names = sorted(name for name in names if is_content_addressed(name))
+        for start in range(0, len(names), 500):
+            rebuild_references(names[start:start + 500])
+
+        # Only the users of the import have new posts, comments or likes
+        user_ids = sorted(self.user_ids.values())
+        for start in range(0, len(user_ids), 1000):
+            UserStats.objects.rebuild(user_ids[start:start + 1000])
+
+        rescore_recent()
+
+        # Rows were inserted with explicit ids; move PostgreSQL sequences past them
+        statements = connection.ops.sequence_reset_sql(no_style(), [BlogPost, Comment])
+        if statements:
+            with connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+
+    def _load_users(self, by_type):
+        usernames = {record['author'] for record in by_type['post'] + by_type['comment']}
+        usernames |= {record['user'] for record in by_type['reaction']}
+        usernames -= self.user_ids.keys()
+        if not usernames:
+            return
+        self.user_ids.update(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+        missing = usernames - self.user_ids.keys()
+        if missing:
+            User.objects.bulk_create([
+                User(username=username, password=make_password(None)) for username in sorted(missing)
+            ])
+            self.user_ids.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
+            self.counts['users'] += len(missing)
+
+    def _import_posts(self, records):
+        """Write the new posts of a chunk; returns the ids of every post of the chunk"""
+        existing = {
+            row[0]: row[1:] for row in BlogPost.objects.filter(pk__in=[r['id'] for r in records])
+            .values_list('pk', 'title', 'content', 'author_id')
+        }
+        chunk_posts, posts, images = set(), [], []
+        for record in records:
+            if record['id'] in chunk_posts or record['id'] in self.imported_posts:
+                self.counts['posts skipped'] += 1
+                continue
+            chunk_posts.add(record['id'])
+            if record['id'] in existing:
+                # Written by an earlier, interrupted run, or an unrelated local post
+                if existing[record['id']] != (record['title'], record.get('content') or '', self.user_ids[record['author']]):
+                    raise InvalidRecord(f'Post {record["id"]} already exists with different content')
+                self.counts['posts skipped'] += 1
+                continue
+            post = BlogPost(
+                pk=record['id'],
+                title=record['title'],
+                content=record.get('content') or '',
+                author_id=self.user_ids[record['author']],
+                image=media_name(record.get('image')) or None,
+                created_at=parse_timestamp(record.get('created_at')),
+            )
+            post.update_derived_text()
+            # Embedded uploads without renditions get them from render_post_content
+            post.update_rendered_html()
+            posts.append(post)
+            images.extend(
+                BlogPostImage(
+                    post_id=post.pk,
+                    image=media_name(image['url']),
+                    caption=image.get('caption', ''),
+                    order=image.get('order', 0),
+                )
+                for image in record.get('images', [])
+            )
+        BlogPost.objects.bulk_create(posts, batch_size=500)
+        BlogPostImage.objects.bulk_create(images, batch_size=500)
+        self.counts['posts'] += len(posts)
+        self.counts['images'] += len(images)
+        return chunk_posts
+
+    def _is_imported_post(self, post_id, chunk_posts):
+        return post_id in chunk_posts or post_id in self.imported_posts
+
+    def _import_comments(self, records, chunk_posts):
+        existing = {
+            row[0]: row[1:] for row in Comment.objects.filter(pk__in=[r['id'] for r in records])
+            .values_list('pk', 'post_id', 'author_id', 'content', 'path')
+        }
+        comments, seen = [], set()
+        for record in records:
+            if not self._is_imported_post(record['post_id'], chunk_posts):
+                self.counts['comments without post'] += 1
+                continue
+            if record['id'] in existing:
+                *stored, path = existing[record['id']]
+                if tuple(stored) != (record['post_id'], self.user_ids[record['author']], record['content']):
+                    raise InvalidRecord(f'Comment {record["id"]} already exists with different content')
+                if record.get('parent_id') and not path:
+                    # Written before an interrupted run could link it; the checkpoint may predate it
+                    self.pending_parents[record['id']] = record['parent_id']
+                self.counts['comments skipped'] += 1
+                continue
+            if record['id'] in seen:
+                self.counts['comments skipped'] += 1
+                continue
+            seen.add(record['id'])
+            parent_id = record.get('parent_id')
+            comments.append(Comment(
+                pk=record['id'],
+                post_id=record['post_id'],
+                author_id=self.user_ids[record['author']],
+                content=record['content'],
+                active=record.get('active', True),
+                created_at=parse_timestamp(record.get('created_at')),
+                # Replies get their path once the parent is linked
+                path='' if parent_id else Comment.path_segment(record['id']),
+            ))
+            if parent_id:
+                self.pending_parents[record['id']] = parent_id
+        Comment.objects.bulk_create(comments, batch_size=500)
+        self.counts['comments'] += len(comments)
+        return {comment.post_id for comment in comments}
+
+    def _import_reactions(self, records, chunk_posts):
+        latest = {}
+        for record in records:
+            if not self._is_imported_post(record['post_id'], chunk_posts):
+                self.counts['reactions without post'] += 1
+                continue
+            latest[(self.user_ids[record['user']], record['post_id'])] = record
+        reactions = [
+            LikeDislike(
+                user_id=user_id,
+                post_id=post_id,
+                is_like=bool(record['is_like']),
+                created_at=parse_timestamp(record.get('created_at')),
+            )
+            for (user_id, post_id), record in latest.items()
+        ]
+        # A user reacts to a post at most once; rows already present win
+        LikeDislike.objects.bulk_create(reactions, batch_size=500, ignore_conflicts=True)
+        self.counts['reactions'] += len(reactions)
+        return {post_id for _, post_id in latest}
@@ -0,0 +1,116 @@
+import time
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from .routers import replica_read_lag, require_fresh
+
+POST_VERSION_KEY = 'post-version:{}'
+# Changes whenever any post, comment or reaction changes; used for feed pages
+FEED_VERSION_KEY = 'feed-version'
+# Changes when a post is published or deleted, i.e. when the feeds list other posts
+LISTING_VERSION_KEY = 'listing-version'
+# Changes whenever post scores are recomputed (posts.ranking); used with the feed version for ranked feeds
+RANKING_VERSION_KEY = 'ranking-version'
+
+
+def _new_version():
+    # Millisecond timestamp plus a random suffix: unique, and it records when the change happened
+    return f'{int(time.time() * 1000):x}-{uuid4().hex[:8]}'
+
+
+def version_timestamp(version):
+    """Return the Unix time (seconds) at which ``version`` was created"""
+    try:
+        return int(version.split('-', 1)[0], 16) / 1000
+    except (AttributeError, ValueError):
+        return time.time()
+
+
+def _get_versions(keys, fresh_keys=None):
+    """Versions of ``keys``; replica reads must have the changes of ``fresh_keys`` (default: all of them)"""
+    found = cache.get_many(keys)
+    for key in set(keys) - found.keys():
+        version = _new_version()
+        # add() keeps a version another request stored in the meantime
+        found[key] = version if cache.add(key, version, None) else cache.get(key, version)
+    fresh = [found[key] for key in (keys if fresh_keys is None else fresh_keys)]
+    if fresh:
+        # Whatever is rendered for these versions must be read from a database that has the change
+        require_fresh(max(version_timestamp(version) for version in fresh))
+    return found
+
+
+def get_post_versions(post_ids):
+    """
+    Return {post_id: version} for the given posts in one cache round trip.
+    Posts without a stored version (new, or evicted) get a fresh one, which
+    safely invalidates any fragments cached under an older version.
+    """
+    keys = {POST_VERSION_KEY.format(post_id): post_id for post_id in post_ids}
+    return {keys[key]: version for key, version in _get_versions(keys).items()}
+
+
+def get_post_version(post_id):
+    return get_post_versions([post_id])[post_id]
+
+
+def get_feed_version():
+    """
+    The version of the latest feed page. Comments and reactions anywhere
+    move it, so under write traffic it is always under a second old; reads
+    only need to be as fresh as the listing version instead, which keeps
+    feed pages on replicas. attach_cache_versions() reads the cards of
+    posts changed since again from the primary.
+    """
+    versions = _get_versions([FEED_VERSION_KEY, LISTING_VERSION_KEY], fresh_keys=[LISTING_VERSION_KEY])
+    return versions[FEED_VERSION_KEY]
+
+
+def get_ranking_version():
+    """The newer of the feed and ranking versions, so ranked feed pages change with either"""
+    versions = _get_versions([FEED_VERSION_KEY, RANKING_VERSION_KEY])
+    return max(versions.values(), key=version_timestamp)
+
+
+def bump_ranking_version():
+    cache.set(RANKING_VERSION_KEY, _new_version(), None)
+
+
+def bump_post_version(post_id):
+    """Invalidate every cached fragment and page of the post by moving it to a new version"""
+    bump_post_versions([post_id])
+
+
+def bump_post_versions(post_ids, listing=False):
+    """
+    bump_post_version for many posts in one cache round trip; ``listing``
+    means posts were published or deleted
+    """
+    version = _new_version()
+    keys = [POST_VERSION_KEY.format(post_id) for post_id in post_ids] + [FEED_VERSION_KEY]
+    if listing:
+        keys.append(LISTING_VERSION_KEY)
+    cache.set_many(dict.fromkeys(keys, version), None)
+
+
+def attach_cache_versions(posts, queryset=None):
+    """
+    Set ``cache_version`` on each post, for use as a {% cache %} key, and
+    return the posts. A post changed more recently than the replica it was
+    read from lags behind its version, so with ``queryset`` (the one the
+    posts came from) such posts are read again from the primary.
+    """
+    posts = list(posts)
+    versions = get_post_versions([post.pk for post in posts])
+    lag = replica_read_lag()
+    if lag and queryset is not None:
+        since = time.time() - lag
+        stale = [post.pk for post in posts if version_timestamp(versions[post.pk]) > since]
+        if stale:
+            current = queryset.using(DEFAULT_DB_ALIAS).in_bulk(stale)
+            posts = [current.get(post.pk, post) for post in posts]
+    for post in posts:
+        post.cache_version = versions[post.pk]
+    return posts
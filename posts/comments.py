@@ -0,0 +1,51 @@
+from .models import Comment
+
+
+def build_comment_tree(comments, root_id=None):
+    """
+    Arrange comments (in path order) into a tree. Each comment gets a
+    ``thread_replies`` list and the roots are returned: top-level comments,
+    or only the comment with ``root_id`` when one is given. Replies whose
+    parent is not in ``comments`` (e.g. a hidden parent) are dropped,
+    matching how inactive threads are hidden.
+    """
+    by_id = {}
+    roots = []
+    for comment in comments:
+        comment.thread_replies = []
+        is_root = comment.pk == root_id if root_id is not None else comment.parent_id is None
+        if is_root:
+            roots.append(comment)
+        elif comment.parent_id in by_id:
+            by_id[comment.parent_id].thread_replies.append(comment)
+        else:
+            continue
+        by_id[comment.pk] = comment
+    return roots
+
+
+def load_comment_tree(post):
+    """Fetch every active comment on ``post`` with its author in one query and return the top-level comments"""
+    comments = (
+        Comment.objects.filter(post=post, active=True)
+        .select_related('author')
+        .order_by('path')
+    )
+    return build_comment_tree(comments)
+
+
+async def aload_comment_tree(post_id):
+    """Async counterpart of load_comment_tree"""
+    comments = (
+        Comment.objects.filter(post_id=post_id, active=True)
+        .select_related('author')
+        .order_by('path')
+    )
+    return build_comment_tree([comment async for comment in comments])
+
+
+def load_comment_subtree(comment):
+    """Fetch ``comment`` and its active descendants in one range scan and return it with replies attached"""
+    comments = Comment.objects.subtree(comment).filter(active=True).select_related('author')
+    roots = build_comment_tree(comments, root_id=comment.pk)
+    return roots[0] if roots else None
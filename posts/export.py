@@ -0,0 +1,132 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Prefetch, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import BlogPost, BlogPostImage, Comment, LikeDislike
+
+EXPORT_TYPES = ('posts', 'comments', 'reactions')
+
+
+class InvalidWatermark(ValueError):
+    pass
+
+
+def parse_watermark(value):
+    """Parse an ISO 8601 watermark, treating naive values as the current time zone"""
+    if not value:
+        return None
+    try:
+        moment = parse_datetime(value)
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise InvalidWatermark(f'"{value}" is not an ISO 8601 date/time')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _image_url(field, url_for):
+    return url_for(field.url) if field else None
+
+
+def export_posts(since=None, chunk_size=500, url_for=str):
+    """Posts created or edited at or after ``since``, with their image URLs"""
+    posts = BlogPost.objects.select_related('author').prefetch_related(
+        Prefetch('additional_images', queryset=BlogPostImage.objects.order_by('post_id', 'order', 'uploaded_at'))
+    ).order_by('pk')
+    if since is not None:
+        posts = posts.filter(Q(updated_at__gte=since) | Q(created_at__gte=since))
+    # iterator() with prefetch_related prefetches per chunk, so memory stays bounded
+    for post in posts.iterator(chunk_size=chunk_size):
+        yield {
+            'type': 'post',
+            'id': post.pk,
+            'title': post.title,
+            'author': post.author.username,
+            'content': post.content,
+            'excerpt': post.excerpt,
+            'word_count': post.word_count,
+            'image': _image_url(post.image, url_for),
+            'images': [
+                {'url': _image_url(image.image, url_for), 'caption': image.caption, 'order': image.order}
+                for image in post.additional_images.all()
+            ],
+            'likes_count': post.likes_count,
+            'dislikes_count': post.dislikes_count,
+            'created_at': post.created_at,
+            'updated_at': post.updated_at,
+        }
+
+
+def export_comments(since=None, chunk_size=2000):
+    """
+    Comments created or edited (which includes hiding or showing them) at
+    or after ``since``, grouped by post in thread order; ``parent_id`` and
+    ``path`` are enough to rebuild the threads.
+    """
+    comments = Comment.objects.select_related('author').order_by('post_id', 'path')
+    if since is not None:
+        comments = comments.filter(Q(updated_at__gte=since) | Q(created_at__gte=since))
+    for comment in comments.iterator(chunk_size=chunk_size):
+        yield {
+            'type': 'comment',
+            'id': comment.pk,
+            'post_id': comment.post_id,
+            'parent_id': comment.parent_id,
+            'path': comment.path,
+            'depth': comment.depth,
+            'author': comment.author.username,
+            'content': comment.content,
+            'active': comment.active,
+            'created_at': comment.created_at,
+            'updated_at': comment.updated_at,
+        }
+
+
+def export_reactions(since=None, chunk_size=2000):
+    """
+    Like/dislike totals per post, counted from LikeDislike rows. With
+    ``since``, only posts that received a reaction at or after it are
+    included (with their full totals); toggles and removals do not move
+    the watermark, so run a full export now and then to catch those.
+    """
+    reactions = LikeDislike.objects.order_by('post_id').values('post_id').annotate(
+        likes=Count('id', filter=Q(is_like=True)),
+        dislikes=Count('id', filter=Q(is_like=False)),
+    )
+    if since is not None:
+        reactions = reactions.filter(
+            post_id__in=LikeDislike.objects.filter(created_at__gte=since).values('post_id')
+        )
+    for row in reactions.iterator(chunk_size=chunk_size):
+        yield {'type': 'reactions', **row}
+
+
+EXPORTERS = {
+    'posts': export_posts,
+    'comments': export_comments,
+    'reactions': export_reactions,
+}
+
+
+def export_lines(types=EXPORT_TYPES, since=None, chunk_size=None, url_for=str):
+    """
+    Yield the export as JSON Lines, one record per line, ending with a
+    ``watermark`` record holding the time the export started. Passing that
+    value as ``since`` next time exports only what changed in between
+    (rows may repeat across exports; consumers should upsert by id).
+    ``url_for`` turns media URLs into absolute ones.
+    """
+    watermark = timezone.now()
+    encoder = DjangoJSONEncoder()
+    for export_type in types:
+        options = {'since': since}
+        if chunk_size:
+            options['chunk_size'] = chunk_size
+        if export_type == 'posts':
+            options['url_for'] = url_for
+        for record in EXPORTERS[export_type](**options):
+            yield encoder.encode(record) + '\n'
+    yield encoder.encode({'type': 'watermark', 'since': since, 'watermark': watermark}) + '\n'
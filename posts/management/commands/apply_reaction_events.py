@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.reactions import apply_reaction_events
+
+
+class Command(BaseCommand):
+    help = 'Apply buffered reaction clicks (POSTS_REACTION_MODE = "buffered") to LikeDislike and the post counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Maximum number of events applied per transaction (default: 1000)',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running, polling for new events',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait between polls when the buffer is empty (default: 2)',
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            started = time.monotonic()
+            applied = apply_reaction_events(batch_size=options['batch_size'])
+            total += applied
+            if applied:
+                elapsed = time.monotonic() - started
+                self.stdout.write(f'Applied {applied} events in {elapsed:.3f}s')
+                # A full batch means more events are probably waiting
+                if applied == options['batch_size']:
+                    continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'Applied {total} reaction event(s).'))
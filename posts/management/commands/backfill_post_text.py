@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import BlogPost
+
+
+class Command(BaseCommand):
+    help = 'Compute plain text, excerpt, word count and reading time for existing blog posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of posts to load and update per batch (default: 500)',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Recompute every post, not only those that have no plain text yet',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = BlogPost.objects.only('id', 'content').order_by('pk')
+        if not options['all']:
+            queryset = queryset.filter(plain_text='').exclude(content='').exclude(content__isnull=True)
+
+        updated = 0
+        last_pk = 0
+        while True:
+            # Seek by primary key so each batch is a cheap range scan
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            for post in batch:
+                post.update_derived_text()
+            with transaction.atomic():
+                BlogPost.objects.bulk_update(batch, BlogPost.DERIVED_TEXT_FIELDS)
+            updated += len(batch)
+            last_pk = batch[-1].pk
+            self.stdout.write(f'Updated {updated} posts...')
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled derived text for {updated} post(s).'))
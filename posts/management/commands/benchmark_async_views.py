@@ -0,0 +1,104 @@
+import asyncio
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from posts.models import BlogPost
+
+VARIANTS = ('sync', 'async')
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare throughput of the sync and async post_list, post_detail and like_dislike_post '
+        'views at a fixed concurrency, through the ASGI handler. Runs against the configured '
+        'database; the like/dislike scenario records real reactions for --user.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario (default: 200)')
+        parser.add_argument('--concurrency', type=int, default=20, help='Requests in flight at once (default: 20)')
+        parser.add_argument('--post', type=int, help='Post id used for the detail and like scenarios (default: newest)')
+        parser.add_argument('--user', help='Username to log in as; required for the like/dislike scenario')
+        parser.add_argument(
+            '--page-cache',
+            action='store_true',
+            help='Leave the anonymous page cache on (by default it is disabled so the views actually run)',
+        )
+
+    def handle(self, *args, **options):
+        post = BlogPost.objects.filter(pk=options['post']) if options['post'] else BlogPost.objects.all()
+        post = post.order_by('-created_at', '-id').only('id').first()
+        if post is None:
+            raise CommandError('No posts to benchmark against; create some first.')
+
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f'Unknown user "{options["user"]}".')
+
+        scenarios = [('post_list', 'get', ''), ('post_detail', 'get', f'post/{post.pk}/')]
+        if user is not None:
+            scenarios.append(('like_dislike_post', 'post', f'post/{post.pk}/like-dislike/'))
+        else:
+            self.stdout.write('Skipping like_dislike_post: pass --user to include it.')
+
+        overrides = {
+            'ROOT_URLCONF': 'posts.benchmark_urls',
+            'POSTS_BENCHMARK_BASE_URLCONF': settings.ROOT_URLCONF,
+            # Repeating the same reaction would soon be throttled
+            'POSTS_THROTTLE_ENABLED': False,
+        }
+        if not options['page_cache']:
+            overrides['POSTS_PAGE_CACHE_ENABLED'] = False
+
+        # Lets the test client's "testserver" host through ALLOWED_HOSTS
+        setup_test_environment()
+        try:
+            with override_settings(**overrides):
+                for name, method, url in scenarios:
+                    for variant in VARIANTS:
+                        result = asyncio.run(self.run_scenario(
+                            method, f'/__bench__/{variant}/{url}', user,
+                            options['requests'], options['concurrency'],
+                        ))
+                        self.report(name, variant, result)
+        finally:
+            teardown_test_environment()
+
+    async def run_scenario(self, method, url, user, total, concurrency):
+        client = AsyncClient()
+        if user is not None:
+            await client.aforce_login(user)
+        data = {'action': 'like'} if method == 'post' else None
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies, errors = [], 0
+
+        async def one_request():
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                response = await getattr(client, method)(url, data)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    errors += 1
+
+        # One warm-up request so imports and template loading are not timed
+        await getattr(client, method)(url, data)
+        started = time.perf_counter()
+        await asyncio.gather(*(one_request() for _ in range(total)))
+        return time.perf_counter() - started, latencies, errors
+
+    def report(self, name, variant, result):
+        elapsed, latencies, errors = result
+        quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        self.stdout.write(
+            f'{name:<18} {variant:<5} {len(latencies) / elapsed:8.1f} req/s  '
+            f'p50 {quantiles[49] * 1000:7.1f} ms  p95 {quantiles[94] * 1000:7.1f} ms  errors {errors}'
+        )
@@ -0,0 +1,102 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from posts.auth import FAST_AUTH_SETTINGS
+from posts.benchmarks import BenchmarkError, compare_auth_setups
+from posts.synthetic import SCALES, generate_dataset
+
+SESSION_ENGINES = {
+    'cache': 'django.contrib.sessions.backends.cache',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+
+# Django's own defaults, which the project settings use
+DEFAULT_AUTH_SETTINGS = {
+    'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+    'MESSAGE_STORAGE': 'django.contrib.messages.storage.fallback.FallbackStorage',
+    'AUTHENTICATION_BACKENDS': ['django.contrib.auth.backends.ModelBackend'],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare anonymous and logged-in page views with database sessions and an uncached user '
+        '(the default) against the fast authentication path of posts.auth, reporting latency and '
+        'the queries per request spent on the session and the user. Runs on a throwaway test '
+        'database filled with a synthetic dataset unless --current-database is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help='Requests per view and setup (default: 50)')
+        parser.add_argument(
+            '--session-engine',
+            choices=sorted(SESSION_ENGINES),
+            default='cache',
+            help='Session engine of the fast path (default: cache)',
+        )
+        parser.add_argument('--scale', choices=sorted(SCALES), default='small', help='Synthetic dataset size (default: small)')
+        parser.add_argument('--seed', type=int, default=0, help='Synthetic dataset seed (default: 0)')
+        parser.add_argument(
+            '--current-database',
+            action='store_true',
+            help='Benchmark the configured database and caches as they are instead of a fresh test database',
+        )
+
+    def handle(self, *args, **options):
+        setups = {
+            'default': DEFAULT_AUTH_SETTINGS,
+            'fast': {**FAST_AUTH_SETTINGS, 'SESSION_ENGINE': SESSION_ENGINES[options['session_engine']]},
+        }
+        try:
+            # Lets the test client's "testserver" host through ALLOWED_HOSTS
+            setup_test_environment()
+            owns_environment = True
+        except RuntimeError:
+            # Already set up, e.g. when called from the test suite
+            owns_environment = False
+        try:
+            with override_settings(POSTS_PAGE_CACHE_ENABLED=False):
+                if options['current_database']:
+                    results = compare_auth_setups(setups, max(options['iterations'], 1), progress=self.progress)
+                else:
+                    results = self.run_on_test_database(setups, options)
+        except BenchmarkError as e:
+            raise CommandError(str(e))
+        finally:
+            if owns_environment:
+                teardown_test_environment()
+
+        self.stdout.write('')
+        for label, fast in results['fast'].items():
+            default = results['default'][label]
+            self.stdout.write(
+                f'{label:<22} p50 {default["p50_ms"]:6.1f} -> {fast["p50_ms"]:6.1f} ms  '
+                f'queries {default["queries"]:2d} -> {fast["queries"]:2d}  '
+                f'session/user queries {default["auth_queries"]} -> {fast["auth_queries"]}'
+            )
+        self.stdout.write(self.style.SUCCESS('Done.'))
+
+    def run_on_test_database(self, setups, options):
+        # Private caches, so sessions and users cached for another database are not used
+        caches = {
+            alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'benchmark-{alias}'}
+            for alias in settings.CACHES
+        }
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES=caches, POSTS_RENDITIONS_ASYNC=False):
+                self.stdout.write(f'Generating the {options["scale"]} dataset (seed {options["seed"]})...')
+                generate_dataset(SCALES[options['scale']], seed=options['seed'])
+                return compare_auth_setups(setups, max(options['iterations'], 1), progress=self.progress)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def progress(self, setup, label, result):
+        self.stdout.write(
+            f'{setup:<8} {label:<22} p50 {result["p50_ms"]:7.1f} ms  p95 {result["p95_ms"]:7.1f} ms  '
+            f'{result["queries"]:3d} queries ({result["auth_queries"]} session/user)'
+        )
@@ -0,0 +1,134 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from posts.benchmarks import SCENARIOS, BenchmarkError, compare, environment, run_benchmarks
+from posts.synthetic import SCALES, generate_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark post_list, post_detail, like_dislike_post, my_posts and user_profile through the '
+        'test client, recording latency percentiles and queries per request, and fail when a run '
+        'regresses against a JSON baseline. By default a throwaway test database is filled with a '
+        'synthetic dataset first, so runs are reproducible.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--baseline',
+            default=os.path.join('benchmarks', 'baseline.json'),
+            help='Baseline file to compare against or write (default: benchmarks/baseline.json)',
+        )
+        parser.add_argument('--save-baseline', action='store_true', help='Write this run as the new baseline')
+        parser.add_argument('--iterations', type=int, default=50, help='Requests per view (default: 50)')
+        parser.add_argument('--views', nargs='+', choices=SCENARIOS, default=list(SCENARIOS), help='Views to run')
+        parser.add_argument('--scale', choices=sorted(SCALES), default='small', help='Synthetic dataset size (default: small)')
+        parser.add_argument('--seed', type=int, default=0, help='Synthetic dataset seed (default: 0)')
+        parser.add_argument(
+            '--current-database',
+            action='store_true',
+            help='Benchmark the configured database and caches as they are instead of a fresh test database',
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.25,
+            help='Allowed relative latency increase over the baseline (default: 0.25)',
+        )
+        parser.add_argument(
+            '--min-delta-ms',
+            type=float,
+            default=5.0,
+            help='Latency increases smaller than this are treated as noise (default: 5)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            # Lets the test client's "testserver" host through ALLOWED_HOSTS
+            setup_test_environment()
+            owns_environment = True
+        except RuntimeError:
+            # Already set up, e.g. when called from the test suite
+            owns_environment = False
+        try:
+            # Repeating the same reaction would soon be throttled
+            with override_settings(POSTS_PAGE_CACHE_ENABLED=False, POSTS_THROTTLE_ENABLED=False):
+                if options['current_database']:
+                    dataset = {'database': 'current'}
+                    results = self.run(options)
+                else:
+                    dataset = {'scale': options['scale'], 'seed': options['seed']}
+                    results = self.run_on_test_database(options)
+        except BenchmarkError as e:
+            raise CommandError(str(e))
+        finally:
+            if owns_environment:
+                teardown_test_environment()
+
+        run = {'environment': environment(), 'dataset': dataset, 'views': results}
+        if options['save_baseline']:
+            self.save(options['baseline'], run)
+            return
+        self.check_baseline(options, run)
+
+    def run_on_test_database(self, options):
+        # Private caches too: fragments cached for another database must not be served
+        caches = {
+            alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'benchmark-{alias}'}
+            for alias in settings.CACHES
+        }
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES=caches, POSTS_RENDITIONS_ASYNC=False):
+                self.stdout.write(f'Generating the {options["scale"]} dataset (seed {options["seed"]})...')
+                generate_dataset(SCALES[options['scale']], seed=options['seed'])
+                return self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, options):
+        def progress(name, result):
+            self.stdout.write(
+                f'{name:<18} p50 {result["p50_ms"]:7.1f} ms  p95 {result["p95_ms"]:7.1f} ms  '
+                f'p99 {result["p99_ms"]:7.1f} ms  {result["queries"]:3d} queries'
+            )
+
+        return run_benchmarks(options['views'], max(options['iterations'], 1), progress=progress)
+
+    def save(self, path, run):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(run, f, indent=2, sort_keys=True)
+            f.write('\n')
+        self.stdout.write(self.style.SUCCESS(f'Saved baseline to {path}'))
+
+    def check_baseline(self, options, run):
+        path = options['baseline']
+        if not os.path.exists(path):
+            self.stdout.write(self.style.WARNING(f'No baseline at {path}; run with --save-baseline to create one.'))
+            return
+        with open(path) as f:
+            baseline = json.load(f)
+
+        for key in ('environment', 'dataset'):
+            if baseline.get(key) != run[key]:
+                self.stdout.write(self.style.WARNING(
+                    f'The baseline was recorded with a different {key} ({baseline.get(key)}); '
+                    'latency comparisons may not be meaningful.'
+                ))
+
+        regressions = compare(
+            run['views'], baseline.get('views', {}),
+            tolerance=options['tolerance'], min_delta_ms=options['min_delta_ms'],
+        )
+        if regressions:
+            raise CommandError('Performance regressions against {}:\n  {}'.format(path, '\n  '.join(regressions)))
+        self.stdout.write(self.style.SUCCESS(f'No regressions against {path}.'))
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, DatabaseError
+from django.utils import timezone
+
+from posts.models import ReplicaHeartbeat
+from posts.routers import record_lag, replica_aliases
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure how far each replica in POSTS_REPLICA_DATABASES lags behind the primary, with a '
+        'heartbeat row, and publish the result for ReplicaRouter. Run it with --loop next to the app.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep measuring')
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='Seconds between heartbeats when looping (default: 1)',
+        )
+
+    def handle(self, *args, **options):
+        aliases = replica_aliases()
+        if not aliases:
+            self.stdout.write('No replicas configured (POSTS_REPLICA_DATABASES).')
+            return
+        # Measurements expire if this command stops, and replicas are then assumed to lag the maximum
+        timeout = max(options['interval'] * 5, 10)
+        while True:
+            lags = self.measure(aliases)
+            record_lag(lags, timeout)
+            self.stdout.write('  '.join(
+                f'{alias}: {"unavailable" if lag is None else f"{lag:.2f}s"}' for alias, lag in lags.items()
+            ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def measure(self, aliases):
+        ReplicaHeartbeat.objects.using(DEFAULT_DB_ALIAS).update_or_create(pk=1, defaults={'beat_at': timezone.now()})
+        lags = {}
+        for alias in aliases:
+            try:
+                beat = ReplicaHeartbeat.objects.using(alias).filter(pk=1).values_list('beat_at', flat=True).first()
+            except DatabaseError as e:
+                self.stderr.write(f'{alias}: {e}')
+                beat = None
+            # The lag includes up to one interval: the replica may be waiting for the next heartbeat
+            lags[alias] = None if beat is None else max((timezone.now() - beat).total_seconds(), 0.0)
+        return lags
@@ -0,0 +1,96 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.caching import bump_post_versions
+from posts.media import IMAGE_MODELS, rebuild_references
+from posts.models import BlogPostImage
+from posts.renditions import delete_source_renditions, shared_renditions
+from posts.storage import CONTENT_ROOT, content_name, file_digest, image_storage
+
+
+class Command(BaseCommand):
+    help = (
+        'Move existing post images to content-addressed names, merging identical files, '
+        'and rebuild the reference counts used to delete unreferenced images'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report duplicates and the space that would be reclaimed',
+        )
+
+    def legacy_names(self):
+        names = set()
+        for model in IMAGE_MODELS:
+            queryset = model.objects.exclude(image='').exclude(image__isnull=True).exclude(
+                image__startswith=CONTENT_ROOT + '/'
+            )
+            names.update(queryset.values_list('image', flat=True).distinct().iterator(chunk_size=2000))
+        return sorted(names)
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        storage = image_storage()
+        moved = merged = missing = reclaimed = 0
+        seen = {}
+
+        for name in self.legacy_names():
+            if not storage.exists(name):
+                missing += 1
+                self.stderr.write(f'Missing file {name}, left unchanged')
+                continue
+            with storage.open(name, 'rb') as source:
+                target = content_name(file_digest(source), os.path.splitext(name)[1])
+
+            duplicate = target in seen or storage.exists(target)
+            if duplicate:
+                merged += 1
+                reclaimed += storage.size(name)
+            else:
+                moved += 1
+            seen[target] = name
+            if dry_run:
+                continue
+
+            if not duplicate:
+                # Rename in place: no copy of the data is made
+                os.makedirs(os.path.dirname(storage.path(target)), exist_ok=True)
+                os.replace(storage.path(name), storage.path(target))
+            try:
+                self.repoint(name, target)
+            except Exception:
+                if not duplicate:
+                    os.replace(storage.path(target), storage.path(name))
+                raise
+            if duplicate:
+                storage.delete(name)
+            delete_source_renditions(name)
+
+        if not dry_run:
+            self.rebuild_reference_counts()
+
+        verb = 'Would reclaim' if dry_run else 'Reclaimed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{moved} file(s) renamed, {merged} duplicate(s) merged, {missing} missing. '
+            f'{verb} {reclaimed / 1024 / 1024:.1f} MiB.'
+        ))
+
+    def repoint(self, name, target):
+        """Point every row using ``name`` at ``target``, reusing renditions the target already has"""
+        metadata = shared_renditions(target) or {}
+        post_ids = set()
+        with transaction.atomic():
+            for model in IMAGE_MODELS:
+                rows = model.objects.filter(image=name)
+                post_field = 'post_id' if model is BlogPostImage else 'pk'
+                post_ids.update(rows.values_list(post_field, flat=True))
+                rows.update(image=target, image_renditions=metadata)
+        bump_post_versions(post_ids)
+
+    def rebuild_reference_counts(self):
+        stale, unreferenced = rebuild_references()
+        self.stdout.write(f'Updated {stale} reference count(s); {unreferenced} file(s) unreferenced')
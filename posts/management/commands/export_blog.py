@@ -0,0 +1,78 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.export import EXPORT_TYPES, InvalidWatermark, export_lines, parse_watermark
+
+
+class Command(BaseCommand):
+    help = 'Stream posts, comments and reaction totals as JSON Lines with constant memory use'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--types',
+            default=','.join(EXPORT_TYPES),
+            help=f'Comma-separated record types to export (default: {",".join(EXPORT_TYPES)})',
+        )
+        parser.add_argument(
+            '--since',
+            help='Only export rows created or updated at or after this ISO 8601 date/time',
+        )
+        parser.add_argument(
+            '--state-file',
+            help='File holding the watermark of the last export; read when --since is not given '
+                 'and updated after a successful export, for nightly incremental dumps',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            help='Rows fetched from the database per round trip',
+        )
+        parser.add_argument(
+            '-o', '--output',
+            help='Write to this file instead of standard output',
+        )
+        parser.add_argument(
+            '--base-url',
+            default='',
+            help='Prefix for media URLs, e.g. https://blog.example.com (default: site-relative URLs)',
+        )
+
+    def handle(self, *args, **options):
+        types = [name for name in options['types'].split(',') if name]
+        unknown = set(types) - set(EXPORT_TYPES)
+        if unknown:
+            raise CommandError(f'Unknown export type(s): {", ".join(sorted(unknown))}')
+
+        since = options['since']
+        state_file = options['state_file']
+        if since is None and state_file and os.path.exists(state_file):
+            with open(state_file) as f:
+                since = json.load(f).get('watermark')
+        try:
+            since = parse_watermark(since)
+        except InvalidWatermark as e:
+            raise CommandError(str(e))
+
+        base_url = options['base_url'].rstrip('/')
+        lines = export_lines(types, since=since, chunk_size=options['chunk_size'],
+                             url_for=lambda url: base_url + url)
+
+        count = 0
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                for line in lines:
+                    output.write(line)
+                    count += 1
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
+                count += 1
+
+        # The last line is the watermark record
+        watermark = json.loads(line)['watermark']
+        if state_file:
+            with open(state_file, 'w') as f:
+                json.dump({'watermark': watermark}, f)
+        self.stderr.write(f'Exported {count - 1} record(s); next watermark {watermark}')
@@ -0,0 +1,108 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts.caching import bump_post_version
+from posts.models import BlogPost, BlogPostImage
+from posts.renditions import discard_renditions, needs_renditions, render_variants, shared_renditions, store_variants
+
+
+def detach_inherited_connections():
+    """
+    Pool initializer: drop the database connections a forked worker inherits
+    from the command. Workers only run Pillow, and the command keeps querying
+    while they start, so the sockets are closed at the OS level first;
+    closing the connection objects then cannot send anything on the
+    parent's sessions.
+    """
+    for connection in connections.all(initialized_only=True):
+        if connection.connection is not None:
+            try:
+                os.close(connection.connection.fileno())
+            except (AttributeError, OSError):
+                pass
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Generate resized WebP/JPEG renditions for existing post images using a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of worker processes used for resizing (default: CPU count)',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate renditions even when they are already up to date',
+        )
+
+    def pending_images(self, force):
+        for model in (BlogPost, BlogPostImage):
+            queryset = model.objects.exclude(image='').exclude(image__isnull=True)
+            fields = ['id', 'image', 'image_renditions'] + (['post_id'] if model is BlogPostImage else [])
+            for instance in queryset.only(*fields).iterator(chunk_size=500):
+                if force or needs_renditions(instance):
+                    yield model, instance
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'], 1)
+        done = failed = 0
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=detach_inherited_connections) as executor:
+            in_flight = {}
+            images = self.pending_images(options['force'])
+            exhausted = False
+
+            while in_flight or not exhausted:
+                # Keep a bounded number of originals in memory at once
+                while not exhausted and len(in_flight) < workers * 2:
+                    try:
+                        model, instance = next(images)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    metadata = None if options['force'] else shared_renditions(instance.image.name)
+                    if metadata is not None:
+                        # Another post uses the same content-addressed image; reuse its renditions
+                        self.record(model, instance, metadata)
+                        done += 1
+                        continue
+                    try:
+                        with instance.image.open('rb') as source:
+                            data = source.read()
+                    except OSError as e:
+                        failed += 1
+                        self.stderr.write(f'Could not read {instance.image.name}: {e}')
+                        continue
+                    in_flight[executor.submit(render_variants, data)] = (model, instance)
+
+                if not in_flight:
+                    continue
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    model, instance = in_flight.pop(future)
+                    try:
+                        variants = future.result()
+                    except Exception as e:
+                        failed += 1
+                        self.stderr.write(f'Could not resize {instance.image.name}: {e}')
+                        continue
+                    self.record(model, instance, store_variants(instance.image.name, variants))
+                    done += 1
+                    if done % 100 == 0:
+                        self.stdout.write(f'Generated renditions for {done} images...')
+
+        self.stdout.write(self.style.SUCCESS(f'Generated renditions for {done} image(s), {failed} failed.'))
+
+    def record(self, model, instance, metadata):
+        previous = instance.image_renditions
+        model.objects.filter(pk=instance.pk).update(image_renditions=metadata)
+        if previous and previous.get('source') != instance.image.name:
+            discard_renditions(previous)
+        bump_post_version(getattr(instance, 'post_id', instance.pk))
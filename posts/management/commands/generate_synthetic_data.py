@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.synthetic import SCALES, Scale, generate_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk load a reproducible synthetic dataset: users, posts with rich HTML and images, '
+        'deep comment threads and skewed reactions'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale',
+            choices=sorted(SCALES),
+            default='small',
+            help='Preset size (default: small); the options below override parts of it',
+        )
+        parser.add_argument('--users', type=int, help='Number of users')
+        parser.add_argument('--posts', type=int, help='Number of posts')
+        parser.add_argument('--comments-per-post', type=int, help='Average comments per post')
+        parser.add_argument('--reactions-per-post', type=int, help='Average reactions per post')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Number of records inserted per transaction (default: 5000)',
+        )
+        parser.add_argument('--no-images', action='store_true', help='Create posts without images')
+
+    def handle(self, *args, **options):
+        scale = SCALES[options['scale']]._replace(**{
+            field: options[field] for field in Scale._fields if options[field] is not None
+        })
+        self.stdout.write(
+            f'Generating {scale.posts} posts by {scale.users} users '
+            f'(~{scale.comments_per_post} comments and ~{scale.reactions_per_post} reactions per post, seed {options["seed"]})'
+        )
+        started = time.monotonic()
+
+        def progress(counts):
+            rows = counts['posts'] + counts['comments'] + counts['reactions']
+            self.stdout.write(f'{rows} rows ({rows / max(time.monotonic() - started, 1e-9):.0f} rows/s)')
+
+        counts = generate_dataset(
+            scale,
+            seed=options['seed'],
+            batch_size=max(options['batch_size'], 1),
+            with_images=not options['no_images'],
+            progress=progress,
+        )
+        summary = ', '.join(f'{count} {name}' for name, count in counts.items() if count)
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {summary} in {time.monotonic() - started:.1f}s. '
+            'Run rebuild_search_index to make the new posts searchable.'
+        ))
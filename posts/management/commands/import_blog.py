@@ -0,0 +1,113 @@
+import json
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.bulk_import import BlogImporter, InvalidRecord
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk load posts (with images), comments and reactions from a JSON Lines file, '
+        'one transaction per chunk, resuming from a checkpoint after an interruption'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='JSON Lines file, e.g. the output of export_blog')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Number of lines imported per transaction (default: 2000)',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Progress file used to resume (default: <path>.checkpoint)',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore an existing checkpoint and start from the first line',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        checkpoint_path = options['checkpoint'] or f'{path}.checkpoint'
+        batch_size = max(options['batch_size'], 1)
+
+        state = {'line': 0, 'pending_parents': {}, 'imported_posts': []}
+        if os.path.exists(checkpoint_path) and not options['restart']:
+            with open(checkpoint_path) as f:
+                state = json.load(f)
+            if state.get('finished'):
+                self.stdout.write(self.style.SUCCESS(f'{path} was already imported (remove {checkpoint_path} to redo).'))
+                return
+            self.stdout.write(f'Resuming after line {state["line"]}')
+
+        importer = BlogImporter(
+            {int(k): v for k, v in state['pending_parents'].items()}, state.get('imported_posts', []),
+            state.get('user_ids', {}),
+        )
+        line_number = state['line']
+        started = time.monotonic()
+        rows = 0
+
+        try:
+            source = open(path)
+        except OSError as e:
+            raise CommandError(f'Cannot read {path}: {e}')
+        with source:
+            lines = islice(source, line_number, None)
+            while True:
+                chunk = list(islice(lines, batch_size))
+                if not chunk:
+                    break
+                records = []
+                for offset, line in enumerate(chunk, start=line_number + 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError as e:
+                        raise CommandError(f'Line {offset}: invalid JSON ({e})')
+                try:
+                    importer.import_chunk(records)
+                except InvalidRecord as e:
+                    raise CommandError(f'Lines {line_number + 1}-{line_number + len(chunk)}: {e}')
+
+                line_number += len(chunk)
+                rows += len(records)
+                self.save_checkpoint(checkpoint_path, line_number, importer)
+                rate = rows / max(time.monotonic() - started, 1e-9)
+                self.stdout.write(f'Line {line_number}: {self.summary(importer.counts)} ({rate:.0f} rows/s)')
+
+        self.stdout.write('Refreshing reaction counters...')
+        importer.finish()
+        self.save_checkpoint(checkpoint_path, line_number, importer, finished=True)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {rows} row(s) in {elapsed:.1f}s: {self.summary(importer.counts)}. '
+            'Run generate_renditions and rebuild_search_index to process the new posts.'
+        ))
+
+    def save_checkpoint(self, checkpoint_path, line, importer, finished=False):
+        temporary = f'{checkpoint_path}.tmp'
+        state = {
+            'line': line,
+            'pending_parents': importer.pending_parents,
+            # Comments and reactions further down the file may refer to any of these
+            'imported_posts': sorted(importer.imported_posts),
+            # finish() rebuilds the stats of these users
+            'user_ids': importer.user_ids,
+            'finished': finished,
+        }
+        with open(temporary, 'w') as f:
+            json.dump(state, f)
+        # Replace atomically so an interruption never leaves a half-written checkpoint
+        os.replace(temporary, checkpoint_path)
+
+    def summary(self, counts):
+        return ', '.join(f'{count} {name}' for name, count in counts.items() if count) or 'nothing new'
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import BlogPost, SearchDocument, SearchPosting
+from posts.search import index_post
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for all blog posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete the whole index before rebuilding (also drops entries of missing posts)',
+        )
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            SearchPosting.objects.all().delete()
+            SearchDocument.objects.all().delete()
+
+        indexed = 0
+        for post in BlogPost.objects.only('id', 'title', 'content', 'plain_text').iterator(chunk_size=200):
+            index_post(post)
+            indexed += 1
+            if indexed % 500 == 0:
+                self.stdout.write(f'Indexed {indexed} posts...')
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} post(s).'))
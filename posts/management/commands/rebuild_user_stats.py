@@ -0,0 +1,32 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from posts.models import UserStats
+
+
+class Command(BaseCommand):
+    help = 'Recompute every user\'s post/comment counts, likes received and last activity'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of users recomputed per round of queries (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        rebuilt = 0
+        last_pk = 0
+        while True:
+            # Seek by primary key so each batch is a cheap range scan
+            user_ids = list(User.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not user_ids:
+                break
+            UserStats.objects.rebuild(user_ids)
+            rebuilt += len(user_ids)
+            last_pk = user_ids[-1]
+            self.stdout.write(f'Rebuilt stats for {rebuilt} users...')
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt stats for {rebuilt} user(s).'))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import BlogPost, UserStats
+from posts.reactions import recount_reactions
+
+
+class Command(BaseCommand):
+    help = 'Recompute BlogPost like/dislike counters from LikeDislike rows and report drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report drifted counters, do not write the corrected values',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of posts to update per query (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        drifted = recount_reactions()
+
+        for post, stored_likes, stored_dislikes in drifted:
+            self.stdout.write(
+                f'Post {post.pk} "{post.title}": '
+                f'likes {stored_likes} -> {post.likes_count}, '
+                f'dislikes {stored_dislikes} -> {post.dislikes_count}'
+            )
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('All reaction counters are in sync.'))
+            return
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(
+                f'{len(drifted)} post(s) have drifted counters (dry run, nothing written).'
+            ))
+            return
+
+        with transaction.atomic():
+            BlogPost.objects.bulk_update(
+                [post for post, _, _ in drifted],
+                ['likes_count', 'dislikes_count'],
+                batch_size=options['batch_size'],
+            )
+            # Likes received are summed from the counters, so refresh the authors' stats too
+            UserStats.objects.rebuild({post.author_id for post, _, _ in drifted})
+        self.stdout.write(self.style.SUCCESS(f'Fixed reaction counters on {len(drifted)} post(s).'))
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.caching import bump_post_versions
+from posts.models import BlogPost
+from posts.rendering import RENDERER_VERSION, generate_content_renditions
+
+
+class Command(BaseCommand):
+    help = (
+        'Compile the content of existing blog posts into rendered_html with the current renderer, '
+        'and resize the uploads embedded in it (run after migrating and whenever RENDERER_VERSION changes)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Number of posts to load and update per batch (default: 200)',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Render every post, not only those rendered by an older renderer',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = BlogPost.objects.only('id', 'content').order_by('pk')
+        if not options['all']:
+            queryset = queryset.exclude(renderer_version=RENDERER_VERSION)
+
+        rendered = 0
+        pending = {}
+        last_pk = 0
+        while True:
+            # Seek by primary key so each batch is a cheap range scan
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            for post in batch:
+                post.update_rendered_html()
+                if post.pending_content_images:
+                    pending[post.pk] = post.pending_content_images
+            with transaction.atomic():
+                BlogPost.objects.bulk_update(batch, BlogPost.RENDERED_FIELDS)
+            # Bulk updates send no signals, so invalidate cached pages explicitly
+            bump_post_versions([post.pk for post in batch])
+            rendered += len(batch)
+            last_pk = batch[-1].pk
+            self.stdout.write(f'Rendered {rendered} posts...')
+
+        for count, (post_id, names) in enumerate(pending.items(), 1):
+            # Renders the post again once its images have renditions
+            generate_content_renditions(post_id, names)
+            self.stdout.write(f'Resized embedded images of {count}/{len(pending)} posts...')
+
+        self.stdout.write(self.style.SUCCESS(f'Rendered {rendered} post(s) with renderer version {RENDERER_VERSION}.'))
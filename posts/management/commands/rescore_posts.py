@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.ranking import rescore_recent
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the hot and top scores of recent posts so the hot feed decays with time, and drop '
+        'posts that left the ranking windows. Run it periodically, or with --loop next to the app.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of posts rescored per round of queries (default: 500)',
+        )
+        parser.add_argument('--loop', action='store_true', help='Keep rescoring')
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=300.0,
+            help='Seconds between runs when looping (default: 300)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            rescored = rescore_recent(
+                options['batch_size'],
+                progress=lambda done: self.stdout.write(f'Rescored {done} posts...'),
+            )
+            self.stdout.write(self.style.SUCCESS(f'Rescored {rescored} recent post(s).'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,44 @@
+import sqlite3
+import time
+from contextlib import closing
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from posts.routers import replica_aliases
+
+
+class Command(BaseCommand):
+    help = (
+        'Local development only: copy the SQLite primary database into the SQLite replica files, '
+        'standing in for replication. With --loop and --delay the replicas trail the primary, '
+        'which shows how ReplicaRouter handles lag.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep copying')
+        parser.add_argument(
+            '--delay',
+            type=float,
+            default=5.0,
+            help='Seconds between copies when looping, i.e. the simulated lag (default: 5)',
+        )
+
+    def handle(self, *args, **options):
+        aliases = replica_aliases()
+        if not aliases:
+            raise CommandError('No replicas configured (POSTS_REPLICA_DATABASES).')
+        databases = [connections[alias].settings_dict for alias in [DEFAULT_DB_ALIAS] + aliases]
+        if any(database['ENGINE'] != 'django.db.backends.sqlite3' for database in databases):
+            raise CommandError('sync_replica only copies SQLite databases; use real replication elsewhere.')
+
+        while True:
+            with closing(sqlite3.connect(databases[0]['NAME'])) as primary:
+                for alias, database in zip(aliases, databases[1:]):
+                    with closing(sqlite3.connect(database['NAME'])) as replica:
+                        # The backup API takes a consistent snapshot even while the app is writing
+                        primary.backup(replica)
+                    self.stdout.write(f'Copied the primary to {alias}')
+            if not options['loop']:
+                break
+            time.sleep(options['delay'])
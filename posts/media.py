@@ -0,0 +1,110 @@
+"""
+Reference counting for content-addressed images (see posts.storage).
+
+MediaFile rows count how many image fields point at each stored file; the
+file and its renditions are deleted only when the last reference goes
+away. posts.signals takes and releases references as posts and images
+are saved and deleted; rows written with bulk_create send no signals, so
+dedupe_media and the bulk importer recount them with rebuild_references().
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import BlogPost, BlogPostImage, MediaFile
+from .renditions import delete_source_renditions
+from .storage import CONTENT_ROOT, image_storage, is_content_addressed
+
+IMAGE_MODELS = (BlogPost, BlogPostImage)
+
+
+def acquire(name, content=None):
+    """
+    Record one more image field pointing at ``name``. The storage hands out
+    an already stored file without taking a reference, so the last one may
+    have been released and the file deleted before this runs; the file is
+    then stored again from ``content`` (FileNotFoundError without it).
+    """
+    if not is_content_addressed(name):
+        return
+    storage = image_storage()
+    with transaction.atomic():
+        media_file, created = MediaFile.objects.select_for_update().get_or_create(
+            name=name, defaults={'ref_count': 1, 'size': _size(name)},
+        )
+        if not created:
+            MediaFile.objects.filter(pk=media_file.pk).update(ref_count=F('ref_count') + 1)
+        # Checked under the row lock, which delete_if_unreferenced holds while deleting the file
+        if not storage.exists(name):
+            if content is None:
+                raise FileNotFoundError(f'{name} was deleted before it could be referenced')
+            storage.save(name, content)
+            MediaFile.objects.filter(pk=media_file.pk).update(size=_size(name))
+
+
+def release(name):
+    """Drop one reference to ``name``; the file is deleted after commit if it was the last one"""
+    if not is_content_addressed(name):
+        return
+    updated = MediaFile.objects.filter(name=name, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+    if updated:
+        transaction.on_commit(lambda: delete_if_unreferenced(name))
+
+
+def delete_if_unreferenced(name):
+    with transaction.atomic():
+        # Re-checked under a lock: the file may have been referenced again since release()
+        media_file = MediaFile.objects.select_for_update().filter(name=name, ref_count=0).first()
+        if media_file is None:
+            return
+        media_file.delete()
+        # Deleted while the row is still locked, so a concurrent acquire() sees the file gone and stores it again
+        image_storage().delete(name)
+        delete_source_renditions(name)
+
+
+def rebuild_references(names=None):
+    """
+    Set the MediaFile counts of ``names`` (default: every content-addressed
+    file) to the number of image fields using them, creating missing rows
+    and deleting files left without references. Returns the number of
+    counts changed and the number of files that were unreferenced.
+    """
+    references = Counter()
+    for model in IMAGE_MODELS:
+        rows = model.objects.filter(image__startswith=CONTENT_ROOT + '/')
+        if names is not None:
+            rows = rows.filter(image__in=names)
+        for row in rows.values('image').annotate(total=Count('pk')).order_by().iterator(chunk_size=2000):
+            references[row['image']] += row['total']
+
+    storage = image_storage()
+    with transaction.atomic():
+        media_files = MediaFile.objects.select_for_update().only('id', 'name', 'ref_count')
+        if names is not None:
+            media_files = media_files.filter(name__in=names)
+        known = {media_file.name: media_file for media_file in media_files}
+        stale = []
+        for name, media_file in known.items():
+            if media_file.ref_count != references.get(name, 0):
+                media_file.ref_count = references.get(name, 0)
+                stale.append(media_file)
+        MediaFile.objects.bulk_update(stale, ['ref_count'], batch_size=500)
+        MediaFile.objects.bulk_create([
+            MediaFile(name=name, ref_count=count, size=storage.size(name) if storage.exists(name) else 0)
+            for name, count in references.items()
+            if name not in known and is_content_addressed(name)
+        ], batch_size=500)
+        unreferenced = [name for name, media_file in known.items() if media_file.ref_count == 0]
+
+    for name in unreferenced:
+        delete_if_unreferenced(name)
+    return len(stale), len(unreferenced)
+
+
+def _size(name):
+    try:
+        return image_storage().size(name)
+    except OSError:
+        return 0
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:03
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_reaction_counts(apps, schema_editor):
+    BlogPost = apps.get_model('posts', 'BlogPost')
+    posts = BlogPost.objects.annotate(
+        actual_likes=Count('likes', filter=Q(likes__is_like=True)),
+        actual_dislikes=Count('likes', filter=Q(likes__is_like=False)),
+    )
+    batch = []
+    for post in posts.iterator(chunk_size=2000):
+        post.likes_count = post.actual_likes
+        post.dislikes_count = post.actual_dislikes
+        batch.append(post)
+        if len(batch) >= 500:
+            BlogPost.objects.bulk_update(batch, ['likes_count', 'dislikes_count'])
+            batch = []
+    if batch:
+        BlogPost.objects.bulk_update(batch, ['likes_count', 'dislikes_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_alter_blogpost_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blogpost',
+            name='dislikes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='blogpost',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_reaction_counts, migrations.RunPython.noop),
+    ]
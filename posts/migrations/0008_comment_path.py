@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:05
+
+from django.db import migrations, models
+
+
+PATH_SEGMENT_WIDTH = 10
+
+
+def backfill_comment_paths(apps, schema_editor):
+    Comment = apps.get_model('posts', 'Comment')
+    # Parents are always created before their replies, so id order visits a parent first
+    paths = {}
+    batch = []
+    for comment in Comment.objects.order_by('id').only('id', 'parent_id').iterator(chunk_size=2000):
+        segment = str(comment.pk).zfill(PATH_SEGMENT_WIDTH) + '/'
+        comment.path = paths.get(comment.parent_id, '') + segment
+        paths[comment.pk] = comment.path
+        batch.append(comment)
+        if len(batch) >= 500:
+            Comment.objects.bulk_update(batch, ['path'])
+            batch = []
+    if batch:
+        Comment.objects.bulk_update(batch, ['path'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_blogpost_reaction_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_comment_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:23
+
+import posts.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_reactionevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='blogpost',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=posts.storage.image_storage, upload_to='blog_images/'),
+        ),
+        migrations.AlterField(
+            model_name='blogpostimage',
+            name='image',
+            field=models.ImageField(storage=posts.storage.image_storage, upload_to='blog_images/additional/'),
+        ),
+    ]
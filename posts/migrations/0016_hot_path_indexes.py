@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_userstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='blogpost',
+            index=models.Index(fields=['author', '-created_at', '-id'], name='blogpost_author_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='blogpostimage',
+            index=models.Index(fields=['post', 'order', 'uploaded_at'], name='blogpostimage_post_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('active', True)), fields=['post', 'path'], name='comment_thread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['author', '-created_at'], name='comment_author_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='likedislike',
+            index=models.Index(fields=['post', 'is_like'], name='likedislike_post_kind_idx'),
+        ),
+    ]
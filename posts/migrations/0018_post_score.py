@@ -0,0 +1,26 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_replica_heartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostScore',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='posts.blogpost')),
+                ('created_at', models.DateTimeField()),
+                ('hot', models.FloatField(blank=True, null=True)),
+                ('top', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('hot__isnull', False)), fields=['-hot', '-post'], name='postscore_hot_idx'), models.Index(condition=models.Q(('top__isnull', False)), fields=['-top', '-post'], name='postscore_top_idx'), models.Index(fields=['created_at'], name='postscore_created_idx')],
+            },
+        ),
+    ]
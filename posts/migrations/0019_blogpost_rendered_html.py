@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_post_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blogpost',
+            name='rendered_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='blogpost',
+            name='renderer_version',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+    ]
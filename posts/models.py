@@ -1,37 +1,146 @@
 from django.db import models
+from django.db.models import Case, Count, F, Max, OuterRef, Prefetch, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.utils import timezone
 from ckeditor_uploader.fields import RichTextUploadingField
 
+from .storage import image_storage
+from .text import html_to_text, make_excerpt, reading_time
+
+class BlogPostQuerySet(models.QuerySet):
+    def with_card_data(self):
+        """
+        Load everything a post card renders in a fixed number of queries:
+        the author, the ordered additional images and the comment count.
+        Reaction counts come from the denormalized counter columns.
+        """
+        return self.select_related('author').prefetch_related(
+            Prefetch(
+                'additional_images',
+                # Leading with post_id lets one index range serve every post in the page
+                queryset=BlogPostImage.objects.order_by('post_id', 'order', 'uploaded_at'),
+            )
+        ).with_comment_count().defer('content', 'plain_text', 'rendered_html')
+
+    def with_comment_count(self):
+        """
+        Annotate ``comment_count``. A correlated subquery rather than a JOIN
+        and GROUP BY, so the posts can still be read in index order.
+        """
+        comments = (
+            Comment.objects.filter(post=OuterRef('pk'))
+            .order_by().values('post').annotate(total=Count('pk')).values('total')
+        )
+        return self.annotate(comment_count=Coalesce(Subquery(comments), Value(0)))
+
+
 class BlogPost(models.Model):
     title = models.CharField(max_length=200)
     content = RichTextUploadingField(blank=True, null=True)
-    image = models.ImageField(upload_to='blog_images/', null=True, blank=True)  # Keep for backward compatibility
+    image = models.ImageField(upload_to='blog_images/', storage=image_storage, null=True, blank=True)  # Keep for backward compatibility
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)  # See posts.renditions
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
+    # Denormalized reaction counters, maintained alongside LikeDislike writes
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    dislikes_count = models.PositiveIntegerField(default=0, editable=False)
+    # Derived from content on save, so templates never process the HTML per request
+    plain_text = models.TextField(blank=True, default='', editable=False)
+    excerpt = models.CharField(max_length=500, blank=True, default='', editable=False)
+    word_count = models.PositiveIntegerField(default=0, editable=False)
+    reading_time = models.PositiveSmallIntegerField(default=0, editable=False, help_text="Estimated minutes to read")
+    # Sanitized display HTML compiled from content on save (see posts.rendering)
+    rendered_html = models.TextField(blank=True, default='', editable=False)
+    renderer_version = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    DERIVED_TEXT_FIELDS = ('plain_text', 'excerpt', 'word_count', 'reading_time')
+    RENDERED_FIELDS = ('rendered_html', 'renderer_version')
+
+    objects = BlogPostQuerySet.as_manager()
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination seeks on (created_at, id), see posts.pagination
+            models.Index(fields=['-created_at', '-id'], name='blogpost_feed_idx'),
+            # An author's posts, newest first (my_posts, the profile page)
+            models.Index(fields=['author', '-created_at', '-id'], name='blogpost_author_feed_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        content_loaded = 'content' in self.__dict__
+        if content_loaded and (update_fields is None or 'content' in update_fields):
+            self.update_derived_text()
+            self.update_rendered_html()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, *self.DERIVED_TEXT_FIELDS, *self.RENDERED_FIELDS}
+        super().save(*args, **kwargs)
+
+    def update_derived_text(self):
+        """Recompute plain text, excerpt, word count and reading time from content"""
+        self.plain_text = html_to_text(self.content)
+        self.excerpt = make_excerpt(self.plain_text)
+        self.word_count = len(self.plain_text.split())
+        self.reading_time = reading_time(self.word_count)
+
+    def update_rendered_html(self):
+        """
+        Compile content into rendered_html. Embedded uploads that still need
+        renditions are kept in ``pending_content_images`` for posts.signals.
+        """
+        # posts.rendering uses posts.renditions, which imports this module
+        from .rendering import RENDERER_VERSION, render_html
+
+        self.rendered_html, self.pending_content_images = render_html(self.content)
+        self.renderer_version = RENDERER_VERSION
+
+    def get_content_html(self):
+        """The HTML to display: rendered_html, or content compiled now if the current renderer has not stored it yet"""
+        from .rendering import RENDERER_VERSION, render_html
+
+        if self.renderer_version == RENDERER_VERSION:
+            return self.rendered_html
+        return render_html(self.content)[0]
+
     def get_absolute_url(self):
         return reverse('post_detail', kwargs={'pk': self.pk})
 
     def total_likes(self):
-        return self.likes.filter(is_like=True).count()
+        return self.likes_count
 
     def total_dislikes(self):
-        return self.likes.filter(is_like=False).count()
+        return self.dislikes_count
+
+    def adjust_reaction_counts(self, likes=0, dislikes=0):
+        """Atomically shift the stored reaction counters by the given deltas"""
+        if not likes and not dislikes:
+            return
+        BlogPost.objects.filter(pk=self.pk).update(
+            likes_count=F('likes_count') + likes,
+            dislikes_count=F('dislikes_count') + dislikes,
+        )
+        self.refresh_from_db(fields=['likes_count', 'dislikes_count'])
+        if likes:
+            UserStats.objects.adjust(self.author_id, likes=likes)
+
+    def total_comments(self):
+        if hasattr(self, 'comment_count'):
+            return self.comment_count
+        return self.comments.count()
 
     def get_all_images(self):
         """Return all images associated with this post (including the main image and additional images)"""
         images = []
         if self.image:
             images.append(self.image)
+        # .all() is served from the prefetch cache when with_card_data() was used
         images.extend([img.image for img in self.additional_images.all()])
         return images
 
@@ -39,22 +148,28 @@ class BlogPost(models.Model):
         """Return the primary image for display (first available image)"""
         if self.image:
             return self.image
-        additional_images = self.additional_images.all()
-        if additional_images.exists():
-            return additional_images.first().image
-        return None
+        if 'additional_images' in getattr(self, '_prefetched_objects_cache', {}):
+            additional_images = list(self.additional_images.all())
+            return additional_images[0].image if additional_images else None
+        first_image = self.additional_images.first()
+        return first_image.image if first_image else None
 
 
 class BlogPostImage(models.Model):
     """Model for additional images in a blog post"""
     post = models.ForeignKey(BlogPost, related_name='additional_images', on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='blog_images/additional/')
+    image = models.ImageField(upload_to='blog_images/additional/', storage=image_storage)
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)  # See posts.renditions
     caption = models.CharField(max_length=200, blank=True, help_text="Optional caption for this image")
     order = models.PositiveIntegerField(default=0, help_text="Order in which this image should appear")
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['order', 'uploaded_at']
+        indexes = [
+            # A post's images in display order, also for prefetches over several posts
+            models.Index(fields=['post', 'order', 'uploaded_at'], name='blogpostimage_post_order_idx'),
+        ]
         verbose_name = "Additional Blog Image"
         verbose_name_plural = "Additional Blog Images"
 
@@ -62,20 +177,66 @@ class BlogPostImage(models.Model):
         return f"Image for {self.post.title} (Order: {self.order})"
 
 
+class CommentQuerySet(models.QuerySet):
+    def subtree(self, comment):
+        """Return ``comment`` and all of its descendants, in thread order, via a range scan on path"""
+        return self.filter(post_id=comment.post_id, path__startswith=comment.path).order_by('path')
+
+
 class Comment(models.Model):
+    # Each materialized path segment is the zero-padded primary key plus a separator,
+    # so ordering by path yields depth-first thread order.
+    PATH_SEGMENT_WIDTH = 10
+    PATH_SEPARATOR = '/'
+    MAX_DEPTH = 255 // (PATH_SEGMENT_WIDTH + 1) - 1
+
     post = models.ForeignKey(BlogPost, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
     created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
     active = models.BooleanField(default=True)
+    path = models.CharField(max_length=255, blank=True, default='', db_index=True, editable=False)
+
+    objects = CommentQuerySet.as_manager()
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # Visible comments of a post in thread order (see posts.comments); hidden ones are left out
+            models.Index(fields=['post', 'path'], condition=models.Q(active=True), name='comment_thread_idx'),
+            # A user's latest comments (profile page)
+            models.Index(fields=['author', '-created_at'], name='comment_author_recent_idx'),
+        ]
 
     def __str__(self):
         return f'Comment by {self.author.username} on {self.post.title}'
 
+    def save(self, *args, **kwargs):
+        if self.parent_id and self.parent.depth >= self.MAX_DEPTH:
+            # Keep the path within bounds by attaching overly deep replies to the deepest allowed ancestor
+            self.parent = self.parent.parent
+        super().save(*args, **kwargs)
+        if not self.path:
+            self.path = self.build_path()
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+
+    @classmethod
+    def path_segment(cls, pk):
+        return str(pk).zfill(cls.PATH_SEGMENT_WIDTH) + cls.PATH_SEPARATOR
+
+    def build_path(self):
+        segment = self.path_segment(self.pk)
+        if self.parent_id:
+            return self.parent.path + segment
+        return segment
+
+    @property
+    def depth(self):
+        """Nesting level of this comment, 0 for top-level comments"""
+        return max(len(self.path) // (self.PATH_SEGMENT_WIDTH + 1) - 1, 0)
+
     def get_replies(self):
         return Comment.objects.filter(parent=self, active=True)
 
@@ -88,6 +249,242 @@ class LikeDislike(models.Model):
 
     class Meta:
         unique_together = ('user', 'post')
+        indexes = [
+            # Per-post like/dislike counts (reaction counter refreshes and recounts)
+            models.Index(fields=['post', 'is_like'], name='likedislike_post_kind_idx'),
+        ]
 
     def __str__(self):
         return f"{'Like' if self.is_like else 'Dislike'} by {self.user.username} on {self.post.title}"
+
+
+class ReactionEvent(models.Model):
+    """
+    Append-only buffer of reaction clicks used when POSTS_REACTION_MODE is
+    'buffered'. Each row records the user's reaction *after* the click
+    (None when it was removed); see posts.reactions.apply_reaction_events.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    post = models.ForeignKey(BlogPost, on_delete=models.CASCADE, related_name='reaction_events')
+    is_like = models.BooleanField(null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'post'], name='reactionevent_user_post_idx'),
+        ]
+
+    def __str__(self):
+        state = {True: 'like', False: 'dislike', None: 'no reaction'}[self.is_like]
+        return f"{self.user.username} -> {state} on {self.post.title}"
+
+
+class SearchDocument(models.Model):
+    """Per-post statistics for the full-text index (see posts.search)"""
+    post = models.OneToOneField(BlogPost, on_delete=models.CASCADE, related_name='search_document')
+    length = models.PositiveIntegerField(default=0, help_text="Number of indexed tokens in the post")
+    indexed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Search document for {self.post.title}"
+
+
+class SearchPosting(models.Model):
+    """Inverted index entry: how often a term occurs in a post"""
+    term = models.CharField(max_length=64)
+    post = models.ForeignKey(BlogPost, on_delete=models.CASCADE, related_name='search_postings')
+    term_frequency = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('term', 'post')
+
+    def __str__(self):
+        return f"{self.term} in {self.post_id} ({self.term_frequency})"
+
+
+class MediaFile(models.Model):
+    """A content-addressed image file and how many image fields reference it (see posts.media)"""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} reference{'s' if self.ref_count != 1 else ''})"
+
+
+class UserStatsQuerySet(models.QuerySet):
+    def adjust(self, user_id, posts=0, comments=0, likes=0, followers=0, activity=None):
+        """
+        Shift a user's counters by the given deltas in one UPDATE. Users
+        without a stats row are skipped: UserStats.for_user() computes the
+        row from scratch, change included, the first time it is needed.
+        """
+        deltas = (
+            ('post_count', posts), ('comment_count', comments), ('likes_received', likes),
+            ('follower_count', followers),
+        )
+        updates = {field: F(field) + delta for field, delta in deltas if delta}
+        if activity is not None:
+            updates['last_activity'] = Greatest(Coalesce('last_activity', Value(activity)), Value(activity))
+        if updates:
+            self.filter(user_id=user_id).update(**updates)
+
+    def adjust_likes(self, deltas):
+        """Apply {user_id: likes delta} to many users in one UPDATE"""
+        deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+        if deltas:
+            self.filter(user_id__in=deltas).update(likes_received=F('likes_received') + Case(
+                *[When(user_id=user_id, then=Value(delta)) for user_id, delta in deltas.items()],
+                default=Value(0),
+            ))
+
+    def rebuild(self, user_ids):
+        """Recompute the stats of ``user_ids`` from posts and comments"""
+        user_ids = list(user_ids)
+        posts = {
+            row['author']: row
+            for row in BlogPost.objects.filter(author__in=user_ids).order_by().values('author').annotate(
+                total=Count('pk'), likes=Sum('likes_count'), latest=Max('created_at'),
+            )
+        }
+        comments = {
+            row['author']: row
+            for row in Comment.objects.filter(author__in=user_ids).order_by().values('author').annotate(
+                total=Count('pk'), latest=Max('created_at'),
+            )
+        }
+        followers = dict(
+            Follow.objects.filter(author__in=user_ids).order_by().values('author').annotate(total=Count('pk'))
+            .values_list('author', 'total')
+        )
+        stats = []
+        for user_id in user_ids:
+            post_row = posts.get(user_id, {})
+            comment_row = comments.get(user_id, {})
+            activity = [moment for moment in (post_row.get('latest'), comment_row.get('latest')) if moment]
+            stats.append(UserStats(
+                user_id=user_id,
+                post_count=post_row.get('total', 0),
+                comment_count=comment_row.get('total', 0),
+                likes_received=post_row.get('likes') or 0,
+                follower_count=followers.get(user_id, 0),
+                last_activity=max(activity) if activity else None,
+            ))
+        return self.bulk_create(
+            stats,
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['post_count', 'comment_count', 'likes_received', 'follower_count', 'last_activity'],
+        )
+
+
+class UserStats(models.Model):
+    """
+    Denormalized per-user totals for the profile page, adjusted as posts,
+    comments, reactions and follows change (see posts.signals and
+    posts.timeline). Last activity is the
+    user's latest post or comment. ``rebuild_user_stats`` repairs drift.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='blog_stats')
+    post_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    likes_received = models.PositiveIntegerField(default=0)
+    follower_count = models.PositiveIntegerField(default=0)
+    last_activity = models.DateTimeField(null=True, blank=True)
+
+    objects = UserStatsQuerySet.as_manager()
+
+    class Meta:
+        verbose_name_plural = "User stats"
+
+    def __str__(self):
+        return f"Stats for {self.user.username}"
+
+    @classmethod
+    def for_user(cls, user):
+        """The user's stats, computing them on first access"""
+        stats = cls.objects.filter(user=user).first()
+        if stats is None:
+            stats = cls.objects.rebuild([user.pk])[0]
+        return stats
+
+
+class ReplicaHeartbeat(models.Model):
+    """
+    A single row whose timestamp check_replicas moves forward on the primary
+    and reads back from each replica; the difference is the replica's lag
+    (see posts.routers).
+    """
+    beat_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Heartbeat at {self.beat_at:%Y-%m-%d %H:%M:%S}"
+
+
+class PostScore(models.Model):
+    """
+    Materialized ranking of a recent post (see posts.ranking): ``hot`` decays
+    with age and ``top`` is the post's points, each set only while the post
+    is inside that feed's window. Posts outside both windows have no row.
+    """
+    post = models.OneToOneField(BlogPost, on_delete=models.CASCADE, primary_key=True, related_name='score')
+    # Copied from the post so windows can be applied without a join
+    created_at = models.DateTimeField()
+    hot = models.FloatField(null=True, blank=True)
+    top = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Each feed reads its index in order (posts.pagination seeks on (score, post))
+            models.Index(fields=['-hot', '-post'], condition=models.Q(hot__isnull=False), name='postscore_hot_idx'),
+            models.Index(fields=['-top', '-post'], condition=models.Q(top__isnull=False), name='postscore_top_idx'),
+            models.Index(fields=['created_at'], name='postscore_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Score of post {self.post_id}"
+
+
+class Follow(models.Model):
+    follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='followers')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            # Also serves "whom does this user follow"
+            models.UniqueConstraint(fields=['follower', 'author'], name='follow_unique'),
+            models.CheckConstraint(condition=~models.Q(follower=F('author')), name='follow_not_self'),
+        ]
+        indexes = [
+            # Fan-out reads an author's followers in id order (posts.timeline)
+            models.Index(fields=['author', 'id'], name='follow_author_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.follower.username} follows {self.author.username}"
+
+
+class TimelineEntry(models.Model):
+    """
+    A post in a follower's home timeline, written when the post is published
+    (fan-out on write, see posts.timeline). Removed with the post by CASCADE.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    post = models.ForeignKey(BlogPost, on_delete=models.CASCADE, related_name='timeline_entries')
+    # Copied from the post so the timeline is read in index order without a join
+    created_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name_plural = "Timeline entries"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='timelineentry_unique'),
+        ]
+        indexes = [
+            # The home feed seeks on (created_at, post), see posts.timeline
+            models.Index(fields=['user', '-created_at', '-post'], name='timelineentry_feed_idx'),
+        ]
+
+    def __str__(self):
+        return f"Post {self.post_id} in the timeline of user {self.user_id}"
@@ -0,0 +1,164 @@
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+
+from .caching import get_feed_version, get_post_version, get_ranking_version, version_timestamp
+
+PAGE_KEY = 'page:{}'
+STATS_KEY = 'page-cache:{}'
+STATS = ('hits', 'misses', 'not_modified', 'bypassed')
+
+
+def record(stat):
+    key = STATS_KEY.format(stat)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The counter was evicted between add() and incr()
+        cache.set(key, 1, None)
+
+
+def get_stats():
+    values = cache.get_many([STATS_KEY.format(stat) for stat in STATS])
+    stats = {stat: values.get(STATS_KEY.format(stat), 0) for stat in STATS}
+    served = stats['hits'] + stats['misses'] + stats['not_modified']
+    stats['hit_ratio'] = round((stats['hits'] + stats['not_modified']) / served, 4) if served else None
+    return stats
+
+
+def _is_cacheable(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if not getattr(settings, 'POSTS_PAGE_CACHE_ENABLED', True):
+        return False
+    if request.user.is_authenticated:
+        return False
+    # Flash messages are per visitor, so a page showing them must not be shared
+    return not get_messages(request)
+
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return etag in parse_etags(if_none_match) or if_none_match.strip() == '*'
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(last_modified) <= if_modified_since
+
+
+def _add_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'public, max-age=0, must-revalidate'
+    patch_vary_headers(response, ['Cookie'])
+    return response
+
+
+class _PageState:
+    def __init__(self, digest, etag, last_modified):
+        self.digest = digest
+        self.etag = etag
+        self.last_modified = last_modified
+        self.response = None
+
+
+def _lookup(request, version_for, args, kwargs):
+    """
+    Decide how to answer ``request`` before the view runs. Returns None to
+    bypass the cache, or a _PageState whose ``response`` is already set
+    for 304s and cache hits.
+    """
+    if not _is_cacheable(request):
+        record('bypassed')
+        return None
+
+    version = version_for(request, *args, **kwargs)
+    digest = hashlib.sha1(f'{request.get_full_path()}|{version}'.encode()).hexdigest()
+    state = _PageState(digest, quote_etag(digest), version_timestamp(version))
+
+    if _not_modified(request, state.etag, state.last_modified):
+        record('not_modified')
+        state.response = _add_validators(HttpResponseNotModified(), state.etag, state.last_modified)
+        return state
+
+    cached = cache.get(PAGE_KEY.format(digest))
+    if cached is not None:
+        record('hits')
+        content, content_type = cached
+        state.response = _add_validators(
+            HttpResponse(content, content_type=content_type), state.etag, state.last_modified
+        )
+        return state
+
+    record('misses')
+    return state
+
+
+def _store(response, state):
+    if hasattr(response, 'render') and callable(response.render):
+        response = response.render()
+    # Never share responses that set cookies (e.g. a fresh CSRF token)
+    if response.status_code == 200 and not response.streaming and not response.cookies:
+        cache.set(
+            PAGE_KEY.format(state.digest),
+            (response.content, response['Content-Type']),
+            getattr(settings, 'POSTS_PAGE_CACHE_TIMEOUT', 600),
+        )
+        _add_validators(response, state.etag, state.last_modified)
+    return response
+
+
+def anonymous_page_cache(version_for):
+    """
+    Cache the full response of a view for anonymous visitors.
+
+    ``version_for(request, *args, **kwargs)`` returns the cache version of
+    the content the page shows (see posts.caching); it changes whenever the
+    post, its comments or its reactions change. The version yields a strong
+    ETag and Last-Modified, so conditional GETs get a 304 without running
+    the view, and cached pages are dropped simply by no longer matching.
+    Works for both sync and async views.
+    """
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                state = await sync_to_async(_lookup)(request, version_for, args, kwargs)
+                if state is None:
+                    return await view_func(request, *args, **kwargs)
+                if state.response is not None:
+                    return state.response
+                response = await view_func(request, *args, **kwargs)
+                return await sync_to_async(_store)(response, state)
+            return async_wrapper
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            state = _lookup(request, version_for, args, kwargs)
+            if state is None:
+                return view_func(request, *args, **kwargs)
+            if state.response is not None:
+                return state.response
+            return _store(view_func(request, *args, **kwargs), state)
+        return wrapper
+    return decorator
+
+
+def feed_version(request, *args, **kwargs):
+    return get_feed_version()
+
+
+def post_version(request, pk, *args, **kwargs):
+    return get_post_version(pk)
+
+
+def ranking_version(request, *args, **kwargs):
+    return get_ranking_version()
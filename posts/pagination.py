@@ -0,0 +1,283 @@
+import base64
+import math
+from collections.abc import Sequence
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+# Yielded by CursorPaginator._page_steps when it needs the total count
+COUNT = object()
+
+
+def encode_cursor(direction, key, pk, number):
+    """``key`` is the serialized sort key of the row the cursor points at (see CursorPaginator)"""
+    raw = f'{direction}|{key}|{pk}|{number}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def cursor_count_key(count_cache_key):
+    """Cache key of the total a CursorPaginator caches under ``count_cache_key``"""
+    return f'cursor-count:{count_cache_key}'
+
+
+def decode_cursor(token, parse_key):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        direction, key, pk, number = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        if direction not in ('n', 'p'):
+            raise ValueError(direction)
+        return direction, parse_key(key), int(pk), max(int(number), 1)
+    except (ValueError, TypeError, UnicodeDecodeError, ValidationError) as e:
+        raise InvalidCursor(token) from e
+
+
+class CursorPage(Sequence):
+    """A page of a CursorPaginator; mirrors the parts of django.core.paginator.Page the templates use"""
+
+    def __init__(self, object_list, paginator, number, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.number = number
+        self._has_next = has_next
+        self._has_previous = has_previous
+        # Taken now so a view may swap object_list for other objects (e.g. posts for their scores)
+        self._bounds = None
+        if object_list:
+            self._bounds = (paginator.cursor_key(object_list[0]), paginator.cursor_key(object_list[-1]))
+
+    def __repr__(self):
+        return f'<CursorPage {self.number}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_cursor(self):
+        if not self._has_next:
+            return None
+        key, pk = self._bounds[1]
+        return encode_cursor('n', key, pk, self.number + 1)
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous:
+            return None
+        key, pk = self._bounds[0]
+        return encode_cursor('p', key, pk, self.number - 1)
+
+
+class CursorPaginator:
+    """
+    Keyset paginator over a queryset ordered by (-key, -pk); the default key
+    matches BlogPost.Meta.ordering. Pages are addressed by opaque cursor
+    tokens, so a deep page costs the same indexed range scan as the first one
+    and no COUNT(*) runs per request; the total used for "Page X of Y" is
+    cached.
+    """
+    LAST = 'last'
+
+    def __init__(self, object_list, per_page, count_cache_key=None, count_timeout=300, key='created_at'):
+        self.key = key
+        self.key_field = object_list.model._meta.get_field(key)
+        self.object_list = object_list.order_by(f'-{key}', '-pk')
+        self.per_page = int(per_page)
+        self.count_cache_key = count_cache_key
+        self.count_timeout = count_timeout
+
+    def cursor_key(self, obj):
+        """(serialized sort key, pk) of ``obj``, as stored in cursors"""
+        return self.key_field.value_to_string(obj), obj.pk
+
+    @cached_property
+    def count(self):
+        if self.count_cache_key is None:
+            return self._total()
+        return cache.get_or_set(self._count_key, self._total, self.count_timeout)
+
+    def _total(self):
+        return self.object_list.count()
+
+    async def acount(self):
+        if 'count' not in self.__dict__:
+            count = None
+            if self.count_cache_key is not None:
+                count = await cache.aget(self._count_key)
+            if count is None:
+                count = await self.object_list.acount()
+                if self.count_cache_key is not None:
+                    await cache.aset(self._count_key, count, self.count_timeout)
+            self.__dict__['count'] = count
+        return self.count
+
+    @property
+    def _count_key(self):
+        return cursor_count_key(self.count_cache_key)
+
+    @cached_property
+    def num_pages(self):
+        return max(math.ceil(self.count / self.per_page), 1)
+
+    def get_page(self, cursor):
+        """Return the page for ``cursor``, falling back to the first page for missing or invalid tokens"""
+        steps = self._page_steps(cursor)
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(self.count if request is COUNT else list(request))
+        except StopIteration as done:
+            return done.value
+
+    async def aget_page(self, cursor):
+        """Async counterpart of get_page using the async ORM"""
+        steps = self._page_steps(cursor)
+        try:
+            request = next(steps)
+            while True:
+                if request is COUNT:
+                    result = await self.acount()
+                else:
+                    result = [row async for row in request]
+                request = steps.send(result)
+        except StopIteration as done:
+            return done.value
+
+    def _page_steps(self, cursor):
+        """
+        Generator doing the paging logic without I/O: it yields querysets
+        (or COUNT) and receives their rows (or the total), so get_page and
+        aget_page share it.
+        """
+        if cursor == self.LAST:
+            return (yield from self._last_page())
+        if cursor:
+            try:
+                direction, value, pk, number = decode_cursor(cursor, self.key_field.to_python)
+            except InvalidCursor:
+                pass
+            else:
+                if direction == 'n':
+                    return (yield from self._page_after(value, pk, number))
+                return (yield from self._page_before(value, pk, number))
+        return (yield from self._page_after(None, None, 1))
+
+    def _seek(self, queryset, bound, descending, tiebreak='pk'):
+        """
+        The first per_page + 1 rows of ``queryset`` in (key, tiebreak) order,
+        past ``bound`` ((key value, tiebreak value), or None to start at the
+        top)
+        """
+        if descending:
+            queryset = queryset.order_by(f'-{self.key}', f'-{tiebreak}')
+        else:
+            queryset = queryset.order_by(self.key, tiebreak)
+        if bound is not None:
+            value, pk = bound
+            lookup = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{self.key}__{lookup}': value}) | Q(**{self.key: value, f'{tiebreak}__{lookup}': pk})
+            )
+        return queryset[:self.per_page + 1]
+
+    def _rows(self, bound, descending):
+        """Rows of a page as _seek selects them; yielded to get_page/aget_page, which read them"""
+        return self._seek(self.object_list, bound, descending)
+
+    def _page_after(self, value, pk, number):
+        rows = yield self._rows(None if value is None else (value, pk), True)
+        if not rows and value is not None:
+            # The cursor points past the end (e.g. posts were deleted); show the last page instead
+            return (yield from self._last_page())
+        has_next = len(rows) > self.per_page
+        return CursorPage(rows[:self.per_page], self, number, has_next, value is not None)
+
+    def _page_before(self, value, pk, number):
+        rows = yield self._rows((value, pk), False)
+        if not rows:
+            return (yield from self._page_after(None, None, 1))
+        has_previous = len(rows) > self.per_page
+        rows = rows[:self.per_page][::-1]
+        if not has_previous:
+            number = 1
+        return CursorPage(rows, self, number, True, has_previous)
+
+    def _last_page(self):
+        yield COUNT
+        # Size the last page like page num_pages of the forward walk, so paging
+        # back from it lands on the same boundaries and numbers
+        size = self.count - (self.num_pages - 1) * self.per_page or self.per_page
+        rows = yield self._rows(None, False)
+        has_previous = len(rows) > size
+        rows = rows[:size][::-1]
+        return CursorPage(rows, self, self.num_pages if has_previous else 1, False, has_previous)
+
+
+def estimated_row_count(model, using='default'):
+    """
+    Row count of ``model``'s table from the database's statistics, without
+    scanning it. Returns None when no estimate is available (e.g. the table
+    was never analyzed).
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    queries = {
+        'postgresql': ('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)', [connection.ops.quote_name(table)]),
+        'mysql': ('SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s', [table]),
+        # Created by ANALYZE; the first number of the stat column is the row count
+        'sqlite': ('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table]),
+    }
+    if connection.vendor not in queries:
+        return None
+    sql, params = queries[connection.vendor]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+    except DatabaseError:
+        # e.g. sqlite_stat1 does not exist before the first ANALYZE
+        return None
+    if row is None or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists over large tables. An unfiltered list is
+    counted from the table statistics and a filtered one only up to
+    COUNT_LIMIT rows, so neither runs a full COUNT(*). Small tables, where
+    statistics are least reliable, are counted exactly.
+    """
+    ESTIMATE_THRESHOLD = 10000
+    COUNT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is None or estimate < self.ESTIMATE_THRESHOLD:
+                return queryset.count()
+            return estimate
+        return queryset[:self.COUNT_LIMIT].count()
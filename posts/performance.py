@@ -0,0 +1,295 @@
+"""
+Per-request performance instrumentation.
+
+Add ``posts.performance.PerformanceMiddleware`` to MIDDLEWARE (after the
+authentication middleware). For every request it records the number of
+queries and the time spent in them, the time spent rendering templates
+and query shapes repeated often enough to suggest an N+1 pattern. The
+figures are sent back in a ``Server-Timing`` header, logged as one JSON
+line on the ``posts.performance`` logger and added to a rolling per-view
+histogram in the cache, which staff can inspect at /stats/performance/.
+
+With ``POSTS_PERFORMANCE_ENABLED = False`` the middleware removes itself
+from the stack at startup and installs no hooks, so it costs nothing.
+"""
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template import base as template_base
+
+logger = logging.getLogger('posts.performance')
+
+# Upper bounds (ms) of the response time histogram; the last bucket is open-ended
+BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500)
+WINDOW_KEY = 'perf:{}:{}:{}'
+VIEWS_KEY = 'perf:{}:views'
+FIELDS = ('requests', 'queries', 'db_ms', 'template_ms', 'n_plus_one') + tuple(f'le_{bound}' for bound in BUCKETS) + ('le_inf',)
+
+_current = ContextVar('posts_performance_metrics', default=None)
+
+_IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+_NUMBER = re.compile(r'\b\d+\b')
+
+
+def query_shape(sql):
+    """The SQL with literals and variable-length IN lists folded, so repeats of one query compare equal"""
+    return _NUMBER.sub('N', _IN_LIST.sub('(%s, ...)', sql))
+
+
+class RequestMetrics:
+    __slots__ = ('started', 'queries', 'db_time', 'template_time', 'template_depth', 'shapes')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.shapes = Counter()
+
+    def n_plus_one_suspects(self):
+        threshold = getattr(settings, 'POSTS_PERFORMANCE_N_PLUS_ONE_THRESHOLD', 5)
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_time += time.perf_counter() - started
+        metrics.queries += 1
+        metrics.shapes[query_shape(sql)] += 1
+
+
+def _watch_connection(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def _timed_render(render):
+    def wrapper(self, context):
+        metrics = _current.get()
+        if metrics is None:
+            return render(self, context)
+        # Only the outermost template is timed; includes and extends render inside it
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - started
+    return wrapper
+
+
+_install_lock = threading.Lock()
+_installed = False
+
+
+def install_hooks():
+    """Hook query execution and template rendering (idempotent; only called when enabled)"""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        connection_created.connect(_watch_connection, dispatch_uid='posts.performance')
+        for connection in connections.all(initialized_only=True):
+            _watch_connection(connection)
+        template_base.Template.render = _timed_render(template_base.Template.render)
+        _installed = True
+
+
+class _Histogram:
+    """
+    Per-process totals, flushed to the shared cache at most every
+    POSTS_PERFORMANCE_FLUSH_SECONDS so a request only updates a dict.
+    Counters live in one-minute windows and are added with cache.incr, so
+    several processes can flush into the same window.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = defaultdict(Counter)
+        self.last_flush = time.monotonic()
+
+    def add(self, view, total_ms, metrics, suspects):
+        bucket = next((f'le_{bound}' for bound in BUCKETS if total_ms <= bound), 'le_inf')
+        with self.lock:
+            counter = self.pending[view]
+            counter['requests'] += 1
+            counter['queries'] += metrics.queries
+            counter['db_ms'] += round(metrics.db_time * 1000)
+            counter['template_ms'] += round(metrics.template_time * 1000)
+            counter['n_plus_one'] += bool(suspects)
+            counter[bucket] += 1
+            due = time.monotonic() - self.last_flush >= getattr(settings, 'POSTS_PERFORMANCE_FLUSH_SECONDS', 10)
+            if not due:
+                return
+            pending, self.pending = self.pending, defaultdict(Counter)
+            self.last_flush = time.monotonic()
+        flush(pending)
+
+
+def _window(timestamp=None):
+    return int((time.time() if timestamp is None else timestamp) // 60)
+
+
+def flush(pending):
+    window = _window()
+    timeout = getattr(settings, 'POSTS_PERFORMANCE_WINDOW_MINUTES', 60) * 60 + 120
+    views_key = VIEWS_KEY.format(window)
+    # A lost update here only hides a view until its next flush
+    known = cache.get(views_key, set())
+    if not known.issuperset(pending):
+        cache.set(views_key, known | set(pending), timeout)
+    for view, counter in pending.items():
+        for field, value in counter.items():
+            if not value:
+                continue
+            key = WINDOW_KEY.format(window, view, field)
+            cache.add(key, 0, timeout)
+            try:
+                cache.incr(key, value)
+            except ValueError:
+                cache.set(key, value, timeout)
+
+
+_histogram = _Histogram()
+
+
+def _percentile(buckets, total, fraction):
+    """Upper bound (ms) of the bucket holding the given fraction of requests, or None for the open bucket"""
+    seen = 0
+    for bound in BUCKETS:
+        seen += buckets[f'le_{bound}']
+        if seen >= total * fraction:
+            return bound
+    return None
+
+
+def get_histograms(minutes=None):
+    """
+    Per-view totals over the last ``minutes`` (default
+    POSTS_PERFORMANCE_WINDOW_MINUTES), sorted by total time spent
+    """
+    minutes = minutes or getattr(settings, 'POSTS_PERFORMANCE_WINDOW_MINUTES', 60)
+    current = _window()
+    windows = range(current - minutes + 1, current + 1)
+    view_sets = cache.get_many([VIEWS_KEY.format(window) for window in windows])
+    views = set().union(*view_sets.values())
+    keys = [WINDOW_KEY.format(window, view, field) for window in windows for view in views for field in FIELDS]
+    values = cache.get_many(keys)
+
+    rows = []
+    for view in views:
+        totals = Counter()
+        for window in windows:
+            for field in FIELDS:
+                totals[field] += values.get(WINDOW_KEY.format(window, view, field), 0)
+        requests = totals['requests']
+        if not requests:
+            continue
+        rows.append({
+            'view': view,
+            'requests': requests,
+            'avg_queries': round(totals['queries'] / requests, 1),
+            'avg_db_ms': round(totals['db_ms'] / requests, 1),
+            'avg_template_ms': round(totals['template_ms'] / requests, 1),
+            'n_plus_one': totals['n_plus_one'],
+            'p50_ms': _percentile(totals, requests, 0.5),
+            'p95_ms': _percentile(totals, requests, 0.95),
+            'p99_ms': _percentile(totals, requests, 0.99),
+            'buckets': [(bound, totals[f'le_{bound}']) for bound in BUCKETS] + [(None, totals['le_inf'])],
+        })
+    rows.sort(key=lambda row: row['requests'] * (row['p50_ms'] or BUCKETS[-1]), reverse=True)
+    return rows
+
+
+def server_timing(total_ms, metrics, suspects):
+    entries = [
+        f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries"',
+        f'tpl;dur={metrics.template_time * 1000:.1f};desc="templates"',
+        f'total;dur={total_ms:.1f}',
+    ]
+    if suspects:
+        entries.append(f'nplusone;desc="{len(suspects)} repeated query shapes"')
+    return ', '.join(entries)
+
+
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'POSTS_PERFORMANCE_ENABLED', True):
+            raise MiddlewareNotUsed
+        install_hooks()
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        total_ms = (time.perf_counter() - metrics.started) * 1000
+        suspects = metrics.n_plus_one_suspects()
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+
+        if getattr(settings, 'POSTS_PERFORMANCE_SERVER_TIMING', True):
+            response['Server-Timing'] = server_timing(total_ms, metrics, suspects)
+
+        record = {
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 1),
+            'queries': metrics.queries,
+            'db_ms': round(metrics.db_time * 1000, 1),
+            'template_ms': round(metrics.template_time * 1000, 1),
+        }
+        if suspects:
+            record['n_plus_one'] = [{'sql': shape, 'count': count} for shape, count in suspects]
+            logger.warning(json.dumps(record), extra={'performance': record})
+        else:
+            logger.info(json.dumps(record), extra={'performance': record})
+
+        _histogram.add(view, total_ms, metrics, suspects)
+        return response
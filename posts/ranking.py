@@ -0,0 +1,125 @@
+"""
+"Trending" (hot) and "Top this week" (top) feeds.
+
+A post's points are its likes minus its dislikes plus
+POSTS_RANKING_COMMENT_WEIGHT per comment. PostScore materializes, per
+recent post:
+
+- ``hot``: (points + 1) / (age in hours + 2) ** POSTS_RANKING_GRAVITY, for
+  posts younger than POSTS_RANKING_HOT_DAYS
+- ``top``: the points, for posts younger than POSTS_RANKING_TOP_DAYS
+
+so each feed is a read of a partial index in order instead of an aggregate
+over LikeDislike and Comment.
+
+Reactions and comments rescore their post when they are committed
+(posts.signals). Decay needs every score recomputed as time passes, which
+the rescore_posts command does periodically with rescore_recent(). All hot
+scores are decayed to the same reference time, the start of its last run, so
+a post rescored in between is compared fairly with the rest.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .caching import bump_ranking_version
+from .models import BlogPost, PostScore
+
+RANKINGS = ('hot', 'top')
+REFERENCE_KEY = 'ranking-reference'
+
+
+def comment_weight():
+    return getattr(settings, 'POSTS_RANKING_COMMENT_WEIGHT', 2.0)
+
+
+def gravity():
+    return getattr(settings, 'POSTS_RANKING_GRAVITY', 1.8)
+
+
+def windows(reference):
+    """The oldest creation time still ranked by the hot and the top feed"""
+    return (
+        reference - timedelta(days=getattr(settings, 'POSTS_RANKING_HOT_DAYS', 3)),
+        reference - timedelta(days=getattr(settings, 'POSTS_RANKING_TOP_DAYS', 7)),
+    )
+
+
+def reference_time():
+    """The time hot scores are currently decayed to"""
+    return cache.get(REFERENCE_KEY) or timezone.now()
+
+
+def points(likes, dislikes, comments):
+    return likes - dislikes + comment_weight() * comments
+
+
+def hot_score(post_points, age_hours):
+    return (post_points + 1) / (max(age_hours, 0) + 2) ** gravity()
+
+
+def rescore_posts(post_ids, reference=None):
+    """
+    Recompute the scores of ``post_ids`` from the reaction counters and
+    comments in two queries. Returns the number of posts inside a window.
+    """
+    reference = reference or reference_time()
+    hot_since, top_since = windows(reference)
+    oldest = min(hot_since, top_since)
+    rows = (
+        BlogPost.objects.filter(pk__in=post_ids, created_at__gte=oldest).order_by().with_comment_count()
+        .values_list('pk', 'created_at', 'likes_count', 'dislikes_count', 'comment_count')
+    )
+    scores = []
+    for post_id, created_at, likes, dislikes, comments in rows:
+        post_points = points(likes, dislikes, comments)
+        age_hours = (reference - created_at).total_seconds() / 3600
+        scores.append(PostScore(
+            post_id=post_id,
+            created_at=created_at,
+            hot=hot_score(post_points, age_hours) if created_at >= hot_since else None,
+            top=post_points if created_at >= top_since else None,
+        ))
+    if scores:
+        PostScore.objects.bulk_create(
+            scores, update_conflicts=True, unique_fields=['post'], update_fields=['created_at', 'hot', 'top'],
+        )
+        bump_ranking_version()
+    return len(scores)
+
+
+def rescore_recent(batch_size=500, progress=None):
+    """
+    Decay every score to now: drop posts that left the windows and rescore
+    the posts inside them, ``batch_size`` at a time. Also creates the scores
+    of recent posts that have none (e.g. after a bulk import). Returns the
+    number of posts rescored.
+    """
+    reference = timezone.now()
+    hot_since, top_since = windows(reference)
+    oldest = min(hot_since, top_since)
+    PostScore.objects.filter(created_at__lt=oldest).delete()
+    PostScore.objects.filter(created_at__lt=hot_since, hot__isnull=False).update(hot=None)
+    PostScore.objects.filter(created_at__lt=top_since, top__isnull=False).update(top=None)
+
+    post_ids = list(
+        BlogPost.objects.filter(created_at__gte=oldest).order_by('-created_at', '-id').values_list('pk', flat=True)
+    )
+    rescored = 0
+    for start in range(0, len(post_ids), batch_size):
+        rescored += rescore_posts(post_ids[start:start + batch_size], reference)
+        if progress:
+            progress(rescored)
+    cache.set(REFERENCE_KEY, reference, None)
+    bump_ranking_version()
+    return rescored
+
+
+def ranked_scores(ranking):
+    """Scores of the posts in the ``ranking`` feed, to be paginated with key=ranking"""
+    if ranking not in RANKINGS:
+        raise ValueError(f'Unknown ranking "{ranking}"')
+    # Matches the condition of the feed's partial index
+    return PostScore.objects.filter(**{f'{ranking}__isnull': False}).only(ranking)
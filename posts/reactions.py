@@ -0,0 +1,282 @@
+import asyncio
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from .caching import bump_post_version
+from .models import BlogPost, LikeDislike, ReactionEvent, UserStats
+from .ranking import rescore_posts
+
+STATE_NAMES = {True: 'like', False: 'dislike', None: None}
+
+
+def buffered_mode():
+    """True when reactions are recorded into ReactionEvent and applied in batches"""
+    return getattr(settings, 'POSTS_REACTION_MODE', 'direct') == 'buffered'
+
+
+def apply_reaction(user, post, action, _retry=True):
+    """
+    Toggle a like/dislike for ``user`` on ``post`` and keep the post's
+    counters in step. Returns the user's reaction after the toggle
+    ('like', 'dislike' or None).
+    """
+    is_like = (action == 'like')
+
+    try:
+        with transaction.atomic():
+            existing_reaction = (
+                LikeDislike.objects.select_for_update()
+                .filter(user=user, post=post)
+                .first()
+            )
+
+            if existing_reaction is None:
+                LikeDislike.objects.create(user=user, post=post, is_like=is_like)
+                post.adjust_reaction_counts(
+                    likes=1 if is_like else 0,
+                    dislikes=0 if is_like else 1,
+                )
+                return action
+
+            if existing_reaction.is_like == is_like:
+                # Clicking the same button again removes the reaction
+                existing_reaction.delete()
+                post.adjust_reaction_counts(
+                    likes=-1 if is_like else 0,
+                    dislikes=0 if is_like else -1,
+                )
+                return None
+
+            existing_reaction.is_like = is_like
+            existing_reaction.save(update_fields=['is_like'])
+            post.adjust_reaction_counts(
+                likes=1 if is_like else -1,
+                dislikes=-1 if is_like else 1,
+            )
+            return action
+    except IntegrityError:
+        # A concurrent request inserted the reaction first; retry against it
+        if not _retry:
+            raise
+        return apply_reaction(user, post, action, _retry=False)
+
+
+def recount_reactions(queryset=None):
+    """
+    Recompute like/dislike counters from LikeDislike rows.
+    Returns a list of (post, stored_likes, stored_dislikes) for every post
+    whose stored counters drifted; the posts carry the corrected values.
+    """
+    if queryset is None:
+        queryset = BlogPost.objects.all()
+
+    queryset = queryset.order_by().annotate(
+        actual_likes=Count('likes', filter=Q(likes__is_like=True)),
+        actual_dislikes=Count('likes', filter=Q(likes__is_like=False)),
+    ).only('id', 'title', 'author', 'likes_count', 'dislikes_count')
+
+    drifted = []
+    for post in queryset.iterator(chunk_size=2000):
+        if post.likes_count != post.actual_likes or post.dislikes_count != post.actual_dislikes:
+            drifted.append((post, post.likes_count, post.dislikes_count))
+            post.likes_count = post.actual_likes
+            post.dislikes_count = post.actual_dislikes
+    return drifted
+
+
+def refresh_reaction_counters(queryset):
+    """
+    Overwrite the stored counters of the posts in ``queryset`` with counts
+    from LikeDislike in a single UPDATE. Used after bulk loads, where
+    recount_reactions would have to pull every drifted post into memory.
+    """
+    def reaction_count(is_like):
+        counts = (
+            LikeDislike.objects.filter(post=OuterRef('pk'), is_like=is_like)
+            .order_by().values('post').annotate(total=Count('pk')).values('total')
+        )
+        return Coalesce(Subquery(counts), Value(0))
+
+    return queryset.update(likes_count=reaction_count(True), dislikes_count=reaction_count(False))
+
+
+def get_user_reaction(user, post):
+    """The user's current reaction to ``post`` ('like', 'dislike' or None), including buffered clicks"""
+    if buffered_mode():
+        latest_pending = (
+            ReactionEvent.objects.filter(user=user, post=post)
+            .order_by('-id')
+            .values_list('is_like')
+            .first()
+        )
+        if latest_pending is not None:
+            return STATE_NAMES[latest_pending[0]]
+    applied = LikeDislike.objects.filter(user=user, post=post).values_list('is_like', flat=True).first()
+    return STATE_NAMES[applied]
+
+
+async def aget_user_reaction(user, post_id):
+    """Async counterpart of get_user_reaction"""
+    applied, latest_pending = await asyncio.gather(
+        LikeDislike.objects.filter(user=user, post_id=post_id).values_list('is_like', flat=True).afirst(),
+        _alatest_pending(user, post_id),
+    )
+    return STATE_NAMES[latest_pending[0] if latest_pending is not None else applied]
+
+
+async def _alatest_pending(user, post_id):
+    if not buffered_mode():
+        return None
+    return await (
+        ReactionEvent.objects.filter(user=user, post_id=post_id)
+        .order_by('-id')
+        .values_list('is_like')
+        .afirst()
+    )
+
+
+def _count_delta(before, after):
+    """(likes, dislikes) change caused by a reaction going from ``before`` to ``after``"""
+    return (
+        (after is True) - (before is True),
+        (after is False) - (before is False),
+    )
+
+
+def record_reaction(user, post_id, action):
+    """
+    Buffered counterpart of apply_reaction: append the click to the
+    ReactionEvent log without touching LikeDislike or the post row.
+    Returns (user_reaction, likes_count, dislikes_count) where the counts
+    are the stored totals plus this user's not yet applied changes, or
+    None if the post does not exist.
+    """
+    counts = BlogPost.objects.filter(pk=post_id).values_list('likes_count', 'dislikes_count').first()
+    if counts is None:
+        return None
+
+    applied = (
+        LikeDislike.objects.filter(user=user, post_id=post_id)
+        .values_list('is_like', flat=True)
+        .first()
+    )
+    latest_pending = (
+        ReactionEvent.objects.filter(user=user, post_id=post_id)
+        .order_by('-id')
+        .values_list('is_like')
+        .first()
+    )
+    current = latest_pending[0] if latest_pending is not None else applied
+
+    is_like = (action == 'like')
+    new_state = None if current == is_like else is_like
+    ReactionEvent.objects.create(user=user, post_id=post_id, is_like=new_state)
+
+    likes, dislikes = _count_delta(applied, new_state)
+    return STATE_NAMES[new_state], counts[0] + likes, counts[1] + dislikes
+
+
+async def arecord_reaction(user, post_id, action):
+    """Async counterpart of record_reaction; the three reads are issued concurrently"""
+    counts, applied, latest_pending = await asyncio.gather(
+        BlogPost.objects.filter(pk=post_id).values_list('likes_count', 'dislikes_count').afirst(),
+        LikeDislike.objects.filter(user=user, post_id=post_id).values_list('is_like', flat=True).afirst(),
+        _alatest_pending(user, post_id),
+    )
+    if counts is None:
+        return None
+    current = latest_pending[0] if latest_pending is not None else applied
+
+    is_like = (action == 'like')
+    new_state = None if current == is_like else is_like
+    await ReactionEvent.objects.acreate(user=user, post_id=post_id, is_like=new_state)
+
+    likes, dislikes = _count_delta(applied, new_state)
+    return STATE_NAMES[new_state], counts[0] + likes, counts[1] + dislikes
+
+
+def apply_reaction_events(batch_size=1000):
+    """
+    Apply up to ``batch_size`` buffered reaction events: only the latest
+    event per (user, post) matters, turned into one bulk insert, one bulk
+    update and one delete on LikeDislike plus a single counter update.
+    Returns the number of events consumed.
+
+    Batches must apply one at a time and in event order: two batches holding
+    events of the same (user, post) would otherwise race, and the older
+    state could win. Every batch starts at the oldest pending events and
+    locks them, so a second worker waits on those rows until the batch
+    commits. SQLite has no row locks; run a single worker there.
+    """
+    with transaction.atomic():
+        events = ReactionEvent.objects.order_by('id')
+        if connection.features.has_select_for_update:
+            events = events.select_for_update()
+        events = list(events.values_list('id', 'user_id', 'post_id', 'is_like')[:batch_size])
+        if not events:
+            return 0
+
+        final_state = {}
+        for _, user_id, post_id, is_like in events:
+            final_state[(user_id, post_id)] = is_like
+
+        existing = {
+            (reaction.user_id, reaction.post_id): reaction
+            for reaction in LikeDislike.objects.filter(
+                user_id__in={user_id for user_id, _ in final_state},
+                post_id__in={post_id for _, post_id in final_state},
+            ).only('id', 'user_id', 'post_id', 'is_like')
+            if (reaction.user_id, reaction.post_id) in final_state
+        }
+
+        to_create, to_update, to_delete = [], [], []
+        deltas = defaultdict(lambda: [0, 0])
+        for (user_id, post_id), is_like in final_state.items():
+            reaction = existing.get((user_id, post_id))
+            before = reaction.is_like if reaction else None
+            if before == is_like:
+                continue
+            if reaction is None:
+                to_create.append(LikeDislike(user_id=user_id, post_id=post_id, is_like=is_like))
+            elif is_like is None:
+                to_delete.append(reaction.pk)
+            else:
+                reaction.is_like = is_like
+                to_update.append(reaction)
+            likes, dislikes = _count_delta(before, is_like)
+            deltas[post_id][0] += likes
+            deltas[post_id][1] += dislikes
+
+        LikeDislike.objects.bulk_create(to_create, batch_size=500)
+        LikeDislike.objects.bulk_update(to_update, ['is_like'], batch_size=500)
+        LikeDislike.objects.filter(pk__in=to_delete).delete()
+
+        changed = {post_id: delta for post_id, delta in deltas.items() if delta != [0, 0]}
+        if changed:
+            BlogPost.objects.filter(pk__in=changed).update(
+                likes_count=F('likes_count') + Case(
+                    *[When(pk=post_id, then=Value(likes)) for post_id, (likes, _) in changed.items()],
+                    default=Value(0),
+                ),
+                dislikes_count=F('dislikes_count') + Case(
+                    *[When(pk=post_id, then=Value(dislikes)) for post_id, (_, dislikes) in changed.items()],
+                    default=Value(0),
+                ),
+            )
+            likes_by_author = defaultdict(int)
+            for post_id, author_id in BlogPost.objects.filter(pk__in=changed).values_list('pk', 'author_id'):
+                likes_by_author[author_id] += changed[post_id][0]
+            UserStats.objects.adjust_likes(likes_by_author)
+
+        ReactionEvent.objects.filter(id__in=[event_id for event_id, *_ in events]).delete()
+
+    # Bulk operations send no model signals, so invalidate cached pages explicitly
+    for post_id in changed:
+        bump_post_version(post_id)
+    if changed:
+        rescore_posts(changed)
+    return len(events)
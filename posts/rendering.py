@@ -0,0 +1,291 @@
+"""
+Compiles rich-text post content into the HTML the detail page shows.
+
+render_html() runs when a post is saved (BlogPost.update_rendered_html) and:
+
+- keeps only allowlisted tags, attributes and URL schemes; scripts, styles
+  and embeds are dropped with their contents
+- rewrites embedded <img> tags of uploaded images to a <picture> with the
+  resized renditions, intrinsic width/height and lazy loading (external
+  images get lazy loading only)
+- gives each heading an id and a "#" anchor link
+
+Uploaded images without renditions yet are resized in the background after
+the post is saved, and the post is rendered again once they exist.
+
+Bump RENDERER_VERSION whenever the output changes, then run
+render_post_content to rebuild the stored HTML of existing posts.
+"""
+import logging
+import re
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+from django.utils.text import slugify
+
+from .caching import bump_post_version
+from .models import BlogPost
+from .renditions import (
+    RENDITION_FORMATS, RENDITION_SPECS, picture_html, render_variants, rendition_name, scaled_size, store_variants,
+)
+
+logger = logging.getLogger(__name__)
+
+RENDERER_VERSION = 1
+
+ALLOWED_TAGS = {
+    'a': {'href', 'title'},
+    'abbr': {'title'},
+    'b': set(), 'blockquote': set(), 'br': set(), 'caption': set(), 'code': set(), 'del': set(), 'div': set(),
+    'em': set(), 'figcaption': set(), 'figure': set(), 'hr': set(), 'i': set(), 'ins': set(), 'li': set(),
+    'p': set(), 'pre': set(), 's': set(), 'span': set(), 'strike': set(), 'strong': set(), 'sub': set(),
+    'sup': set(), 'table': set(), 'tbody': set(), 'tfoot': set(), 'thead': set(), 'tr': set(), 'u': set(),
+    'ul': set(),
+    'h1': set(), 'h2': set(), 'h3': set(), 'h4': set(), 'h5': set(), 'h6': set(),
+    'img': {'src', 'alt', 'title', 'width', 'height'},
+    'ol': {'start'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan'},
+}
+VOID_TAGS = {'br', 'hr', 'img'}
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+# Removed together with everything inside them
+DROPPED_TAGS = {'script', 'style', 'iframe', 'object', 'template', 'noscript', 'textarea', 'svg', 'math'}
+NUMERIC_ATTRIBUTES = {'width', 'height', 'colspan', 'rowspan', 'start'}
+URL_ATTRIBUTES = {'href', 'src'}
+URL_SCHEMES = {'', 'http', 'https', 'mailto'}
+
+# Heading ids are prefixed so they cannot clash with ids the page itself uses
+ANCHOR_PREFIX = 'section-'
+# The content column of post_detail.html
+CONTENT_IMAGE_SIZES = '(min-width: 768px) 66vw, 100vw'
+
+STYLE_SIZE_RE = re.compile(r'(?:^|;)\s*(width|height)\s*:\s*(\d+)(?:\.\d+)?px', re.IGNORECASE)
+# Browsers ignore whitespace and control characters inside a URL scheme ("java\tscript:")
+URL_NOISE_RE = re.compile(r'[\x00-\x20\x7f]+')
+
+
+def safe_url(value):
+    value = (value or '').strip()
+    try:
+        scheme = urlsplit(URL_NOISE_RE.sub('', value)).scheme.lower()
+    except ValueError:
+        return None
+    return value if value and scheme in URL_SCHEMES else None
+
+
+def stored_image_name(src):
+    """The storage name of an uploaded image referenced by ``src``, or None for other URLs"""
+    media_url = settings.MEDIA_URL
+    if not media_url or not src.startswith(media_url):
+        return None
+    name = unquote(urlsplit(src[len(media_url):]).path)
+    if not name or '..' in name.split('/'):
+        return None
+    return name
+
+
+def image_size(name):
+    """(width, height) of a stored image as displayed (EXIF rotation applied), or None if unreadable"""
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with default_storage.open(name, 'rb') as source, Image.open(source) as image:
+            width, height = image.size
+            # Orientations 5-8 are rotated by a quarter turn
+            if image.getexif().get(0x0112) in (5, 6, 7, 8):
+                width, height = height, width
+    except (OSError, UnidentifiedImageError, ValueError):
+        return None
+    return width, height
+
+
+def content_renditions(name, size):
+    """Rendition metadata (as on BlogPost.image_renditions) of a stored content image, if all of it exists"""
+    specs = {}
+    for spec, max_width in RENDITION_SPECS.items():
+        width, height = scaled_size(*size, max_width)
+        entry = {'width': width, 'height': height}
+        for extension in RENDITION_FORMATS:
+            entry[extension] = rendition_name(name, spec, extension)
+            if not default_storage.exists(entry[extension]):
+                return None
+        specs[spec] = entry
+    return specs
+
+
+def _dimension(value):
+    return int(value) if value and value.isdigit() and 0 < int(value) <= 10000 else None
+
+
+class ContentCompiler(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.output = []
+        self.open_tags = []
+        self.dropping = None
+        self.drop_depth = 0
+        # Index in output of the opening tag of the heading being read, and its text
+        self.heading = None
+        self.heading_text = []
+        self.anchors = set()
+        self.missing_renditions = []
+
+    def result(self):
+        self.close()
+        while self.open_tags:
+            self._close_tag(self.open_tags[-1])
+        return ''.join(self.output)
+
+    def handle_starttag(self, tag, attrs):
+        if self.dropping:
+            if tag == self.dropping:
+                self.drop_depth += 1
+            return
+        if tag in DROPPED_TAGS:
+            self.dropping, self.drop_depth = tag, 1
+            return
+        if tag not in ALLOWED_TAGS:
+            return
+        attrs = self._clean_attributes(tag, attrs)
+        if tag == 'img':
+            self.output.append(self._image(attrs))
+            return
+        if tag in VOID_TAGS:
+            self.output.append(format_html('<{}{}>', tag, flatatt(attrs)))
+            return
+        if tag in HEADING_TAGS:
+            if self.heading is not None:
+                return
+            self.heading = len(self.output)
+            self.heading_text = []
+            self.output.append(None)
+        else:
+            self.output.append(format_html('<{}{}>', tag, flatatt(attrs)))
+        self.open_tags.append(tag)
+
+    def handle_endtag(self, tag):
+        if self.dropping:
+            if tag == self.dropping:
+                self.drop_depth -= 1
+                if not self.drop_depth:
+                    self.dropping = None
+            return
+        if tag in self.open_tags:
+            # Closes any tags left open inside it, as browsers do
+            while self.open_tags:
+                if self._close_tag(self.open_tags[-1]) == tag:
+                    break
+
+    def handle_data(self, data):
+        if self.dropping:
+            return
+        self.output.append(escape(data, quote=False))
+        if self.heading is not None:
+            self.heading_text.append(data)
+
+    def _close_tag(self, tag):
+        self.open_tags.pop()
+        if tag in HEADING_TAGS and self.heading is not None:
+            anchor = self._anchor(''.join(self.heading_text))
+            self.output[self.heading] = format_html('<{} id="{}">', tag, anchor)
+            self.output.append(format_html(
+                '<a class="heading-anchor" href="#{}" aria-label="Link to this section">#</a>', anchor,
+            ))
+            self.heading = None
+        self.output.append(f'</{tag}>')
+        return tag
+
+    def _anchor(self, text):
+        base = ANCHOR_PREFIX + (slugify(text)[:60].strip('-') or 'heading')
+        anchor, suffix = base, 2
+        while anchor in self.anchors:
+            anchor, suffix = f'{base}-{suffix}', suffix + 1
+        self.anchors.add(anchor)
+        return anchor
+
+    def _clean_attributes(self, tag, attrs):
+        allowed = ALLOWED_TAGS[tag]
+        cleaned = {}
+        for name, value in attrs:
+            if tag == 'img' and name == 'style':
+                # CKEditor sizes images with inline styles
+                for dimension, pixels in STYLE_SIZE_RE.findall(value or ''):
+                    cleaned.setdefault(dimension.lower(), pixels)
+                continue
+            if name not in allowed or value is None:
+                continue
+            if name in URL_ATTRIBUTES:
+                value = safe_url(value)
+            elif name in NUMERIC_ATTRIBUTES:
+                value = value.strip() if value.strip().isdigit() else None
+            if value is not None:
+                cleaned[name] = value
+        if tag == 'a' and urlsplit(cleaned.get('href', '')).netloc:
+            cleaned['rel'] = 'nofollow noopener'
+        return cleaned
+
+    def _image(self, attrs):
+        src = attrs.pop('src', None)
+        if not src:
+            return ''
+        attrs.setdefault('alt', '')
+        attrs.update(loading='lazy', decoding='async')
+        width, height = _dimension(attrs.pop('width', None)), _dimension(attrs.pop('height', None))
+
+        name = stored_image_name(src)
+        size = image_size(name) if name else None
+        if size:
+            # Keep the author's display size, completing it from the image's aspect ratio
+            if width and not height:
+                height = max(round(size[1] * width / size[0]), 1)
+            elif height and not width:
+                width = max(round(size[0] * height / size[1]), 1)
+            elif not width:
+                width, height = size
+        if width and height:
+            attrs.update(width=width, height=height)
+
+        specs = content_renditions(name, size) if size else None
+        if specs is None:
+            if size:
+                self.missing_renditions.append(name)
+            return format_html('<img src="{}"{}>', src, flatatt(attrs))
+        sizes = f'{width}px' if width and width < size[0] else CONTENT_IMAGE_SIZES
+        return picture_html(specs, 'detail', sizes, attrs)
+
+
+def render_html(html):
+    """
+    Sanitized, display-ready HTML for rich-text ``html``. Returns (html,
+    storage names of embedded uploads that have no renditions yet).
+    """
+    compiler = ContentCompiler()
+    compiler.feed(html or '')
+    rendered = compiler.result()
+    return rendered, list(dict.fromkeys(compiler.missing_renditions))
+
+
+def generate_content_renditions(post_id, names):
+    """Resize the uploads embedded in a post, then render the post again so it uses them"""
+    for name in names:
+        size = image_size(name)
+        if size is None or content_renditions(name, size) is not None:
+            continue
+        try:
+            with default_storage.open(name, 'rb') as source:
+                store_variants(name, render_variants(source.read()))
+        except Exception:
+            logger.exception('Could not create renditions for %s', name)
+
+    post = BlogPost.objects.filter(pk=post_id).only('id', 'content').first()
+    if post is None:
+        return
+    post.update_rendered_html()
+    BlogPost.objects.filter(pk=post_id).update(rendered_html=post.rendered_html, renderer_version=post.renderer_version)
+    bump_post_version(post_id)
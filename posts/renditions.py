@@ -0,0 +1,223 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from .caching import bump_post_version
+from .models import BlogPost, BlogPostImage
+from .storage import is_content_addressed
+
+logger = logging.getLogger(__name__)
+
+# Rendition name -> maximum width in pixels. Images are never upscaled.
+RENDITION_SPECS = {
+    'thumbnail': 320,
+    'card': 640,
+    'detail': 1280,
+}
+
+# Output formats in order of preference; the last one is the <img> fallback
+RENDITION_FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+RENDITION_ROOT = 'renditions'
+
+_executor = None
+
+
+def render_variants(data):
+    """
+    Resize and re-encode raw image bytes into every rendition.
+    Pure Pillow with no Django access, so it can run in a process pool.
+    Returns {spec: {'width', 'height', <format>: bytes, ...}}.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original).convert('RGB')
+
+    variants = {}
+    for spec, max_width in RENDITION_SPECS.items():
+        size = scaled_size(image.width, image.height, max_width)
+        resized = image.resize(size, Image.LANCZOS) if size != image.size else image
+        variant = {'width': resized.width, 'height': resized.height}
+        for extension, options in RENDITION_FORMATS.items():
+            buffer = BytesIO()
+            resized.save(buffer, **options)
+            variant[extension] = buffer.getvalue()
+        variants[spec] = variant
+    return variants
+
+
+def scaled_size(width, height, max_width):
+    """Size of the rendition of a ``width`` x ``height`` image no wider than ``max_width``, as render_variants makes it"""
+    if width > max_width:
+        return max_width, max(round(height * max_width / width), 1)
+    return width, height
+
+
+def rendition_name(source_name, spec, extension):
+    stem, _ = os.path.splitext(source_name)
+    return f'{RENDITION_ROOT}/{stem}-{spec}.{extension}'
+
+
+def store_variants(source_name, variants):
+    """Write encoded variants to storage and return the metadata stored on the model"""
+    metadata = {'source': source_name, 'specs': {}}
+    for spec, variant in variants.items():
+        entry = {'width': variant['width'], 'height': variant['height']}
+        for extension in RENDITION_FORMATS:
+            name = rendition_name(source_name, spec, extension)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            entry[extension] = default_storage.save(name, ContentFile(variant[extension]))
+        metadata['specs'][spec] = entry
+    return metadata
+
+
+def srcset(specs, extension):
+    return ', '.join(
+        f"{default_storage.url(entry[extension])} {entry['width']}w"
+        for _, entry in sorted(specs.items(), key=lambda item: item[1]['width'])
+    )
+
+
+def picture_html(specs, spec, sizes, attrs):
+    """
+    A <picture> offering the renditions in ``specs`` (rendition metadata) up
+    to ``spec`` as a WebP srcset with a JPEG fallback. The <img> gets
+    ``attrs``, and the intrinsic size of ``spec`` unless attrs set one.
+    """
+    chosen = specs[spec]
+    # Only offer sizes up to the requested one; bigger files are never needed here
+    limit = RENDITION_SPECS.get(spec, chosen['width'])
+    candidates = {name: entry for name, entry in specs.items() if RENDITION_SPECS.get(name, 0) <= limit}
+    attrs = dict(attrs)
+    if 'width' not in attrs or 'height' not in attrs:
+        attrs.update(width=chosen['width'], height=chosen['height'])
+    attrs.update(sizes=sizes, srcset=srcset(candidates, 'jpeg'))
+    return format_html(
+        '<picture class="responsive-picture"><source type="image/webp" srcset="{}" sizes="{}"><img src="{}"{}></picture>',
+        srcset(candidates, 'webp'),
+        sizes,
+        default_storage.url(chosen['jpeg']),
+        flatatt(attrs),
+    )
+
+
+def delete_rendition_files(metadata):
+    for entry in (metadata or {}).get('specs', {}).values():
+        for extension in RENDITION_FORMATS:
+            name = entry.get(extension)
+            if name and default_storage.exists(name):
+                default_storage.delete(name)
+
+
+def delete_source_renditions(source_name):
+    """Delete every rendition of ``source_name``, whichever rows recorded them"""
+    for spec in RENDITION_SPECS:
+        for extension in RENDITION_FORMATS:
+            name = rendition_name(source_name, spec, extension)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+
+
+def discard_renditions(metadata):
+    """
+    Delete renditions a row stopped using. Renditions of content-addressed
+    images are shared by every row with that image and are removed with
+    the image itself (posts.media), so they are left alone.
+    """
+    if not is_content_addressed((metadata or {}).get('source')):
+        delete_rendition_files(metadata)
+
+
+def shared_renditions(source_name):
+    """Rendition metadata another row already has for the same content-addressed image, if any"""
+    if not is_content_addressed(source_name):
+        return None
+    for model in (BlogPost, BlogPostImage):
+        metadata = (
+            model.objects.filter(image=source_name, image_renditions__source=source_name)
+            .values_list('image_renditions', flat=True)
+            .first()
+        )
+        if metadata:
+            return metadata
+    return None
+
+
+def needs_renditions(instance):
+    """True when the instance has an image whose renditions are missing or stale"""
+    return bool(instance.image) and (instance.image_renditions or {}).get('source') != instance.image.name
+
+
+def generate_renditions(model, pk):
+    """Build renditions for ``model`` row ``pk`` and record their metadata on it"""
+    instance = model.objects.filter(pk=pk).only('id', 'image', 'image_renditions').first()
+    if instance is None or not needs_renditions(instance):
+        return
+
+    source_name = instance.image.name
+    # The same image uploaded to another post already has renditions
+    metadata = shared_renditions(source_name)
+    if metadata is None:
+        with instance.image.open('rb') as source:
+            data = source.read()
+        try:
+            variants = render_variants(data)
+        except Exception:
+            logger.exception('Could not create renditions for %s', source_name)
+            return
+        metadata = store_variants(source_name, variants)
+
+    previous = instance.image_renditions
+    # Only record the renditions if the image was not replaced in the meantime
+    updated = model.objects.filter(pk=pk, image=source_name).update(image_renditions=metadata)
+    if updated:
+        if previous and previous.get('source') != source_name:
+            discard_renditions(previous)
+        bump_post_version(getattr(instance, 'post_id', instance.pk))
+    else:
+        discard_renditions(metadata)
+
+
+def _run_in_background(job, *args):
+    try:
+        job(*args)
+    except Exception:
+        logger.exception('Rendition job %s%r failed', job.__name__, args)
+    finally:
+        close_old_connections()
+
+
+def run_rendition_job(job, *args):
+    """
+    Call ``job(*args)`` on a small background thread pool, or inline when
+    POSTS_RENDITIONS_ASYNC is False.
+    """
+    global _executor
+
+    if not getattr(settings, 'POSTS_RENDITIONS_ASYNC', True):
+        job(*args)
+        return
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'POSTS_RENDITION_WORKERS', 2),
+            thread_name_prefix='renditions',
+        )
+    _executor.submit(_run_in_background, job, *args)
+
+
+def schedule_renditions(model, pk):
+    """Generate renditions for a freshly uploaded image, in the background (see run_rendition_job)"""
+    run_rendition_job(generate_renditions, model, pk)
@@ -0,0 +1,157 @@
+"""
+Read-replica routing.
+
+ReplicaRouter sends writes to the primary ('default') and, during requests
+handled by ReplicaPinningMiddleware, reads to one of the aliases in
+POSTS_REPLICA_DATABASES. Reads go to the primary instead when:
+
+- the request is not a safe method, or a write in the last
+  POSTS_REPLICA_STICKY_SECONDS set the pin cookie (read-your-writes: the
+  redirect after add_comment shows the new comment)
+- a transaction is open on the primary
+- every replica lags more than POSTS_REPLICA_MAX_LAG, or more than the age
+  of the newest content version the request renders (posts.caching), so a
+  replica never fills the shared caches with content older than its key.
+  Feed pages only need replicas that have the latest published or deleted
+  post; cards of posts changed since are read again from the primary.
+  A replica without a lag measurement counts as lagging (run
+  check_replicas more often than its cache entries expire)
+- outside requests (management commands, background threads), which keeps
+  read-then-write jobs consistent
+
+Lag is measured by check_replicas and shared through the cache.
+"""
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+LAG_KEY = 'replica-lag:{}'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+_request_state = ContextVar('posts_replica_state', default=None)
+
+
+class _RequestState:
+    __slots__ = ('pinned', 'wrote', 'fresh_after', 'read_lag')
+
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.wrote = False
+        self.fresh_after = 0.0
+        self.read_lag = 0.0
+
+
+def replica_aliases():
+    return getattr(settings, 'POSTS_REPLICA_DATABASES', [])
+
+
+def sticky_seconds():
+    return getattr(settings, 'POSTS_REPLICA_STICKY_SECONDS', 10)
+
+
+def pin_cookie_name():
+    return getattr(settings, 'POSTS_REPLICA_PIN_COOKIE', 'primary_pin')
+
+
+def require_fresh(timestamp):
+    """Only read from replicas that had caught up with changes made at ``timestamp`` (Unix time)"""
+    state = _request_state.get()
+    if state is not None and timestamp > state.fresh_after:
+        state.fresh_after = timestamp
+
+
+def replica_read_lag():
+    """Seconds the replicas read from during this request may be behind the primary (0 if none was used)"""
+    state = _request_state.get()
+    return state.read_lag if state is not None else 0.0
+
+
+def record_lag(lags, timeout=60):
+    """Publish measured lag in seconds ({alias: seconds, or None if unavailable}) to every process"""
+    cache.set_many(
+        {LAG_KEY.format(alias): float('inf') if lag is None else lag for alias, lag in lags.items()},
+        timeout,
+    )
+
+
+class _LagSnapshot:
+    """Replica lags read from the cache at most every POSTS_REPLICA_LAG_REFRESH seconds per process"""
+
+    def __init__(self):
+        self.lags = {}
+        self.fetched_at = float('-inf')
+
+    def get(self):
+        now = time.monotonic()
+        if now - self.fetched_at >= getattr(settings, 'POSTS_REPLICA_LAG_REFRESH', 1):
+            aliases = replica_aliases()
+            found = cache.get_many([LAG_KEY.format(alias) for alias in aliases])
+            self.lags = {alias: found.get(LAG_KEY.format(alias)) for alias in aliases}
+            self.fetched_at = now
+        return self.lags
+
+
+_lag_snapshot = _LagSnapshot()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _request_state.get()
+        if state is None or state.pinned or not replica_aliases():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+
+        max_lag = getattr(settings, 'POSTS_REPLICA_MAX_LAG', 5)
+        if state.fresh_after:
+            max_lag = min(max_lag, time.time() - state.fresh_after)
+        # A replica without a measurement (check_replicas not running, or its entry expired) is
+        # treated like a failed probe: its lag is unknown, so it may be arbitrarily far behind
+        lags = _lag_snapshot.get()
+        candidates = [alias for alias, lag in lags.items() if (float('inf') if lag is None else lag) <= max_lag]
+        if not candidates:
+            return DEFAULT_DB_ALIAS
+        alias = random.choice(candidates)
+        state.read_lag = max(state.read_lag, lags[alias])
+        return alias
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        # Session saves happen on most requests and are not content the user expects to read back
+        if state is not None and model._meta.app_label != 'sessions':
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaPinningMiddleware:
+    """
+    Enables replica reads for the request and pins the visitor to the
+    primary for POSTS_REPLICA_STICKY_SECONDS after a write, with a cookie.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned = request.method not in SAFE_METHODS or pin_cookie_name() in request.COOKIES
+        state = _RequestState(pinned)
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        if state.wrote:
+            response.set_cookie(pin_cookie_name(), '1', max_age=sticky_seconds(), httponly=True, samesite='Lax')
+        return response
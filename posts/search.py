@@ -0,0 +1,97 @@
+import re
+from collections import Counter
+from math import log
+
+from django.db import transaction
+from django.db.models import Avg, Case, Count, F, FloatField, Sum, Value, When
+from django.db.models.functions import Cast
+
+from .models import SearchDocument, SearchPosting
+from .text import html_to_text
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Title tokens count this many times towards a post's term frequencies
+TITLE_WEIGHT = 3
+
+MAX_TERM_LENGTH = 64
+
+STOP_WORDS = frozenset("""
+a an and are as at be but by for from has have he her his i if in into is it its me my
+no not of on or our she so that the their them there they this to was we were what when
+which who will with you your
+""".split())
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Split text into lowercase index terms, dropping stop words and single characters"""
+    return [
+        token[:MAX_TERM_LENGTH]
+        for token in TOKEN_RE.findall(text.lower())
+        if len(token) > 1 and token not in STOP_WORDS
+    ]
+
+
+def post_terms(post):
+    """Return a Counter of index terms for the post's title and plain-text content"""
+    terms = Counter(tokenize(post.plain_text or html_to_text(post.content)))
+    for term in tokenize(post.title):
+        terms[term] += TITLE_WEIGHT
+    return terms
+
+
+@transaction.atomic
+def index_post(post):
+    """Replace the post's postings with freshly computed ones"""
+    terms = post_terms(post)
+    SearchPosting.objects.filter(post=post).delete()
+    SearchPosting.objects.bulk_create(
+        SearchPosting(term=term, post=post, term_frequency=frequency)
+        for term, frequency in terms.items()
+    )
+    SearchDocument.objects.update_or_create(post=post, defaults={'length': sum(terms.values())})
+
+
+def rank_posts(query):
+    """
+    Return a queryset of {'post_id', 'score'} rows ordered by BM25 score
+    for ``query``. Scores are computed in the database, so only the page
+    that is actually shown has to be fetched.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return SearchPosting.objects.none().values('post_id')
+
+    stats = SearchDocument.objects.aggregate(total=Count('id'), avg_length=Avg('length'))
+    total, avg_length = stats['total'], stats['avg_length'] or 1.0
+    frequencies = dict(
+        SearchPosting.objects.filter(term__in=terms)
+        .values('term')
+        .annotate(df=Count('id'))
+        .values_list('term', 'df')
+    )
+    terms = [term for term in terms if term in frequencies]
+    if not terms:
+        return SearchPosting.objects.none().values('post_id')
+
+    tf = Cast(F('term_frequency'), FloatField())
+    length_norm = Value(K1 * (1 - B)) + Value(K1 * B / avg_length) * Cast(F('post__search_document__length'), FloatField())
+    term_score = tf * Value(K1 + 1) / (tf + length_norm)
+    idf = Case(
+        *[When(term=term, then=Value(_idf(total, frequencies[term]))) for term in terms],
+        output_field=FloatField(),
+    )
+    return (
+        SearchPosting.objects.filter(term__in=terms)
+        .values('post_id')
+        .annotate(score=Sum(idf * term_score))
+        .order_by('-score', '-post_id')
+    )
+
+
+def _idf(total, document_frequency):
+    return log(1 + (total - document_frequency + 0.5) / (document_frequency + 0.5))
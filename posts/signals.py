@@ -0,0 +1,185 @@
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .auth import forget_user
+from .caching import bump_post_version, bump_post_versions
+from .media import acquire, release
+from .models import BlogPost, BlogPostImage, Comment, LikeDislike, UserStats
+from .ranking import rescore_posts
+from .rendering import generate_content_renditions
+from .renditions import discard_renditions, needs_renditions, run_rendition_job, schedule_renditions
+from .search import index_post
+from .timeline import fan_out_post, forget_home_counts
+
+
+@receiver(post_save, sender=BlogPost)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    # Postings and the search document are removed with the post by CASCADE
+    if raw:
+        return
+    index_post(instance)
+
+
+@receiver(post_save, sender=BlogPost)
+@receiver(post_save, sender=BlogPostImage)
+def queue_image_renditions(sender, instance, raw=False, **kwargs):
+    if raw or not needs_renditions(instance):
+        return
+    transaction.on_commit(lambda: schedule_renditions(sender, instance.pk))
+
+
+@receiver(post_save, sender=BlogPost)
+def queue_content_renditions(sender, instance, raw=False, **kwargs):
+    # Uploads embedded in the content that rendered_html could not use resized versions of yet
+    names = instance.__dict__.pop('pending_content_images', None)
+    if raw or not names:
+        return
+    transaction.on_commit(lambda: run_rendition_job(generate_content_renditions, instance.pk, names))
+
+
+@receiver(post_delete, sender=BlogPost)
+@receiver(post_delete, sender=BlogPostImage)
+def remove_image_renditions(sender, instance, **kwargs):
+    metadata = instance.image_renditions
+    if metadata:
+        transaction.on_commit(lambda: discard_renditions(metadata))
+
+
+@receiver(pre_save, sender=BlogPost)
+@receiver(pre_save, sender=BlogPostImage)
+def remember_stored_image(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and 'image' not in update_fields):
+        return
+    instance._stored_image = (
+        sender.objects.filter(pk=instance.pk).values_list('image', flat=True).first() if instance.pk else None
+    )
+    # After saving the field only holds the stored name; keep the upload in case acquire() must store it again
+    instance._image_upload = None if instance.image._committed else instance.image.file
+
+
+@receiver(post_save, sender=BlogPost)
+@receiver(post_save, sender=BlogPostImage)
+def count_image_references(sender, instance, raw=False, **kwargs):
+    if raw or not hasattr(instance, '_stored_image'):
+        return
+    previous = instance.__dict__.pop('_stored_image')
+    upload = instance.__dict__.pop('_image_upload')
+    if instance.image.name != previous:
+        acquire(instance.image.name, upload)
+        release(previous)
+
+
+@receiver(post_delete, sender=BlogPost)
+@receiver(post_delete, sender=BlogPostImage)
+def release_image_reference(sender, instance, **kwargs):
+    release(instance.image.name)
+
+
+@receiver(post_save, sender=BlogPost)
+@receiver(post_delete, sender=BlogPost)
+def invalidate_post_fragments(sender, instance, signal, created=False, **kwargs):
+    # Publishing or deleting a post changes what the feeds list
+    bump_post_versions([instance.pk], listing=created or signal is post_delete)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=LikeDislike)
+@receiver(post_delete, sender=LikeDislike)
+@receiver(post_save, sender=BlogPostImage)
+@receiver(post_delete, sender=BlogPostImage)
+def invalidate_parent_post_fragments(sender, instance, origin=None, **kwargs):
+    # Deleted along with their post, which bumps its own version
+    if isinstance(origin, BlogPost):
+        return
+    bump_post_version(instance.post_id)
+
+
+@receiver(post_save, sender=BlogPost)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=LikeDislike)
+@receiver(post_delete, sender=LikeDislike)
+def rescore_post(sender, instance, raw=False, origin=None, **kwargs):
+    # Nothing to rescore when the post itself is being deleted; its score goes by CASCADE
+    if raw or isinstance(origin, BlogPost):
+        return
+    rescore_after_commit(instance.pk if sender is BlogPost else instance.post_id)
+
+
+def rescore_after_commit(post_id):
+    """
+    Rescore ``post_id`` once the current transaction commits, so the
+    reaction counters adjusted in it are included. The posts changed in one
+    transaction are rescored together by a single on_commit callback.
+    """
+    connection = transaction.get_connection()
+    flush = getattr(connection, 'pending_rescore', None)
+    # The callback is gone once it ran, or when the transaction (or savepoint) registering it rolled back
+    registered = flush is not None and any(callback is flush for _, callback, _ in connection.run_on_commit)
+    if not registered:
+        post_ids = set()
+
+        def flush():
+            if connection.pending_rescore is flush:
+                connection.pending_rescore = None
+            rescore_posts(post_ids)
+
+        flush.post_ids = post_ids
+        connection.pending_rescore = flush
+    flush.post_ids.add(post_id)
+    if not registered:
+        transaction.on_commit(flush)
+
+
+@receiver(post_save, sender=BlogPost)
+def fan_out_new_post(sender, instance, created, raw=False, **kwargs):
+    # Timeline entries are removed with the post by CASCADE
+    if created and not raw:
+        transaction.on_commit(lambda: fan_out_post(instance.pk))
+
+
+@receiver(post_delete, sender=BlogPost)
+def forget_deleted_post_in_home_counts(sender, instance, **kwargs):
+    # Pulled posts are counted too, so every follower's total is dropped, not only fanned out ones
+    author_id = instance.author_id
+    transaction.on_commit(lambda: forget_home_counts(author_id))
+
+
+@receiver(post_save, sender=BlogPost)
+def count_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.adjust(instance.author_id, posts=1, activity=instance.created_at)
+
+
+@receiver(post_delete, sender=BlogPost)
+def count_deleted_post(sender, instance, **kwargs):
+    UserStats.objects.adjust(instance.author_id, posts=-1, likes=-instance.likes_count)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.adjust(instance.author_id, comments=1, activity=instance.created_at)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    UserStats.objects.adjust(instance.author_id, comments=-1)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    # Password changes and login's last_login update are saves too
+    forget_user(instance.pk)
+
+
+@receiver(user_logged_in)
+@receiver(user_logged_out)
+def forget_user_on_session_change(sender, request, user, **kwargs):
+    if user is not None:
+        forget_user(user.pk)
@@ -0,0 +1,92 @@
+"""
+Content-addressed storage for post images.
+
+Uploads are stored once under a path derived from the SHA-256 of their
+bytes, so the same banner uploaded to many posts occupies one file and
+one CDN cache entry. Reference counting lives in posts.media.
+"""
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+CONTENT_ROOT = 'images'
+
+
+def content_name(digest, extension):
+    return f'{CONTENT_ROOT}/{digest[:2]}/{digest[2:4]}/{digest}{extension.lower()}'
+
+
+def is_content_addressed(name):
+    return bool(name) and name.startswith(CONTENT_ROOT + '/')
+
+
+def file_digest(content):
+    """SHA-256 of a Django File, read in chunks"""
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Saves every file under content_name() of its hash, ignoring the upload
+    name and upload_to. Saving bytes that are already stored writes nothing
+    and returns the existing name; the reference taken afterwards
+    (posts.media.acquire) stores the file again if it was deleted meanwhile.
+    """
+
+    def _save(self, name, content):
+        # Set by the hashing upload handlers; otherwise hash the file now
+        digest = getattr(content, 'content_hash', None) or file_digest(content)
+        target = content_name(digest, os.path.splitext(name)[1])
+        if self.exists(target):
+            return target
+        saved = super()._save(target, content)
+        if saved != target:
+            # Another request stored the same bytes first; keep its copy
+            super().delete(saved)
+        return target
+
+
+_storage = None
+
+
+def image_storage():
+    """Storage of BlogPost.image and BlogPostImage.image (a callable, so settings are read lazily)"""
+    global _storage
+    if _storage is None:
+        _storage = ContentAddressedStorage()
+    return _storage
+
+
+class HashingUploadMixin:
+    """Hash uploads while they stream in, so storing them needs no second pass over the data"""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        if uploaded is not None:
+            uploaded.content_hash = self.digest.hexdigest()
+        return uploaded
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    pass
@@ -0,0 +1,184 @@
+"""
+Reproducible synthetic data for load tests and benchmarks.
+
+generate_records() yields users' posts, comment threads and reactions in
+the JSON Lines format read by posts.bulk_import, so generate_dataset()
+loads them with the same bulk inserts as import_blog. The same seed and
+scale always produce the same records. Popularity is skewed the way real
+blogs are: a few authors write most posts, and a few posts collect most of
+the comments and reactions.
+"""
+import random
+from collections import namedtuple
+from datetime import timedelta
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db.models import Max
+from django.utils import timezone
+
+from .bulk_import import BlogImporter
+from .models import BlogPost, BlogPostImage, Comment
+from .renditions import render_variants, shared_renditions, store_variants
+from .storage import image_storage
+
+WORDS = (
+    'django query index cache latency render template thread comment reply post image feed '
+    'page cursor database replica shard token bucket profile reaction author reader draft '
+    'design review deploy metric budget window stream export import batch signal model view'
+).split()
+PALETTE = ((52, 101, 164), (204, 0, 0), (78, 154, 6), (245, 121, 0), (117, 80, 123), (193, 125, 17))
+
+# Comment and reaction counts are averages; popular posts get many times more
+Scale = namedtuple('Scale', ['users', 'posts', 'comments_per_post', 'reactions_per_post'])
+
+SCALES = {
+    'tiny': Scale(users=10, posts=20, comments_per_post=5, reactions_per_post=5),
+    'small': Scale(users=100, posts=500, comments_per_post=10, reactions_per_post=20),
+    'medium': Scale(users=1000, posts=10000, comments_per_post=20, reactions_per_post=50),
+    'large': Scale(users=10000, posts=100000, comments_per_post=30, reactions_per_post=100),
+}
+
+
+def _skewed_index(rng, count, alpha=1.2):
+    """An index in [0, count) where low indexes are much more likely (Pareto distributed)"""
+    return min(int(rng.paretovariate(alpha)) - 1, count - 1)
+
+
+def _sentence(rng, words=12):
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def rich_html(rng):
+    """Post body with the markup CKEditor produces: headings, lists, quotes, links, code and tables"""
+    blocks = []
+    for _ in range(rng.randint(2, 5)):
+        blocks.append(f'<h2>{_sentence(rng, 4)[:-1]}</h2>')
+        for _ in range(rng.randint(1, 3)):
+            blocks.append(
+                f'<p>{_sentence(rng)} <strong>{rng.choice(WORDS)}</strong> {_sentence(rng)} '
+                f'<a href="https://example.com/{rng.choice(WORDS)}">{rng.choice(WORDS)}</a> {_sentence(rng)}</p>'
+            )
+        kind = rng.randrange(4)
+        if kind == 0:
+            blocks.append('<ul>' + ''.join(f'<li>{_sentence(rng, 6)}</li>' for _ in range(rng.randint(2, 5))) + '</ul>')
+        elif kind == 1:
+            blocks.append(f'<blockquote><p>{_sentence(rng, 20)}</p></blockquote>')
+        elif kind == 2:
+            blocks.append(f'<pre><code>{rng.choice(WORDS)} = {rng.randint(1, 999)}\n</code></pre>')
+        else:
+            rows = ''.join(
+                f'<tr><td>{rng.choice(WORDS)}</td><td>{rng.randint(1, 999)}</td></tr>' for _ in range(3)
+            )
+            blocks.append(f'<table><tbody>{rows}</tbody></table>')
+    return '\n'.join(blocks)
+
+
+def palette_images(count=len(PALETTE)):
+    """
+    Store a few distinct JPEGs (content-addressed, so repeated runs reuse
+    them) with their renditions, and return {name: rendition metadata}
+    """
+    from PIL import Image, ImageDraw
+
+    storage = image_storage()
+    images = {}
+    for index, colour in enumerate(PALETTE[:count]):
+        image = Image.new('RGB', (1200, 800), colour)
+        draw = ImageDraw.Draw(image)
+        for stripe in range(0, 1200, 150):
+            draw.rectangle([stripe, 0, stripe + 60, 800], fill=tuple(min(c + 40, 255) for c in colour))
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', quality=80)
+        name = storage.save(f'synthetic-{index}.jpg', ContentFile(buffer.getvalue()))
+        images[name] = shared_renditions(name) or store_variants(name, render_variants(buffer.getvalue()))
+    return images
+
+
+def generate_records(scale, seed=0, image_names=(), first_post_id=1, first_comment_id=1, username_prefix='synthetic'):
+    """
+    Yield import records for ``scale``. Ids start at the given values so
+    generated rows never collide with existing ones.
+    """
+    rng = random.Random(seed)
+    usernames = [f'{username_prefix}-{n:05d}' for n in range(scale.users)]
+    image_names = list(image_names)
+    now = timezone.now().replace(microsecond=0)
+    comment_id = first_comment_id
+
+    for offset in range(scale.posts):
+        post_id = first_post_id + offset
+        created_at = now - timedelta(minutes=(scale.posts - offset) * 7)
+        images = []
+        if image_names:
+            images = [
+                {'url': rng.choice(image_names), 'caption': _sentence(rng, 3), 'order': order}
+                for order in range(rng.choice((0, 0, 1, 2, 3)))
+            ]
+        yield {
+            'type': 'post',
+            'id': post_id,
+            'title': _sentence(rng, rng.randint(3, 8))[:-1],
+            'author': usernames[_skewed_index(rng, scale.users)],
+            'content': rich_html(rng),
+            'image': rng.choice(image_names) if image_names and rng.random() < 0.7 else None,
+            'images': images,
+            'created_at': created_at.isoformat(),
+        }
+
+        # Comments and reactions concentrate on a minority of posts
+        popularity = min(rng.paretovariate(1.5), 20) / 3
+        thread = []
+        for _ in range(int(scale.comments_per_post * popularity)):
+            # Most comments reply to a recent comment, which builds deep threads
+            parent_id = thread[-rng.randint(1, min(len(thread), 3))] if thread and rng.random() < 0.6 else None
+            thread.append(comment_id)
+            yield {
+                'type': 'comment',
+                'id': comment_id,
+                'post_id': post_id,
+                'parent_id': parent_id,
+                'author': rng.choice(usernames),
+                'content': _sentence(rng, rng.randint(5, 40)),
+                'created_at': (created_at + timedelta(minutes=len(thread))).isoformat(),
+            }
+            comment_id += 1
+
+        reactors = rng.sample(usernames, min(int(scale.reactions_per_post * popularity), scale.users))
+        for username in reactors:
+            yield {'type': 'reaction', 'post_id': post_id, 'user': username, 'is_like': rng.random() < 0.8}
+
+
+def generate_dataset(scale, seed=0, batch_size=5000, with_images=True, username_prefix='synthetic', progress=None):
+    """
+    Bulk load a synthetic dataset into the database and return the
+    importer's counts. ``progress(counts)`` is called after every batch.
+    """
+    images = palette_images() if with_images else {}
+    ids = BlogPost.objects.aggregate(post=Max('pk'))
+    ids.update(Comment.objects.aggregate(comment=Max('pk')))
+    records = generate_records(
+        scale, seed=seed, image_names=images,
+        first_post_id=(ids['post'] or 0) + 1, first_comment_id=(ids['comment'] or 0) + 1,
+        username_prefix=username_prefix,
+    )
+
+    importer = BlogImporter()
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            importer.import_chunk(batch)
+            batch = []
+            if progress:
+                progress(importer.counts)
+    if batch:
+        importer.import_chunk(batch)
+    importer.finish()
+
+    # The palette images already have renditions; point the new rows at them
+    for name, metadata in images.items():
+        for model in (BlogPost, BlogPostImage):
+            model.objects.filter(image=name).exclude(image_renditions__source=name).update(image_renditions=metadata)
+    return importer.counts
@@ -0,0 +1,56 @@
+import re
+
+from django import template
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+SLOT_RE = re.compile(r'<!--user-slot ([\w/.-]+)((?: \w+=[\w-]*)*)-->')
+
+
+@register.simple_tag
+def user_slot(template_name, **kwargs):
+    """
+    Leave a placeholder for per-user markup inside a shared {% cache %} block.
+    The enclosing {% personalize %} renders ``template_name`` in its place
+    for the current request, with ``kwargs`` (ints or simple strings) in context.
+    """
+    args = ''.join(f' {key}={value}' for key, value in kwargs.items())
+    return format_html('<!--user-slot {}{}-->', template_name, mark_safe(args))
+
+
+class PersonalizeNode(template.Node):
+    def __init__(self, nodelist):
+        self.nodelist = nodelist
+
+    def render(self, context):
+        output = self.nodelist.render(context)
+        engine = context.template.engine
+        templates = {}
+
+        def fill(match):
+            name, raw_args = match.group(1), match.group(2)
+            if name not in templates:
+                templates[name] = engine.get_template(name)
+            values = {}
+            for pair in raw_args.split():
+                key, value = pair.split('=', 1)
+                values[key] = int(value) if value.lstrip('-').isdigit() else value
+            with context.push(**values):
+                return templates[name].render(context)
+
+        return SLOT_RE.sub(fill, output)
+
+
+@register.tag
+def personalize(parser, token):
+    """
+    {% personalize %}...{% endpersonalize %}
+
+    Fill the {% user_slot %} placeholders in the enclosed (usually cached)
+    output with markup rendered for the current user.
+    """
+    nodelist = parser.parse(('endpersonalize',))
+    parser.delete_first_token()
+    return PersonalizeNode(nodelist)
@@ -0,0 +1,36 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from posts.renditions import picture_html
+
+register = template.Library()
+
+
+def _renditions_for(image):
+    """Return the stored rendition specs for an image field file, if they are current"""
+    metadata = getattr(getattr(image, 'instance', None), 'image_renditions', None) or {}
+    if metadata.get('source') != image.name:
+        return {}
+    return metadata.get('specs', {})
+
+
+@register.simple_tag
+def responsive_image(image, spec='card', sizes='100vw', **attrs):
+    """
+    Render an <img> for an uploaded image using its resized renditions:
+    a <picture> with a WebP srcset and a JPEG fallback, plus intrinsic
+    width/height and lazy loading. Falls back to the original file while
+    renditions are still being generated.
+
+    Usage: {% responsive_image image 'card' sizes='33vw' class='card-img-top' alt=post.title %}
+    """
+    if not image:
+        return ''
+    attrs.setdefault('loading', 'lazy')
+    attrs.setdefault('decoding', 'async')
+
+    specs = _renditions_for(image)
+    if spec not in specs:
+        return format_html('<img src="{}"{}>', image.url, flatatt(attrs))
+    return picture_html(specs, spec, sizes, attrs)
@@ -1 +1,1713 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.test import RequestFactory, SimpleTestCase, TestCase, modify_settings, override_settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .auth import FAST_AUTH_SETTINGS, USER_KEY, CachedModelBackend
+from .benchmarks import SCENARIOS, compare, is_auth_query
+from .bulk_import import BlogImporter, InvalidRecord
+from .caching import attach_cache_versions, bump_post_versions, get_feed_version
+from .comments import load_comment_tree
+from .export import export_lines, parse_watermark
+from .models import (
+    BlogPost, BlogPostImage, Comment, Follow, LikeDislike, MediaFile, PostScore, ReactionEvent, ReplicaHeartbeat,
+    SearchDocument, SearchPosting, TimelineEntry, UserStats,
+)
+from .page_cache import get_stats
+from .pagination import CursorPaginator, EstimatedCountPaginator
+from .performance import PerformanceMiddleware, query_shape
+from .ranking import rescore_posts, rescore_recent
+from .rendering import RENDERER_VERSION, render_html
+from .reactions import apply_reaction, apply_reaction_events, get_user_reaction, recount_reactions, refresh_reaction_counters
+from .renditions import render_variants
+from .routers import ReplicaPinningMiddleware, ReplicaRouter, record_lag, require_fresh
+from .search import rank_posts
+from .storage import ContentAddressedStorage, image_storage
+from .synthetic import Scale, generate_dataset, generate_records
+from . import throttling
+from .throttling import InvalidRate, Rate, parse_rate
+from .timeline import follow
+
+
+def make_posts(author, count, images_per_post=2, comments_per_post=2):
+    """Create ``count`` posts, each with additional images, comments and a like."""
+    reader = User.objects.create_user(username=f'reader-{author.username}-{count}')
+    posts = []
+    for i in range(count):
+        post = BlogPost.objects.create(
+            title=f'Post {i}',
+            content='<p>' + 'Lorem ipsum dolor sit amet. ' * 10 + '</p>',
+            image='blog_images/main.jpg',
+            author=author,
+        )
+        for order in range(images_per_post):
+            BlogPostImage.objects.create(post=post, image=f'blog_images/additional/{i}-{order}.jpg', order=order)
+        for _ in range(comments_per_post):
+            Comment.objects.create(post=post, author=reader, content='A thoughtful comment')
+        LikeDislike.objects.create(post=post, user=reader, is_like=True)
+        post.adjust_reaction_counts(likes=1)
+        posts.append(post)
+    return posts
+
+
+class PostListQueryBudgetTests(TestCase):
+    """Feed pages must issue a fixed number of queries regardless of how many cards they show."""
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='secret')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_post_list_query_count_is_constant(self):
+        make_posts(self.author, 1)
+        one_card = self.count_queries(reverse('post_list'))
+
+        make_posts(self.author, 5)
+        full_page = self.count_queries(reverse('post_list'))
+
+        self.assertEqual(one_card, full_page)
+        # page count + posts with authors and comment counts + image prefetch
+        self.assertLessEqual(full_page, 3)
+
+    def test_my_posts_query_count_is_constant(self):
+        self.client.force_login(self.author)
+        make_posts(self.author, 1)
+        one_card = self.count_queries(reverse('my_posts'))
+
+        make_posts(self.author, 5)
+        full_page = self.count_queries(reverse('my_posts'))
+
+        self.assertEqual(one_card, full_page)
+
+    def test_card_data_uses_prefetched_images(self):
+        make_posts(self.author, 3)
+        posts = list(BlogPost.objects.with_card_data())
+        with self.assertNumQueries(0):
+            for post in posts:
+                self.assertEqual(len(post.get_all_images()), 3)
+                self.assertEqual(post.get_primary_image().name, 'blog_images/main.jpg')
+                self.assertEqual(post.total_comments(), 2)
+                self.assertEqual(post.total_likes(), 1)
+                self.assertEqual(post.author.username, 'author')
+
+
+class CommentTreeTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.post = BlogPost.objects.create(title='Threaded post', content='<p>Body</p>', author=self.author)
+
+    def add_thread(self, depth):
+        parent = None
+        for level in range(depth):
+            parent = Comment.objects.create(
+                post=self.post, author=self.author, parent=parent, content=f'Level {level} comment'
+            )
+        return parent
+
+    def test_paths_follow_thread_nesting(self):
+        leaf = self.add_thread(4)
+        self.assertEqual(leaf.depth, 3)
+        self.assertTrue(leaf.path.startswith(leaf.parent.path))
+        root = Comment.objects.get(post=self.post, parent=None)
+        self.assertEqual(Comment.objects.subtree(root).count(), 4)
+
+    def test_tree_loads_in_one_query_at_any_depth(self):
+        self.add_thread(5)
+        self.add_thread(2)
+        with self.assertNumQueries(1):
+            roots = load_comment_tree(self.post)
+            node, depth = roots[0], 1
+            while node.thread_replies:
+                node, depth = node.thread_replies[0], depth + 1
+                node.author.username
+        self.assertEqual(len(roots), 2)
+        self.assertEqual(depth, 5)
+
+    def test_inactive_comment_hides_its_replies(self):
+        leaf = self.add_thread(3)
+        Comment.objects.filter(pk=leaf.parent_id).update(active=False)
+        roots = load_comment_tree(self.post)
+        self.assertEqual(roots[0].thread_replies, [])
+
+    def test_post_detail_query_count_is_independent_of_comment_count(self):
+        self.add_thread(2)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(reverse('post_detail', args=[self.post.pk]))
+        for _ in range(10):
+            self.add_thread(3)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(reverse('post_detail', args=[self.post.pk]))
+        self.assertContains(response, 'Level 2 comment')
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        now = timezone.now()
+        # Several posts share a timestamp so the id tiebreaker is exercised
+        for i in range(14):
+            BlogPost.objects.create(
+                title=f'Post {i}', content='<p>Body</p>', author=self.author,
+                created_at=now - timedelta(minutes=i // 3),
+            )
+        self.expected = list(BlogPost.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+
+    def test_walks_forward_and_back_over_every_post(self):
+        paginator = CursorPaginator(BlogPost.objects.all(), 6)
+        page = paginator.get_page(None)
+        seen, numbers = [p.pk for p in page], [page.number]
+        while page.has_next():
+            page = paginator.get_page(page.next_cursor)
+            seen.extend(p.pk for p in page)
+            numbers.append(page.number)
+        self.assertEqual(seen, self.expected)
+        self.assertEqual(numbers, [1, 2, 3])
+
+        page = paginator.get_page(page.previous_cursor)
+        self.assertEqual([p.pk for p in page], self.expected[6:12])
+        page = paginator.get_page(page.previous_cursor)
+        self.assertEqual([p.pk for p in page], self.expected[:6])
+        self.assertFalse(page.has_previous())
+
+    def test_deep_page_costs_one_query(self):
+        paginator = CursorPaginator(BlogPost.objects.all(), 6)
+        cursor = paginator.get_page(None).next_cursor
+        cursor = paginator.get_page(cursor).next_cursor
+        with self.assertNumQueries(1):
+            page = paginator.get_page(cursor)
+            list(page)
+
+    def test_last_and_invalid_cursors(self):
+        paginator = CursorPaginator(BlogPost.objects.all(), 6)
+        last = paginator.get_page(CursorPaginator.LAST)
+        # Sized like the third page of the forward walk, so paging back keeps its boundaries
+        self.assertEqual([p.pk for p in last], self.expected[12:])
+        self.assertEqual(last.number, 3)
+        self.assertFalse(last.has_next())
+        page = paginator.get_page(last.previous_cursor)
+        self.assertEqual([p.pk for p in page], self.expected[6:12])
+        self.assertEqual(page.number, 2)
+        self.assertEqual(paginator.get_page('not-a-cursor').number, 1)
+
+    def test_post_list_follows_next_cursor(self):
+        first = self.client.get(reverse('post_list'))
+        next_cursor = first.context['page_obj'].next_cursor
+        response = self.client.get(reverse('post_list'), {'cursor': next_cursor})
+        self.assertEqual([p.pk for p in response.context['page_obj']], self.expected[6:12])
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.django_post = BlogPost.objects.create(
+            title='Django query optimization',
+            content='<p>Use <strong>select_related</strong> to avoid extra queries in Django views.</p>',
+            author=self.author,
+        )
+        self.cooking_post = BlogPost.objects.create(
+            title='Weekend cooking',
+            content='<p>A recipe that mentions Django once, among many cooking tips about cooking.</p>',
+            author=self.author,
+        )
+
+    def ranked_ids(self, query):
+        return [row['post_id'] for row in rank_posts(query)]
+
+    def test_html_is_stripped_before_indexing(self):
+        self.assertTrue(SearchPosting.objects.filter(post=self.django_post, term='select_related').exists())
+        self.assertFalse(SearchPosting.objects.filter(term='strong').exists())
+
+    def test_bm25_ranks_more_relevant_post_first(self):
+        self.assertEqual(self.ranked_ids('django'), [self.django_post.pk, self.cooking_post.pk])
+        self.assertEqual(self.ranked_ids('cooking'), [self.cooking_post.pk])
+        self.assertEqual(self.ranked_ids('the'), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.cooking_post.title = 'Baking bread'
+        self.cooking_post.content = '<p>Sourdough only.</p>'
+        self.cooking_post.save()
+        self.assertEqual(self.ranked_ids('cooking'), [])
+        self.assertEqual(self.ranked_ids('sourdough'), [self.cooking_post.pk])
+
+        self.django_post.delete()
+        self.assertEqual(self.ranked_ids('django'), [])
+        self.assertFalse(SearchDocument.objects.filter(post_id=self.django_post.pk).exists())
+
+    def test_search_view(self):
+        response = self.client.get(reverse('search'), {'q': 'query optimization'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['results'], [self.django_post])
+        self.assertContains(response, 'Django query optimization')
+
+
+class ImageRenditionTests(TestCase):
+    def test_render_variants_never_upscales(self):
+        from io import BytesIO
+        from PIL import Image
+
+        buffer = BytesIO()
+        Image.new('RGB', (800, 400), 'blue').save(buffer, 'PNG')
+        variants = render_variants(buffer.getvalue())
+
+        self.assertEqual((variants['thumbnail']['width'], variants['thumbnail']['height']), (320, 160))
+        self.assertEqual(variants['detail']['width'], 800)
+        self.assertTrue(variants['card']['webp'].startswith(b'RIFF'))
+        self.assertTrue(variants['card']['jpeg'].startswith(b'\xff\xd8'))
+
+    def test_responsive_image_uses_stored_metadata(self):
+        author = User.objects.create_user(username='author')
+        post = BlogPost.objects.create(title='Pictures', content='<p>Body</p>', author=author, image='blog_images/a.jpg')
+        template = Template("{% load post_images %}{% responsive_image post.image 'card' alt=post.title %}")
+
+        html = template.render(Context({'post': post}))
+        self.assertIn('src="/media/blog_images/a.jpg"', html)
+        self.assertNotIn('srcset', html)
+
+        post.image_renditions = {'source': 'blog_images/a.jpg', 'specs': {
+            spec: {'width': width, 'height': width // 2,
+                   'webp': f'renditions/a-{spec}.webp', 'jpeg': f'renditions/a-{spec}.jpeg'}
+            for spec, width in (('thumbnail', 320), ('card', 640), ('detail', 1280))
+        }}
+        html = template.render(Context({'post': post}))
+        self.assertIn('width="640"', html)
+        self.assertIn('loading="lazy"', html)
+        self.assertIn('renditions/a-thumbnail.webp 320w, /media/renditions/a-card.webp 640w"', html)
+        self.assertNotIn('a-detail', html)
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        self.post = BlogPost.objects.create(title='Cached post', content='<p>Body</p>', author=self.author)
+        self.comment = Comment.objects.create(post=self.post, author=self.author, content='First comment here')
+        self.url = reverse('post_detail', args=[self.post.pk])
+
+    def test_cached_comments_keep_per_user_controls(self):
+        edit_url = reverse('edit_comment', args=[self.comment.pk])
+
+        self.client.force_login(self.author)
+        self.assertContains(self.client.get(self.url), edit_url)
+
+        self.client.force_login(self.reader)
+        response = self.client.get(self.url)
+        self.assertContains(response, 'First comment here')
+        self.assertNotContains(response, edit_url)
+        self.assertContains(response, f'reply-form-{self.comment.pk}')
+
+        self.client.logout()
+        response = self.client.get(self.url)
+        self.assertNotContains(response, f'reply-form-{self.comment.pk}')
+        self.assertNotContains(response, 'user-slot')
+
+    def test_cache_hit_skips_comment_query_and_changes_invalidate(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url)
+        self.assertFalse(any('posts_comment' in q['sql'] for q in ctx.captured_queries))
+
+        Comment.objects.create(post=self.post, author=self.reader, content='A brand new reply', parent=self.comment)
+        self.assertContains(self.client.get(self.url), 'A brand new reply')
+
+        LikeDislike.objects.create(post=self.post, user=self.reader, is_like=True)
+        self.post.adjust_reaction_counts(likes=1)
+        self.assertContains(self.client.get(self.url), '<strong>Likes:</strong> 1')
+
+    def test_post_delete_bumps_the_post_not_each_child(self):
+        LikeDislike.objects.create(post=self.post, user=self.reader, is_like=True)
+        BlogPostImage.objects.create(post=self.post, image='blog_images/additional/x.jpg', order=0)
+        with mock.patch('posts.signals.bump_post_version') as bump:
+            self.post.delete()
+        bump.assert_not_called()
+
+
+class AnonymousPageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.post = BlogPost.objects.create(title='Popular post', content='<p>Body</p>', author=self.author)
+        self.url = reverse('post_detail', args=[self.post.pk])
+
+    def test_conditional_get_returns_304_without_queries(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertContains(response, 'Popular post')
+        self.assertEqual(get_stats()['hits'], 1)
+        self.assertEqual(get_stats()['not_modified'], 1)
+
+    def test_activity_changes_etag_and_content(self):
+        etag = self.client.get(self.url)['ETag']
+        Comment.objects.create(post=self.post, author=self.author, content='Fresh comment text')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Fresh comment text')
+
+        list_etag = self.client.get(reverse('post_list'))['ETag']
+        LikeDislike.objects.create(post=self.post, user=self.author, is_like=True)
+        self.assertNotEqual(self.client.get(reverse('post_list'))['ETag'], list_etag)
+
+    def test_logged_in_users_bypass_the_page_cache(self):
+        self.client.force_login(self.author)
+        response = self.client.get(self.url)
+        self.assertNotIn('ETag', response)
+        self.assertContains(response, reverse('edit_post', args=[self.post.pk]))
+
+
+class DerivedTextTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+
+    def test_save_derives_text_fields_from_content(self):
+        words = ' '.join(f'word{i}' for i in range(450))
+        post = BlogPost.objects.create(title='Long read', content=f'<p>Fish &amp; <b>chips</b></p><p>{words}</p>', author=self.author)
+        self.assertTrue(post.plain_text.startswith('Fish & chips word0'))
+        self.assertEqual(post.word_count, 453)
+        self.assertEqual(post.reading_time, 3)
+        self.assertEqual(post.excerpt, 'Fish & chips ' + ' '.join(f'word{i}' for i in range(17)) + ' …')
+
+        post.content = '<p>Short now</p>'
+        post.save(update_fields=['content'])
+        post.refresh_from_db()
+        self.assertEqual((post.excerpt, post.word_count, post.reading_time), ('Short now', 2, 1))
+
+    def test_backfill_command(self):
+        post = BlogPost.objects.create(title='Legacy', content='<p>Old body text</p>', author=self.author)
+        BlogPost.objects.filter(pk=post.pk).update(plain_text='', excerpt='', word_count=0, reading_time=0)
+        call_command('backfill_post_text', batch_size=1, stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual((post.plain_text, post.word_count), ('Old body text', 3))
+
+    def test_cards_do_not_load_content(self):
+        BlogPost.objects.create(title='Card', content='<p>Body text</p>', author=self.author)
+        post = BlogPost.objects.with_card_data().get()
+        self.assertIn('content', post.get_deferred_fields())
+        with self.assertNumQueries(0):
+            self.assertEqual(post.excerpt, 'Body text')
+
+
+class ReactionCounterTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        self.post = BlogPost.objects.create(title='Post', content='<p>Body</p>', author=self.author)
+
+    def counts(self):
+        self.post.refresh_from_db()
+        return self.post.likes_count, self.post.dislikes_count
+
+    def test_create_remove_and_flip(self):
+        self.assertEqual(apply_reaction(self.reader, self.post, 'like'), 'like')
+        self.assertEqual(self.counts(), (1, 0))
+        # The same button again removes the reaction
+        self.assertIsNone(apply_reaction(self.reader, self.post, 'like'))
+        self.assertEqual(self.counts(), (0, 0))
+        self.assertFalse(LikeDislike.objects.exists())
+
+        self.assertEqual(apply_reaction(self.reader, self.post, 'dislike'), 'dislike')
+        self.assertEqual(self.counts(), (0, 1))
+        self.assertEqual(apply_reaction(self.reader, self.post, 'like'), 'like')
+        self.assertEqual(self.counts(), (1, 0))
+        self.assertEqual(apply_reaction(self.reader, self.post, 'dislike'), 'dislike')
+        self.assertEqual(self.counts(), (0, 1))
+        self.assertEqual(LikeDislike.objects.get().is_like, False)
+
+    def test_retries_once_after_a_concurrent_insert(self):
+        create = LikeDislike.objects.create
+        calls = []
+
+        def racing_create(**kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                raise IntegrityError('duplicate key value violates unique constraint')
+            return create(**kwargs)
+
+        with mock.patch.object(LikeDislike.objects, 'create', side_effect=racing_create):
+            self.assertEqual(apply_reaction(self.reader, self.post, 'like'), 'like')
+        self.assertEqual(len(calls), 2)
+        # The failed attempt rolled back before touching the counters
+        self.assertEqual(self.counts(), (1, 0))
+
+        with mock.patch.object(LikeDislike.objects, 'create', side_effect=IntegrityError('still failing')):
+            with self.assertRaises(IntegrityError):
+                apply_reaction(User.objects.create_user(username='other'), self.post, 'like')
+        self.assertEqual(self.counts(), (1, 0))
+
+    def test_recount_command_reports_then_fixes_drift(self):
+        apply_reaction(self.reader, self.post, 'like')
+        in_sync = BlogPost.objects.create(title='In sync', content='<p>Body</p>', author=self.author)
+        BlogPost.objects.filter(pk=self.post.pk).update(likes_count=5, dislikes_count=2)
+
+        out = StringIO()
+        call_command('recount_reactions', '--dry-run', stdout=out)
+        self.assertIn(f'Post {self.post.pk} "Post": likes 5 -> 1, dislikes 2 -> 0', out.getvalue())
+        self.assertNotIn(f'Post {in_sync.pk} ', out.getvalue())
+        self.assertIn('1 post(s) have drifted counters (dry run, nothing written).', out.getvalue())
+        self.assertEqual(self.counts(), (5, 2))
+
+        out = StringIO()
+        call_command('recount_reactions', stdout=out)
+        self.assertIn('Fixed reaction counters on 1 post(s).', out.getvalue())
+        self.assertEqual(self.counts(), (1, 0))
+        self.assertEqual(UserStats.for_user(self.author).likes_received, 1)
+
+        out = StringIO()
+        call_command('recount_reactions', stdout=out)
+        self.assertIn('All reaction counters are in sync.', out.getvalue())
+
+
+@override_settings(POSTS_REACTION_MODE='buffered')
+class BufferedReactionTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.readers = [User.objects.create_user(username=f'reader{i}') for i in range(3)]
+        self.post = BlogPost.objects.create(title='Viral post', content='<p>Body</p>', author=self.author)
+        self.url = reverse('like_dislike_post', args=[self.post.pk])
+
+    def click(self, user, action):
+        self.client.force_login(user)
+        return self.client.post(self.url, {'action': action}).json()
+
+    def test_endpoint_reports_user_state_before_events_are_applied(self):
+        self.assertEqual(self.click(self.readers[0], 'like'), {'likes_count': 1, 'dislikes_count': 0, 'user_reaction': 'like'})
+        self.assertEqual(self.click(self.readers[0], 'dislike'), {'likes_count': 0, 'dislikes_count': 1, 'user_reaction': 'dislike'})
+        self.assertFalse(LikeDislike.objects.exists())
+        self.assertEqual(get_user_reaction(self.readers[0], self.post), 'dislike')
+
+    def test_batch_applies_net_effect_once(self):
+        LikeDislike.objects.create(user=self.readers[2], post=self.post, is_like=True)
+        self.post.adjust_reaction_counts(likes=1)
+
+        self.click(self.readers[0], 'like')
+        self.click(self.readers[0], 'like')      # toggled off again
+        self.click(self.readers[1], 'like')
+        self.click(self.readers[1], 'dislike')
+        self.click(self.readers[2], 'like')      # removes the existing like
+
+        self.assertEqual(apply_reaction_events(), 5)
+        self.assertEqual(ReactionEvent.objects.count(), 0)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.dislikes_count), (0, 1))
+        self.assertEqual(
+            list(LikeDislike.objects.values_list('user__username', 'is_like')),
+            [('reader1', False)],
+        )
+        self.assertEqual(recount_reactions(), [])
+
+
+@override_settings(ROOT_URLCONF='posts.benchmark_urls', POSTS_BENCHMARK_BASE_URLCONF=settings.ROOT_URLCONF)
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        self.post = BlogPost.objects.create(title='Async post', content='<p>Body</p>', author=self.author)
+        Comment.objects.create(post=self.post, author=self.reader, content='First!')
+        LikeDislike.objects.create(user=self.reader, post=self.post, is_like=False)
+        self.post.adjust_reaction_counts(dislikes=1)
+
+    async def test_post_detail_matches_sync_view(self):
+        await self.async_client.aforce_login(self.reader)
+        sync = await self.async_client.get(f'/__bench__/sync/post/{self.post.pk}/')
+        cache.clear()
+        response = await self.async_client.get(f'/__bench__/async/post/{self.post.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['user_reaction'], 'dislike')
+        self.assertContains(response, 'First!')
+        self.assertEqual(response.content, sync.content.replace(
+            sync.context['csrf_token'].encode(), response.context['csrf_token'].encode(),
+        ))
+
+        missing = await self.async_client.get('/__bench__/async/post/999999/')
+        self.assertEqual(missing.status_code, 404)
+
+    async def test_post_list_pages(self):
+        await BlogPost.objects.abulk_create(
+            BlogPost(title=f'Post {i}', content='<p>x</p>', author=self.author) for i in range(7)
+        )
+        response = await self.async_client.get('/__bench__/async/')
+        page_obj = response.context['page_obj']
+        self.assertEqual((len(page_obj), page_obj.paginator.count), (6, 8))
+        response = await self.async_client.get(f'/__bench__/async/?cursor={page_obj.next_cursor}')
+        self.assertEqual([post.title for post in response.context['page_obj']], ['Post 0', 'Async post'])
+
+    async def test_like_dislike_toggles_in_both_modes(self):
+        await self.async_client.aforce_login(self.reader)
+        url = f'/__bench__/async/post/{self.post.pk}/like-dislike/'
+
+        response = await self.async_client.post(url, {'action': 'like'})
+        self.assertEqual(response.json(), {'likes_count': 1, 'dislikes_count': 0, 'user_reaction': 'like'})
+
+        with override_settings(POSTS_REACTION_MODE='buffered'):
+            response = await self.async_client.post(url, {'action': 'like'})
+            self.assertEqual(response.json(), {'likes_count': 0, 'dislikes_count': 0, 'user_reaction': None})
+            self.assertEqual(await ReactionEvent.objects.acount(), 1)
+
+        response = await self.async_client.post(url, {'action': 'bogus'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.staff = User.objects.create_user(username='staff', is_staff=True)
+        self.old = BlogPost.objects.create(title='Old', content='<p>Old</p>', author=self.author)
+        root = Comment.objects.create(post=self.old, author=self.author, content='Root')
+        Comment.objects.create(post=self.old, author=self.author, content='Reply', parent=root)
+        LikeDislike.objects.create(user=self.staff, post=self.old, is_like=True)
+        yesterday = timezone.now() - timedelta(days=1)
+        BlogPost.objects.update(created_at=yesterday, updated_at=yesterday)
+        Comment.objects.update(created_at=yesterday, updated_at=yesterday)
+        LikeDislike.objects.update(created_at=yesterday)
+
+    def read(self, lines):
+        return [json.loads(line) for line in lines]
+
+    def test_full_export_streams_every_record_type(self):
+        records = self.read(export_lines())
+        self.assertEqual([r['type'] for r in records], ['post', 'comment', 'comment', 'reactions', 'watermark'])
+        self.assertEqual(records[2]['parent_id'], records[1]['id'])
+        self.assertEqual(records[3], {'type': 'reactions', 'post_id': self.old.pk, 'likes': 1, 'dislikes': 0})
+
+    def test_incremental_export_uses_watermark(self):
+        watermark = self.read(export_lines())[-1]['watermark']
+        new = BlogPost.objects.create(title='New', content='<p>New</p>', author=self.author)
+        Comment.objects.create(post=self.old, author=self.author, content='Late')
+
+        out = StringIO()
+        call_command('export_blog', since=watermark, stdout=out, stderr=StringIO())
+        records = self.read(out.getvalue().splitlines())
+        self.assertEqual(
+            [(r['type'], r.get('title') or r.get('content')) for r in records[:-1]],
+            [('post', 'New'), ('comment', 'Late')],
+        )
+        self.assertNotEqual(records[-1]['watermark'], watermark)
+
+    def test_incremental_export_includes_edited_comments(self):
+        watermark = self.read(export_lines())[-1]['watermark']
+        comment = Comment.objects.get(content='Reply')
+        comment.active = False
+        comment.save()
+
+        records = self.read(export_lines(types=['comments'], since=parse_watermark(watermark)))
+        self.assertEqual([(r['id'], r['active']) for r in records[:-1]], [(comment.pk, False)])
+
+    def test_api_is_staff_only_and_streams(self):
+        url = reverse('export')
+        self.client.force_login(self.author)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(url, {'types': 'posts'})
+        self.assertTrue(response.streaming)
+        records = self.read(b''.join(response.streaming_content).decode().splitlines())
+        self.assertEqual([r['type'] for r in records], ['post', 'watermark'])
+        self.assertEqual(self.client.get(url, {'since': 'yesterday'}).status_code, 400)
+
+
+class BulkImportTests(TestCase):
+    RECORDS = [
+        {'type': 'post', 'id': 501, 'title': 'Imported', 'author': 'olduser', 'content': '<p>Hello there</p>',
+         'image': '/media/blog_images/a.jpg', 'images': [{'url': '/media/blog_images/additional/b.jpg', 'order': 1}],
+         'created_at': '2020-01-01T10:00:00Z'},
+        # A reply that arrives before its parent
+        {'type': 'comment', 'id': 902, 'post_id': 501, 'parent_id': 901, 'author': 'reader', 'content': 'Reply'},
+        {'type': 'reaction', 'post_id': 501, 'user': 'reader', 'is_like': True},
+        {'type': 'comment', 'id': 901, 'post_id': 501, 'parent_id': None, 'author': 'olduser', 'content': 'Root'},
+        {'type': 'reaction', 'post_id': 501, 'user': 'other', 'is_like': False},
+        {'type': 'watermark', 'watermark': '2020-01-02T00:00:00Z'},
+    ]
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.jsonl')
+        with os.fdopen(handle, 'w') as f:
+            f.writelines(json.dumps(record) + '\n' for record in self.RECORDS)
+        self.addCleanup(lambda: [os.remove(p) for p in (self.path, self.path + '.checkpoint') if os.path.exists(p)])
+
+    def run_import(self, **options):
+        out = StringIO()
+        call_command('import_blog', self.path, batch_size=2, stdout=out, **options)
+        return out.getvalue()
+
+    def test_import_links_threads_and_counters(self):
+        output = self.run_import()
+        self.assertIn('rows/s', output)
+
+        post = BlogPost.objects.get(pk=501)
+        self.assertEqual((post.author.username, post.image.name, post.plain_text), ('olduser', 'blog_images/a.jpg', 'Hello there'))
+        self.assertEqual(post.additional_images.get().image.name, 'blog_images/additional/b.jpg')
+        self.assertEqual((post.likes_count, post.dislikes_count), (1, 1))
+        self.assertFalse(User.objects.get(username='reader').has_usable_password())
+
+        reply = Comment.objects.get(pk=902)
+        self.assertEqual((reply.parent_id, reply.path), (901, reply.parent.path + Comment.path_segment(902)))
+        self.assertEqual([c.pk for c in load_comment_tree(post)], [901])
+
+    def test_rerun_resumes_from_checkpoint(self):
+        self.run_import()
+        self.assertIn('already imported', self.run_import())
+
+        # Replaying everything (e.g. after losing the checkpoint) does not duplicate rows
+        self.run_import(restart=True)
+        self.assertEqual(
+            (BlogPost.objects.count(), Comment.objects.count(), LikeDislike.objects.count(), BlogPostImage.objects.count()),
+            (1, 2, 2, 1),
+        )
+
+    def test_replay_links_replies_written_before_the_checkpoint(self):
+        # The reply was written, but the checkpoint holding its pending parent was lost
+        BlogImporter().import_chunk(self.RECORDS[:2])
+        self.assertEqual(Comment.objects.get(pk=902).path, '')
+
+        importer = BlogImporter()
+        importer.import_chunk(self.RECORDS)
+        importer.finish()
+        reply = Comment.objects.get(pk=902)
+        self.assertEqual((reply.parent_id, reply.path), (901, reply.parent.path + Comment.path_segment(902)))
+
+    def test_finish_only_recounts_the_import(self):
+        local = BlogPost.objects.create(title='Local', content='<p>Mine</p>', author=User.objects.create_user(username='local'))
+        # Deliberately out of step; settling that is recount_reactions' job, not the importer's
+        BlogPost.objects.filter(pk=local.pk).update(likes_count=7)
+        with mock.patch.object(UserStats.objects, 'rebuild', wraps=UserStats.objects.rebuild) as rebuild:
+            self.run_import()
+        self.assertEqual(BlogPost.objects.get(pk=local.pk).likes_count, 7)
+        self.assertEqual((BlogPost.objects.get(pk=501).likes_count, BlogPost.objects.get(pk=501).dislikes_count), (1, 1))
+        rebuilt = {user_id for call in rebuild.call_args_list for user_id in call.args[0]}
+        self.assertEqual(rebuilt, set(User.objects.filter(username__in=['olduser', 'reader', 'other']).values_list('pk', flat=True)))
+
+    def test_source_ids_never_attach_to_local_rows(self):
+        author = User.objects.create_user(username='local')
+        local = BlogPost.objects.create(title='Local', content='<p>Mine</p>', author=author)
+        importer = BlogImporter()
+        # Records of a post the file does not contain are dropped, not attached to the local post
+        importer.import_chunk([
+            {'type': 'comment', 'id': 950, 'post_id': local.pk, 'author': 'reader', 'content': 'Stray'},
+            {'type': 'reaction', 'post_id': local.pk, 'user': 'reader', 'is_like': True},
+        ])
+        self.assertEqual((importer.counts['comments without post'], importer.counts['reactions without post']), (1, 1))
+        self.assertFalse(local.comments.exists() or local.likes.exists())
+
+        # A source post whose id is taken by a different local post rejects the chunk
+        with self.assertRaisesMessage(InvalidRecord, f'Post {local.pk} already exists with different content'):
+            importer.import_chunk([
+                {'type': 'post', 'id': local.pk, 'title': 'Imported', 'author': 'olduser', 'content': '<p>Theirs</p>'},
+                {'type': 'comment', 'id': 951, 'post_id': local.pk, 'author': 'reader', 'content': 'Hello'},
+            ])
+        self.assertFalse(local.comments.exists())
+        self.assertEqual(BlogPost.objects.get().title, 'Local')
+
+
+@override_settings(POSTS_RENDITIONS_ASYNC=False)
+class ContentAddressedMediaTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.author = User.objects.create_user(username='author')
+
+    def upload(self, color='red', name='banner.png'):
+        from io import BytesIO
+        from PIL import Image
+
+        buffer = BytesIO()
+        Image.new('RGB', (40, 20), color).save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def test_identical_uploads_share_one_file_until_last_reference_goes(self):
+        first = BlogPost.objects.create(title='One', content='x', author=self.author, image=self.upload())
+        second = BlogPost.objects.create(title='Two', content='x', author=self.author, image=self.upload(name='copy.PNG'))
+        extra = BlogPostImage.objects.create(post=second, image=self.upload())
+        other = BlogPostImage.objects.create(post=second, image=self.upload('blue'))
+
+        name = first.image.name
+        self.assertTrue(name.startswith('images/') and name.endswith('.png'))
+        self.assertEqual({second.image.name, extra.image.name}, {name})
+        self.assertNotEqual(other.image.name, name)
+        self.assertEqual(MediaFile.objects.get(name=name).ref_count, 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(image_storage().exists(name))
+
+        # Renditions are generated once and shared by every row with the image
+        with self.captureOnCommitCallbacks(execute=True):
+            second.save()
+            extra.save()
+        second.refresh_from_db()
+        extra.refresh_from_db()
+        self.assertEqual(second.image_renditions, extra.image_renditions)
+        rendition = second.image_renditions['specs']['card']['webp']
+        self.assertTrue(default_storage.exists(rendition))
+
+        # Deleting the post cascades to its images, releasing every reference
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(image_storage().exists(name))
+        self.assertFalse(default_storage.exists(rendition))
+        self.assertFalse(image_storage().exists(other.image.name))
+        self.assertFalse(MediaFile.objects.exists())
+
+    def test_replacing_an_image_releases_the_old_one(self):
+        post = BlogPost.objects.create(title='One', content='x', author=self.author, image=self.upload())
+        old_name = post.image.name
+        post.image = self.upload('green')
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+        self.assertFalse(image_storage().exists(old_name))
+        self.assertEqual(list(MediaFile.objects.values_list('name', 'ref_count')), [(post.image.name, 1)])
+
+    def test_file_deleted_before_the_reference_is_taken_is_stored_again(self):
+        storage = image_storage()
+        save = ContentAddressedStorage._save
+        calls = []
+
+        def save_then_lose(self, name, content):
+            saved = save(self, name, content)
+            calls.append(saved)
+            if len(calls) == 1:
+                # A concurrent delete_if_unreferenced removes the file the upload found
+                storage.delete(saved)
+            return saved
+
+        with mock.patch.object(ContentAddressedStorage, '_save', save_then_lose):
+            post = BlogPost.objects.create(title='One', content='x', author=self.author, image=self.upload())
+        name = post.image.name
+        self.assertEqual(calls, [name, name])
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(MediaFile.objects.filter(name=name, ref_count=1, size=storage.size(name)).count(), 1)
+
+        # Without the uploaded bytes at hand the reference is refused
+        storage.delete(name)
+        with self.assertRaises(FileNotFoundError):
+            BlogPost.objects.create(title='Two', content='x', author=self.author, image=name)
+
+    def test_bulk_imported_rows_take_references(self):
+        post = BlogPost.objects.create(title='One', content='x', author=self.author, image=self.upload())
+        name = post.image.name
+        importer = BlogImporter()
+        importer.import_chunk([
+            {'type': 'post', 'id': post.pk + 1, 'title': 'Imported', 'author': 'olduser', 'image': settings.MEDIA_URL + name},
+        ])
+        importer.finish()
+        self.assertEqual(MediaFile.objects.get(name=name).ref_count, 2)
+
+        # The imported post still uses the file after the upload that stored it goes
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        self.assertTrue(image_storage().exists(name))
+        self.assertEqual(MediaFile.objects.get(name=name).ref_count, 1)
+
+    def test_dedupe_media_merges_existing_files(self):
+        storage = image_storage()
+        for name in ('blog_images/a.jpg', 'blog_images/additional/b.jpg', 'blog_images/c.jpg'):
+            path = os.path.join(self.media_root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'unique' if name.endswith('c.jpg') else b'same bytes')
+        post = BlogPost.objects.create(title='One', content='x', author=self.author, image='blog_images/a.jpg')
+        image = BlogPostImage.objects.create(post=post, image='blog_images/additional/b.jpg')
+        other = BlogPost.objects.create(title='Two', content='x', author=self.author, image='blog_images/c.jpg')
+
+        out = StringIO()
+        call_command('dedupe_media', stdout=out)
+        self.assertIn('1 duplicate(s) merged', out.getvalue())
+
+        post.refresh_from_db()
+        image.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(post.image.name, image.image.name)
+        self.assertTrue(storage.exists(post.image.name))
+        self.assertFalse(storage.exists('blog_images/a.jpg') or storage.exists('blog_images/additional/b.jpg'))
+        self.assertEqual(dict(MediaFile.objects.values_list('name', 'ref_count')), {post.image.name: 2, other.image.name: 1})
+
+
+class UserStatsTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='pw')
+        self.reader = User.objects.create_user(username='reader')
+
+    def assertStatsMatchRebuild(self, user):
+        stats = UserStats.objects.get(user=user)
+        rebuilt = UserStats.objects.rebuild([user.pk])[0]
+        self.assertEqual(
+            (stats.post_count, stats.comment_count, stats.likes_received, stats.last_activity),
+            (rebuilt.post_count, rebuilt.comment_count, rebuilt.likes_received, rebuilt.last_activity),
+        )
+
+    def test_counters_follow_posts_comments_and_reactions(self):
+        UserStats.for_user(self.author)
+        UserStats.for_user(self.reader)
+        posts = make_posts(self.author, 3)
+        self.client.force_login(self.reader)
+        self.client.post(reverse('like_dislike_post', args=[posts[0].pk]), {'action': 'like'})
+        Comment.objects.create(post=posts[1], author=self.author, content='Self reply')
+        posts[2].delete()
+
+        stats = UserStats.objects.get(user=self.author)
+        self.assertEqual((stats.post_count, stats.comment_count, stats.likes_received), (2, 1, 3))
+        self.assertStatsMatchRebuild(self.author)
+
+        with override_settings(POSTS_REACTION_MODE='buffered'):
+            self.client.post(reverse('like_dislike_post', args=[posts[1].pk]), {'action': 'like'})
+            apply_reaction_events()
+        self.assertEqual(UserStats.objects.get(user=self.author).likes_received, 4)
+        self.assertStatsMatchRebuild(self.author)
+
+    def test_profile_uses_constant_queries(self):
+        self.client.force_login(self.author)
+        make_posts(self.author, 2)
+        self.client.get(reverse('profile'))
+
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(reverse('profile'))
+        make_posts(self.author, 10)
+        for post in BlogPost.objects.all()[:8]:
+            Comment.objects.create(post=post, author=self.author, content='Mine')
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(reverse('profile'))
+
+        self.assertEqual(len(small), len(large))
+        self.assertFalse(any('"rendered_html"' in q['sql'] for q in large.captured_queries if 'posts_blogpost' in q['sql']))
+        self.assertEqual(len(response.context['user_posts']), 6)
+        self.assertEqual(response.context['total_posts'], 12)
+        self.assertEqual(response.context['more_comments'], 3)
+        self.assertContains(response, 'View all 12 posts')
+
+
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='pw')
+        self.client.force_login(self.admin)
+
+    def changelist_queries(self, model_name):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f'admin:posts_{model_name}_changelist'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelists_use_constant_queries(self):
+        make_posts(self.admin, 2)
+        before = {name: self.changelist_queries(name) for name in ('blogpost', 'comment', 'likedislike')}
+        posts = make_posts(self.admin, 10)
+        Comment.objects.create(post=posts[0], author=self.admin, content='Reply', parent=posts[0].comments.first())
+        after = {name: self.changelist_queries(name) for name in ('blogpost', 'comment', 'likedislike')}
+        self.assertEqual(before, after)
+
+        response = self.client.get(reverse('admin:posts_blogpost_changelist'))
+        self.assertEqual(response.context['cl'].result_list[0].image_total, 3)
+
+    def test_estimated_paginator_caps_filtered_counts(self):
+        class SmallLimitPaginator(EstimatedCountPaginator):
+            COUNT_LIMIT = 2
+
+        make_posts(self.admin, 3, images_per_post=0, comments_per_post=0)
+        self.assertEqual(SmallLimitPaginator(BlogPost.objects.filter(likes_count=1), 10).count, 2)
+        # Unfiltered small tables are counted exactly
+        self.assertEqual(SmallLimitPaginator(BlogPost.objects.all(), 10).count, 3)
+
+
+@modify_settings(MIDDLEWARE={'append': 'posts.performance.PerformanceMiddleware'})
+@override_settings(POSTS_PERFORMANCE_FLUSH_SECONDS=0)
+class PerformanceMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='perf', password='pw')
+        make_posts(self.author, 3)
+
+    def test_reports_queries_and_timings(self):
+        with CaptureQueriesContext(connection) as queries:
+            with self.assertLogs('posts.performance', 'INFO') as logs:
+                response = self.client.get(reverse('post_list'))
+        query_count = len(queries)
+
+        timing = response['Server-Timing']
+        self.assertIn(f'desc="{query_count} queries"', timing)
+        self.assertRegex(timing, r'tpl;dur=[\d.]+')
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['view'], 'post_list')
+        self.assertEqual(record['queries'], query_count)
+        self.assertGreater(record['template_ms'], 0)
+
+        staff = User.objects.create_user(username='staff', password='pw', is_staff=True)
+        self.client.force_login(staff)
+        rows = self.client.get(reverse('performance_stats'), {'format': 'json'}).json()['views']
+        post_list = next(row for row in rows if row['view'] == 'post_list')
+        self.assertEqual(post_list['requests'], 1)
+        self.assertEqual(post_list['avg_queries'], query_count)
+        self.assertContains(self.client.get(reverse('performance_stats')), '<code>post_list</code>')
+
+    def test_flags_repeated_query_shapes(self):
+        def n_plus_one_view(request):
+            for post in BlogPost.objects.all():
+                post.author.username
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.resolver_match = None
+        with override_settings(POSTS_PERFORMANCE_N_PLUS_ONE_THRESHOLD=3):
+            with self.assertLogs('posts.performance', 'WARNING') as logs:
+                response = PerformanceMiddleware(n_plus_one_view)(request)
+
+        self.assertIn('nplusone;desc="1 repeated query shapes"', response['Server-Timing'])
+        suspect, = json.loads(logs.records[-1].getMessage())['n_plus_one']
+        self.assertEqual(suspect['count'], 3)
+        self.assertIn('auth_user', suspect['sql'])
+
+    def test_query_shapes_fold_in_lists(self):
+        self.assertEqual(
+            query_shape('SELECT 1 FROM t WHERE id IN (%s, %s, %s) LIMIT 21'),
+            query_shape('SELECT 1 FROM t WHERE id IN (%s) LIMIT 5'),
+        )
+
+    @override_settings(POSTS_PERFORMANCE_ENABLED=False)
+    def test_disabled_middleware_is_removed(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            PerformanceMiddleware(lambda request: HttpResponse())
+        self.assertNotIn('Server-Timing', self.client.get(reverse('post_list')))
+
+
+class SyntheticDataTests(TestCase):
+    scale = Scale(users=6, posts=15, comments_per_post=6, reactions_per_post=4)
+
+    def test_records_are_reproducible(self):
+        first = [record['title'] for record in generate_records(self.scale, seed=7) if record['type'] == 'post']
+        again = [record['title'] for record in generate_records(self.scale, seed=7) if record['type'] == 'post']
+        other = [record['title'] for record in generate_records(self.scale, seed=8) if record['type'] == 'post']
+        self.assertEqual(first, again)
+        self.assertNotEqual(first, other)
+
+    def test_generates_threads_and_skewed_activity(self):
+        counts = generate_dataset(self.scale, seed=1, with_images=False)
+
+        self.assertEqual(BlogPost.objects.count(), 15)
+        self.assertEqual(Comment.objects.count(), counts['comments'])
+        self.assertTrue(any(comment.depth >= 2 for comment in Comment.objects.all()))
+        post = BlogPost.objects.order_by('-likes_count').first()
+        self.assertEqual(post.likes_count, post.likes.filter(is_like=True).count())
+        per_post = Counter(Comment.objects.values_list('post_id', flat=True))
+        self.assertGreater(max(per_post.values()), 2 * sum(per_post.values()) / 15)
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        generate_dataset(Scale(users=4, posts=8, comments_per_post=3, reactions_per_post=2), with_images=False)
+        self.baseline = os.path.join(tempfile.mkdtemp(), 'baseline.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.baseline))
+
+    def test_compare_flags_query_and_latency_regressions(self):
+        baseline = {'post_list': {'p50_ms': 10.0, 'p95_ms': 20.0, 'queries': 3}}
+        self.assertEqual(compare({'post_list': {'p50_ms': 14.0, 'p95_ms': 24.0, 'queries': 3}}, baseline), [])
+        regressions = compare({'post_list': {'p50_ms': 30.0, 'p95_ms': 20.0, 'queries': 4}}, baseline)
+        self.assertEqual(len(regressions), 2)
+        self.assertIn('4 queries per request (baseline 3)', regressions[0])
+
+    def test_run_against_baseline(self):
+        reactions = LikeDislike.objects.count()
+        call_command(
+            'benchmark_views', '--current-database', '--iterations', '2',
+            '--baseline', self.baseline, '--save-baseline', stdout=StringIO(),
+        )
+        with open(self.baseline) as f:
+            saved = json.load(f)
+        self.assertEqual(set(saved['views']), set(SCENARIOS))
+        self.assertTrue(all(result['queries'] > 0 for result in saved['views'].values()))
+        # The like/dislike scenario leaves the reactions as they were
+        self.assertEqual(LikeDislike.objects.count(), reactions)
+
+        saved['views']['post_detail']['queries'] -= 1
+        with open(self.baseline, 'w') as f:
+            json.dump(saved, f)
+        with self.assertRaisesMessage(CommandError, 'post_detail'):
+            call_command(
+                'benchmark_views', '--current-database', '--iterations', '2', '--views', 'post_detail',
+                '--baseline', self.baseline, '--min-delta-ms', '1000', stdout=StringIO(),
+            )
+
+    def test_auth_comparison(self):
+        out = StringIO()
+        call_command('benchmark_auth', '--current-database', '--iterations', '2', stdout=out)
+        self.assertIn('post_list (anonymous)', out.getvalue())
+        self.assertIn('session/user queries 2 -> 0', out.getvalue())
+
+
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'Query plans are checked on SQLite and PostgreSQL')
+@override_settings(POSTS_PAGE_CACHE_ENABLED=False)
+class QueryPlanTests(TestCase):
+    """The queries the hot views issue must be answered from an index, without sorting or scanning a table."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='planner', password='pw')
+        self.posts = make_posts(self.author, 8)
+        other = User.objects.create_user(username='other-author')
+        make_posts(other, 4)
+        self.client.force_login(self.author)
+
+    def plan(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # The test tables are tiny; make the planner show what it does once they are not
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql)
+                return '\n'.join(row[0] for row in cursor.fetchall())
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+
+    def view_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries.captured_queries]
+
+    def assertUsesIndex(self, sql, index):
+        plan = self.plan(sql)
+        self.assertIn(index, plan, f'{index} not used by {sql}:\n{plan}')
+        self.assertNotRegex(plan, r'(?m)TEMP B-TREE|^\s*(->\s*)?(Incremental )?Sort\b', f'Sort in plan of {sql}:\n{plan}')
+        self.assertNotRegex(plan, r'(?m)^SCAN \w+$|Seq Scan', f'Table scan in plan of {sql}:\n{plan}')
+
+    def query_on(self, queries, table, containing=''):
+        matches = [
+            sql for sql in queries
+            if sql.startswith('SELECT') and f'FROM "{table}"' in sql and containing in sql and 'COUNT(*)' not in sql
+        ]
+        self.assertTrue(matches, f'No query on {table} in {queries}')
+        return matches[0]
+
+    def test_feed_and_image_prefetch(self):
+        queries = self.view_queries(reverse('post_list'))
+        self.assertUsesIndex(self.query_on(queries, 'posts_blogpost'), 'blogpost_feed_idx')
+        self.assertUsesIndex(self.query_on(queries, 'posts_blogpostimage'), 'blogpostimage_post_order_idx')
+
+    def test_comment_thread(self):
+        queries = self.view_queries(reverse('post_detail', args=[self.posts[0].pk]))
+        self.assertUsesIndex(self.query_on(queries, 'posts_comment'), 'comment_thread_idx')
+
+    def test_author_pages(self):
+        queries = self.view_queries(reverse('my_posts'))
+        self.assertUsesIndex(self.query_on(queries, 'posts_blogpost', 'author_id'), 'blogpost_author_feed_idx')
+
+        queries = self.view_queries(reverse('profile'))
+        self.assertUsesIndex(self.query_on(queries, 'posts_blogpost', 'ORDER BY'), 'blogpost_author_feed_idx')
+        self.assertUsesIndex(self.query_on(queries, 'posts_comment', '"posts_comment"."author_id" ='), 'comment_author_recent_idx')
+
+    def test_reaction_counts(self):
+        with CaptureQueriesContext(connection) as queries:
+            refresh_reaction_counters(BlogPost.objects.filter(pk=self.posts[0].pk))
+        update, = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertUsesIndex(update, 'likedislike_post_kind_idx')
+
+    def test_ranked_feeds(self):
+        rescore_recent()
+        for name, index in (('hot_posts', 'postscore_hot_idx'), ('top_posts', 'postscore_top_idx')):
+            queries = self.view_queries(reverse(name))
+            self.assertUsesIndex(self.query_on(queries, 'posts_postscore'), index)
+            cursor = self.client.get(reverse(name)).context['page_obj'].next_cursor
+            queries = self.view_queries(f'{reverse(name)}?cursor={cursor}')
+            self.assertUsesIndex(self.query_on(queries, 'posts_postscore'), index)
+
+    @override_settings(POSTS_TIMELINE_FANOUT_MAX_FOLLOWERS=0)
+    def test_home_timeline(self):
+        reader = User.objects.create_user(username='follower')
+        for post in self.posts:
+            TimelineEntry.objects.create(user=reader, post=post, created_at=post.created_at)
+        follow(reader, User.objects.get(username='other-author'))
+        self.client.force_login(reader)
+        cursor = self.client.get(reverse('home_timeline')).context['page_obj'].next_cursor
+        for url in (reverse('home_timeline'), f"{reverse('home_timeline')}?cursor={cursor}"):
+            queries = self.view_queries(url)
+            self.assertUsesIndex(self.query_on(queries, 'posts_timelineentry'), 'timelineentry_feed_idx')
+            # Posts of followed authors over the fan-out limit
+            self.assertUsesIndex(self.query_on(queries, 'posts_blogpost', 'author_id" IN'), 'blogpost_author_feed_idx')
+
+
+@override_settings(POSTS_REPLICA_DATABASES=['replica'], POSTS_REPLICA_LAG_REFRESH=0, POSTS_REPLICA_MAX_LAG=5)
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def route_read(self, request):
+        """The alias a read issued while handling ``request`` goes to, and the response"""
+        chosen = []
+
+        def view(request):
+            chosen.append(self.router.db_for_read(BlogPost))
+            return HttpResponse()
+
+        response = ReplicaPinningMiddleware(view)(request)
+        return chosen[0], response
+
+    def test_reads_use_caught_up_replicas_within_requests(self):
+        record_lag({'replica': 0.5})
+        self.assertEqual(self.route_read(self.factory.get('/'))[0], 'replica')
+        self.assertEqual(self.router.db_for_write(BlogPost), 'default')
+        # Outside requests (commands, background jobs) everything uses the primary
+        self.assertEqual(self.router.db_for_read(BlogPost), 'default')
+
+    def test_lagging_or_unavailable_replicas_fall_back_to_primary(self):
+        record_lag({'replica': 30})
+        self.assertEqual(self.route_read(self.factory.get('/'))[0], 'default')
+        record_lag({'replica': None})
+        self.assertEqual(self.route_read(self.factory.get('/'))[0], 'default')
+
+    def test_unmeasured_replicas_are_not_used(self):
+        # check_replicas never ran, or its entries expired
+        self.assertIsNone(cache.get('replica-lag:replica'))
+        self.assertEqual(self.route_read(self.factory.get('/'))[0], 'default')
+
+    def test_recent_changes_are_read_from_primary(self):
+        record_lag({'replica': 2})
+
+        def view(request):
+            require_fresh(time.time() - 1)
+            return HttpResponse(self.router.db_for_read(BlogPost))
+
+        self.assertEqual(ReplicaPinningMiddleware(view)(self.factory.get('/')).content, b'default')
+
+        def older_change_view(request):
+            require_fresh(time.time() - 3)
+            return HttpResponse(self.router.db_for_read(BlogPost))
+
+        self.assertEqual(ReplicaPinningMiddleware(older_change_view)(self.factory.get('/')).content, b'replica')
+
+    def test_feed_stays_on_replicas_under_write_traffic(self):
+        record_lag({'replica': 2})
+        with mock.patch('posts.caching.time.time', return_value=time.time() - 10):
+            bump_post_versions([1], listing=True)
+
+        def post_list(request):
+            # A reaction elsewhere a moment ago moved the feed version
+            bump_post_versions([2])
+            get_feed_version()
+            return HttpResponse(self.router.db_for_read(BlogPost))
+
+        self.assertEqual(ReplicaPinningMiddleware(post_list)(self.factory.get('/')).content, b'replica')
+
+        # A post published since the replica last caught up would be missing from it
+        bump_post_versions([3], listing=True)
+        self.assertEqual(ReplicaPinningMiddleware(post_list)(self.factory.get('/')).content, b'default')
+
+    def test_writes_pin_the_visitor_to_the_primary(self):
+        record_lag({'replica': 0})
+
+        def add_comment(request):
+            self.router.db_for_write(Comment)
+            return HttpResponse(self.router.db_for_read(Comment))
+
+        response = ReplicaPinningMiddleware(add_comment)(self.factory.post('/post/1/comment/'))
+        self.assertEqual(response.content, b'default')
+        cookie = response.cookies['primary_pin']
+        self.assertEqual(cookie['max-age'], 10)
+
+        # The redirected GET carries the cookie and reads its own write
+        redirected = self.factory.get('/post/1/')
+        redirected.COOKIES['primary_pin'] = cookie.value
+        alias, response = self.route_read(redirected)
+        self.assertEqual(alias, 'default')
+        self.assertNotIn('primary_pin', response.cookies)
+
+    @override_settings(POSTS_REPLICA_DATABASES=[])
+    def test_without_replicas_everything_uses_the_primary(self):
+        self.assertEqual(self.route_read(self.factory.get('/'))[0], 'default')
+
+
+class ReplicaLagTests(TestCase):
+    def test_cards_changed_after_the_replica_read_are_read_again(self):
+        cache.clear()
+        author = User.objects.create_user(username='author')
+        old, changed = (BlogPost.objects.create(title=title, content='x', author=author) for title in ('Old', 'Changed'))
+        with mock.patch('posts.caching.time.time', return_value=time.time() - 10):
+            bump_post_versions([old.pk, changed.pk])
+        cards = BlogPost.objects.with_card_data()
+        posts = list(cards.order_by('pk'))
+        # A like the replica the posts came from has not seen yet
+        changed.adjust_reaction_counts(likes=1)
+        bump_post_versions([changed.pk])
+
+        with mock.patch('posts.caching.replica_read_lag', return_value=2):
+            # The changed post and its prefetched images
+            with self.assertNumQueries(2):
+                posts = attach_cache_versions(posts, cards)
+        self.assertEqual([(post.title, post.likes_count) for post in posts], [('Old', 0), ('Changed', 1)])
+
+    @override_settings(POSTS_REPLICA_DATABASES=['default'])
+    def test_check_replicas_publishes_heartbeat_lag(self):
+        cache.clear()
+        call_command('check_replicas', stdout=StringIO())
+        self.assertLess(cache.get('replica-lag:default'), 1)
+        self.assertEqual(ReplicaHeartbeat.objects.count(), 1)
+
+
+class RankingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader', password='pw')
+
+    def make_post(self, title, age, likes=0, comments=0):
+        post = BlogPost.objects.create(
+            title=title, content='<p>Body</p>', author=self.author, created_at=timezone.now() - age,
+        )
+        for i in range(likes):
+            LikeDislike.objects.create(post=post, user=User.objects.create_user(username=f'{title}-fan-{i}'), is_like=True)
+        post.adjust_reaction_counts(likes=likes)
+        for _ in range(comments):
+            Comment.objects.create(post=post, author=self.reader, content='Nice')
+        return post
+
+    def feed(self, name, cursor=None):
+        response = self.client.get(reverse(name), {'cursor': cursor} if cursor else {})
+        return response.context['page_obj']
+
+    @override_settings(POSTS_RANKING_COMMENT_WEIGHT=2)
+    def test_reactions_and_comments_rescore_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = self.make_post('Fresh', timedelta(hours=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(post=post, author=self.reader, content='First!')
+        self.assertEqual(PostScore.objects.get(post=post).top, 2)
+
+        self.client.force_login(self.reader)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('like_dislike_post', args=[post.pk]), {'action': 'dislike'})
+        score = PostScore.objects.get(post=post)
+        self.assertEqual(score.top, 1)
+        self.assertGreater(score.hot, 0)
+
+    def test_one_rescore_per_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.make_post('First', timedelta(hours=1))
+            second = self.make_post('Second', timedelta(hours=2))
+        with self.captureOnCommitCallbacks() as callbacks:
+            for post in (first, second, first):
+                Comment.objects.create(post=post, author=self.reader, content='Nice')
+        self.assertEqual(len(callbacks), 1)
+        with mock.patch('posts.signals.rescore_posts') as rescore:
+            callbacks[0]()
+        self.assertEqual(set(rescore.call_args.args[0]), {first.pk, second.pk})
+
+    def test_deleting_a_post_does_not_rescore_it(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = self.make_post('Doomed', timedelta(hours=1), likes=2, comments=3)
+        with self.captureOnCommitCallbacks() as callbacks:
+            post.delete()
+        self.assertFalse(any('rescore' in callback.__qualname__ for callback in callbacks))
+
+    def test_hot_decays_and_old_posts_leave_the_feeds(self):
+        old_favourite = self.make_post('Old favourite', timedelta(days=2), likes=8)
+        newcomer = self.make_post('Newcomer', timedelta(hours=1), likes=2)
+        last_month = self.make_post('Last month', timedelta(days=30), likes=20)
+        self.assertEqual(rescore_recent(), 2)
+
+        self.assertEqual([post.pk for post in self.feed('hot_posts')], [newcomer.pk, old_favourite.pk])
+        self.assertEqual([post.pk for post in self.feed('top_posts')], [old_favourite.pk, newcomer.pk])
+        self.assertFalse(PostScore.objects.filter(post=last_month).exists())
+
+        with override_settings(POSTS_RANKING_HOT_DAYS=1):
+            rescore_recent()
+        self.assertEqual([post.pk for post in self.feed('hot_posts')], [newcomer.pk])
+        self.assertEqual(len(self.feed('top_posts')), 2)
+
+    def test_feed_pages_follow_score_order(self):
+        posts = [self.make_post(f'Post {i}', timedelta(hours=i), likes=i % 3) for i in range(14)]
+        rescore_recent()
+        expected = list(PostScore.objects.order_by('-hot', '-post').values_list('post', flat=True))
+        self.assertEqual(len(expected), len(posts))
+
+        page = self.feed('hot_posts')
+        seen = [post.pk for post in page]
+        while page.has_next():
+            page = self.feed('hot_posts', page.next_cursor)
+            seen.extend(post.pk for post in page)
+        self.assertEqual(seen, expected)
+        self.assertEqual(page.number, 3)
+        self.assertEqual([post.pk for post in self.feed('hot_posts', page.previous_cursor)], expected[6:12])
+
+    def test_rescored_feed_is_not_served_from_the_page_cache(self):
+        first = self.make_post('First', timedelta(hours=2), likes=1)
+        second = self.make_post('Second', timedelta(hours=1))
+        rescore_recent()
+        self.assertEqual(self.feed('top_posts')[0].pk, first.pk)
+
+        second.adjust_reaction_counts(likes=5)
+        rescore_posts([second.pk])
+        self.assertEqual(self.feed('top_posts')[0].pk, second.pk)
+
+    def test_rescore_command(self):
+        self.make_post('Fresh', timedelta(hours=1))
+        out = StringIO()
+        call_command('rescore_posts', stdout=out)
+        self.assertIn('Rescored 1 recent post(s).', out.getvalue())
+
+
+@override_settings(POSTS_RENDITIONS_ASYNC=False)
+class ContentRenderingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.author = User.objects.create_user(username='author')
+
+    def store_image(self, name, size):
+        from io import BytesIO
+        from PIL import Image
+
+        buffer = BytesIO()
+        Image.new('RGB', size, 'purple').save(buffer, 'JPEG')
+        return default_storage.save(name, SimpleUploadedFile(name, buffer.getvalue()))
+
+    def test_sanitizes_against_the_allowlist(self):
+        html, pending = render_html(
+            '<p onclick="steal()">Hi <script>alert(1)</script><b>there</b><iframe src="x"><p>x</p></iframe></p>'
+            '<a href=" java\tscript:alert(1)">bad</a><a href="https://example.com/?a=1&b=2" target="_blank">ok</a>'
+            '<img src="javascript:alert(1)"><p>unclosed <em>text'
+        )
+        self.assertEqual(html, (
+            '<p>Hi <b>there</b></p><a>bad</a>'
+            '<a href="https://example.com/?a=1&amp;b=2" rel="nofollow noopener">ok</a><p>unclosed <em>text</em></p>'
+        ))
+        self.assertEqual(pending, [])
+
+    def test_headings_get_unique_anchors(self):
+        html, _ = render_html('<h2 id="comments">Setup &amp; Use</h2><h2>Setup &amp; Use</h2>')
+        self.assertIn('<h2 id="section-setup-use">Setup &amp; Use<a class="heading-anchor" href="#section-setup-use"', html)
+        self.assertIn('<h2 id="section-setup-use-2">', html)
+        self.assertNotIn('id="comments"', html)
+
+    def test_embedded_uploads_get_dimensions_and_renditions(self):
+        name = self.store_image('uploads/photo.jpg', (2000, 1000))
+        content = f'<p><img src="{settings.MEDIA_URL}{name}" alt="Photo" style="width: 500px"></p>'
+        external = '<img src="https://example.com/a.png">'
+        with self.captureOnCommitCallbacks(execute=True):
+            post = BlogPost.objects.create(title='Photos', content=content + external, author=self.author)
+        # Saved before the renditions existed, with the original image; rendered again after commit
+        self.assertIn(f'src="{settings.MEDIA_URL}{name}"', post.rendered_html)
+        self.assertNotIn('<picture', post.rendered_html)
+
+        html = BlogPost.objects.get(pk=post.pk).rendered_html
+        self.assertIn('<picture class="responsive-picture">', html)
+        self.assertIn('alt="Photo"', html)
+        self.assertIn('height="250"', html)
+        self.assertIn('width="500"', html)
+        self.assertIn('sizes="500px"', html)
+        self.assertIn('uploads/photo-card.webp 640w', html)
+        self.assertIn('<img src="https://example.com/a.png" alt="" decoding="async" loading="lazy">', html)
+        self.assertTrue(default_storage.exists('renditions/uploads/photo-detail.jpeg'))
+
+    def test_render_command_and_stale_posts(self):
+        post = BlogPost.objects.create(title='Old', content='<p>Safe</p>', author=self.author)
+        BlogPost.objects.filter(pk=post.pk).update(
+            content='<p>Old <script>alert(1)</script></p>', rendered_html='', renderer_version=0,
+        )
+        response = self.client.get(reverse('post_detail', args=[post.pk]))
+        self.assertContains(response, '<p>Old </p>')
+        self.assertNotContains(response, 'alert(1)')
+
+        out = StringIO()
+        call_command('render_post_content', stdout=out)
+        post.refresh_from_db()
+        self.assertEqual((post.rendered_html, post.renderer_version), ('<p>Old </p>', RENDERER_VERSION))
+        self.assertIn('Rendered 1 post(s)', out.getvalue())
+        call_command('render_post_content', stdout=out)
+        self.assertIn('Rendered 0 post(s)', out.getvalue())
+
+
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        throttling._stats.pending.clear()
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader', password='pw')
+        self.post = BlogPost.objects.create(title='Post', content='<p>Body</p>', author=self.author)
+
+    def react(self, user, **extra):
+        self.client.force_login(user)
+        return self.client.post(reverse('like_dislike_post', args=[self.post.pk]), {'action': 'like'}, **extra)
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('10/m'), Rate(10, 60))
+        self.assertEqual(parse_rate('100/5m'), Rate(100, 300))
+        self.assertIsNone(parse_rate(None))
+        with self.assertRaises(InvalidRate):
+            parse_rate('10 per minute')
+
+    def test_previous_period_slides_out(self):
+        rate = Rate(10, 60)
+        # Half of the previous period's 10 requests still count
+        self.assertEqual(throttling._wait(rate, 5, 10, 30), 0)
+        self.assertEqual(throttling._wait(rate, 6, 10, 30), 6)
+        self.assertEqual(throttling._wait(rate, 12, 0, 30), 30 + 10)
+
+    @override_settings(POSTS_THROTTLE_RATES={'reaction': {'user': '2/m', 'ip': None}})
+    def test_user_limit(self):
+        self.assertEqual(self.react(self.reader).status_code, 200)
+        self.assertEqual(self.react(self.reader).status_code, 200)
+        response = self.react(self.reader, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertEqual(response.json()['retry_after'], int(response['Retry-After']))
+
+        # Other users have their own bucket
+        other = User.objects.create_user(username='other')
+        self.assertEqual(self.react(other).status_code, 200)
+
+    @override_settings(POSTS_THROTTLE_RATES={'reaction': {'user': None, 'ip': '2/m'}})
+    def test_ip_limit(self):
+        self.assertEqual(self.react(self.reader).status_code, 200)
+        self.assertEqual(self.react(User.objects.create_user(username='second')).status_code, 200)
+        response = self.react(User.objects.create_user(username='third'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertEqual(self.react(self.reader, REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    @override_settings(
+        POSTS_THROTTLE_RATES={'reaction': {'user': None, 'ip': '1/m'}},
+        POSTS_THROTTLE_IP_HEADER='HTTP_X_FORWARDED_FOR',
+        POSTS_THROTTLE_TRUSTED_PROXIES=2,
+    )
+    def test_ip_limit_behind_trusted_proxies(self):
+        # client, then the outer proxy's address appended by the inner one
+        self.assertEqual(self.react(self.reader, HTTP_X_FORWARDED_FOR='10.0.0.7, 192.168.0.1').status_code, 200)
+        # A forged leading entry does not give the same client a fresh bucket
+        forged = self.react(self.reader, HTTP_X_FORWARDED_FOR='1.2.3.4, 10.0.0.7, 192.168.0.1')
+        self.assertEqual(forged.status_code, 429)
+        self.assertEqual(self.react(self.reader, HTTP_X_FORWARDED_FOR='10.0.0.8, 192.168.0.1').status_code, 200)
+
+    def test_previous_counters_are_read_in_one_call(self):
+        rates = {'user': Rate(10, 60), 'ip': Rate(10, 60)}
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            throttling.check_rates('reaction', rates, self.reader.pk, '10.0.0.1')
+        get_many.assert_called_once()
+        self.assertEqual(len(get_many.call_args.args[0]), 2)
+
+    @override_settings(POSTS_THROTTLE_RATES={'create_post': {'user': '0/m'}})
+    def test_safe_methods_and_disabled_throttle_pass_through(self):
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get(reverse('create_post')).status_code, 200)
+        self.assertEqual(self.client.post(reverse('create_post'), {}).status_code, 429)
+        with override_settings(POSTS_THROTTLE_ENABLED=False):
+            self.assertEqual(self.client.post(reverse('create_post'), {}).status_code, 200)
+
+    @override_settings(POSTS_THROTTLE_MAX_CONCURRENT_PER_PROCESS=2, POSTS_THROTTLE_SHED_RETRY_AFTER=3)
+    def test_sheds_writes_over_the_concurrency_cap(self):
+        throttling._in_flight.count += 2
+        try:
+            response = self.react(self.reader)
+        finally:
+            throttling._in_flight.count -= 2
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '3')
+        self.assertEqual(self.react(self.reader).status_code, 200)
+        self.assertEqual(throttling._in_flight.count, 0)
+
+    @override_settings(
+        POSTS_THROTTLE_RATES={'comment': {'user': '1/m'}},
+        POSTS_THROTTLE_STATS_FLUSH_SECONDS=0,
+    )
+    def test_stats(self):
+        self.client.force_login(self.reader)
+        url = reverse('add_comment', args=[self.post.pk])
+        for _ in range(3):
+            self.client.post(url, {'content': 'Hello'})
+        self.assertEqual(Comment.objects.filter(post=self.post).count(), 1)
+
+        self.client.force_login(User.objects.create_user(username='staff', is_staff=True))
+        stats = self.client.get(reverse('throttle_stats')).json()
+        self.assertEqual(stats['comment']['admitted'], 1)
+        self.assertEqual(stats['comment']['shed_user'], 2)
+        self.assertEqual(stats['comment']['shed_ratio'], 0.6667)
+        self.assertEqual(stats['reaction']['shed_ratio'], None)
+
+
+class HomeTimelineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='pw')
+        self.reader = User.objects.create_user(username='reader', password='pw')
+
+    def publish(self, author, title, age=timedelta(0)):
+        with self.captureOnCommitCallbacks(execute=True):
+            return BlogPost.objects.create(
+                title=title, content='<p>Body</p>', author=author, created_at=timezone.now() - age,
+            )
+
+    def feed(self, cursor=None):
+        response = self.client.get(reverse('home_timeline'), {'cursor': cursor} if cursor else {})
+        return response.context['page_obj']
+
+    def test_posts_fan_out_to_followers_and_leave_with_the_post(self):
+        follow(self.reader, self.author)
+        follow(User.objects.create_user(username='other'), self.author)
+        self.client.force_login(self.reader)
+        self.assertEqual(self.feed().paginator.count, 0)
+        post = self.publish(self.author, 'Fresh')
+        self.assertEqual(TimelineEntry.objects.filter(post=post).count(), 2)
+        # Fanning out drops the followers' cached totals
+        self.assertEqual(self.feed().paginator.count, 1)
+
+        self.client.force_login(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('delete_post', args=[post.pk]))
+        self.assertFalse(TimelineEntry.objects.exists())
+        # So do deletes
+        self.client.force_login(self.reader)
+        self.assertEqual(self.feed().paginator.count, 0)
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        posts = [self.publish(self.author, f'Post {i}', timedelta(hours=i)) for i in range(3)]
+        self.client.force_login(self.reader)
+        url = reverse('follow_author', args=[self.author.pk])
+
+        response = self.client.post(url, {'action': 'follow', 'next': reverse('post_detail', args=[posts[0].pk])})
+        self.assertRedirects(response, reverse('post_detail', args=[posts[0].pk]))
+        self.assertEqual([post.pk for post in self.feed()], [post.pk for post in posts])
+        self.assertEqual(UserStats.for_user(self.author).follower_count, 1)
+        self.assertContains(self.client.get(reverse('post_detail', args=[posts[0].pk])), 'Unfollow author')
+
+        response = self.client.post(url, {'action': 'unfollow', 'next': 'https://evil.example/'})
+        self.assertRedirects(response, reverse('home_timeline'))
+        self.assertEqual(len(self.feed()), 0)
+        self.assertEqual(UserStats.for_user(self.author).follower_count, 0)
+
+        self.client.force_login(self.author)
+        self.client.post(url, {'action': 'follow'})
+        self.assertFalse(Follow.objects.filter(follower=self.author).exists())
+
+    @override_settings(POSTS_TIMELINE_FANOUT_MAX_FOLLOWERS=1)
+    def test_feed_merges_pulled_authors(self):
+        celebrity = User.objects.create_user(username='celebrity')
+        follow(self.reader, self.author)
+        follow(self.reader, celebrity)
+        # Fanned out while the celebrity had a single follower, then pulled as well
+        early = self.publish(celebrity, 'Early', timedelta(hours=20))
+        follow(User.objects.create_user(username='fan'), celebrity)
+
+        posts = [early]
+        for i in range(10):
+            posts.append(self.publish(celebrity if i % 2 else self.author, f'Post {i}', timedelta(hours=i)))
+        self.assertEqual(TimelineEntry.objects.filter(post__author=celebrity).count(), 1)
+        expected = [post.pk for post in sorted(posts, key=lambda post: post.created_at, reverse=True)]
+
+        self.client.force_login(self.reader)
+        with self.assertNumQueries(9):
+            # Session, user, pulled authors, both sources, posts, their images and the totals (cached afterwards)
+            page = self.feed()
+        seen = [post.pk for post in page]
+        while page.has_next():
+            page = self.feed(page.next_cursor)
+            seen.extend(post.pk for post in page)
+        self.assertEqual(seen, expected)
+        # The early post is in both sources but counts once
+        self.assertEqual((page.paginator.count, page.paginator.num_pages), (11, 2))
+        self.assertEqual([post.pk for post in self.feed(page.previous_cursor)], expected[:6])
+        self.assertEqual([post.pk for post in self.feed('last')], expected[6:])
+
+
+@override_settings(**FAST_AUTH_SETTINGS)
+class FastAuthTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='reader', password='pw')
+        BlogPost.objects.create(title='Post', content='<p>Body</p>', author=self.user)
+
+    def auth_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [query['sql'] for query in queries.captured_queries if is_auth_query(query['sql'])]
+
+    def test_logged_in_pages_skip_session_and_user_queries(self):
+        self.client.post(reverse('login'), {'username': 'reader', 'password': 'pw'})
+        self.client.get(reverse('post_list'))
+        for url in (reverse('post_list'), reverse('profile')):
+            response, queries = self.auth_queries(url)
+            self.assertContains(response, 'reader')
+            self.assertEqual(queries, [])
+
+    def test_user_changes_invalidate_the_cached_user(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('post_list'))
+        self.assertIsNotNone(cache.get(USER_KEY.format(self.user.pk)))
+
+        self.user.username = 'renamed'
+        self.user.save()
+        response, queries = self.auth_queries(reverse('post_list'))
+        self.assertContains(response, 'renamed')
+        self.assertEqual(len(queries), 1)
+
+        # A changed password ends the other sessions at once
+        self.user.set_password('new-pw')
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 302)
+
+    def test_user_cached_again_before_commit_is_dropped_on_commit(self):
+        key = USER_KEY.format(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Changed'
+            self.user.save()
+            self.assertIsNone(cache.get(key))
+            # A concurrent request still reads the old row and caches it
+            cache.set(key, User.objects.get(pk=self.user.pk))
+        self.assertIsNone(cache.get(key))
+
+    async def test_async_lookup_uses_the_cache(self):
+        backend = CachedModelBackend()
+        self.assertEqual(await backend.aget_user(self.user.pk), self.user)
+        self.assertEqual((await cache.aget(USER_KEY.format(self.user.pk))).username, 'reader')
+        # Served from the cache: update() sends no signal to drop it
+        await User.objects.filter(pk=self.user.pk).aupdate(username='changed')
+        self.assertEqual((await backend.aget_user(self.user.pk)).username, 'reader')
+
+    def test_logout_forgets_the_user(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('post_list'))
+        self.client.get(reverse('logout'))
+        self.assertIsNone(cache.get(USER_KEY.format(self.user.pk)))
+        response = self.client.get(reverse('post_list'))
+        self.assertFalse(response.context['user'].is_authenticated)
+        # The flash message travelled in a cookie
+        self.assertContains(response, 'You have been logged out successfully, reader!')
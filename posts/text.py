@@ -0,0 +1,29 @@
+import math
+import re
+from html import unescape
+
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
+
+EXCERPT_WORDS = 20
+EXCERPT_MAX_CHARS = 500  # BlogPost.excerpt max_length
+WORDS_PER_MINUTE = 200
+
+# Closing block-level tags and <br> separate words even without whitespace between them
+BLOCK_BOUNDARY_RE = re.compile(r'(<br\s*/?>|</(?:p|div|h[1-6]|li|blockquote|pre|tr|td|th|figcaption)>)', re.IGNORECASE)
+
+
+def html_to_text(html):
+    """Plain text of rich-text HTML, with tags removed and entities decoded"""
+    spaced = BLOCK_BOUNDARY_RE.sub(r'\1 ', html or '')
+    return ' '.join(unescape(strip_tags(spaced)).split())
+
+
+def make_excerpt(text, words=EXCERPT_WORDS):
+    excerpt = Truncator(text).words(words, truncate=' …')
+    return Truncator(excerpt).chars(EXCERPT_MAX_CHARS)
+
+
+def reading_time(word_count):
+    """Estimated reading time in whole minutes (at least one for non-empty posts)"""
+    return math.ceil(word_count / WORDS_PER_MINUTE) if word_count else 0
@@ -0,0 +1,311 @@
+"""
+Admission control for write endpoints.
+
+@throttle(scope, user='10/m', ip='30/m') guards a view's unsafe requests
+with:
+
+- rate limits per user and per client IP (see client_ip). Each behaves like a
+  token bucket of ``count`` tokens refilled over ``period``, kept as two
+  request counters in the cache: the current period's, bumped with an
+  atomic increment, and the previous period's, weighted by how much of it
+  still falls within the last ``period`` seconds. Rejected requests count
+  too, so a client that keeps retrying stays limited.
+- a cap of POSTS_THROTTLE_MAX_CONCURRENT_PER_PROCESS write requests in
+  progress, across every throttled view. When the database slows down and
+  writes pile up, further ones are shed at once instead of queueing behind
+  them (and holding a worker). The count is kept in memory, so the site as
+  a whole admits the cap times the number of worker processes.
+
+Either answers 429 Too Many Requests with Retry-After. POSTS_THROTTLE_RATES
+= {scope: {'user': rate, 'ip': rate}} overrides a view's rates; a rate of
+None turns that limit off, and POSTS_THROTTLE_ENABLED = False every limit.
+
+Checking the limits costs one cache round trip on Redis, where every
+counter of a request is incremented and read in one pipeline. Other
+backends (memcached, locmem) have no multi-key increment: they read the
+previous periods' counters with one get_many and increment each current
+counter on its own, so a request with both limits takes three round trips,
+plus an add for each counter that starts a period.
+
+Admitted and shed requests are counted in memory and added to the shared
+totals every POSTS_THROTTLE_STATS_FLUSH_SECONDS (see get_stats).
+"""
+import math
+import re
+import threading
+import time
+from collections import Counter, namedtuple
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.http import HttpResponse, JsonResponse
+
+BUCKET_KEY = 'throttle:{}:{}:{}:{}'
+STATS_KEY = 'throttle-stats:{}:{}'
+OUTCOMES = ('admitted', 'shed_user', 'shed_ip', 'shed_concurrency')
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+RATE_RE = re.compile(r'^(\d+)/(\d*)([smhd])$')
+
+Rate = namedtuple('Rate', ['count', 'period'])
+
+# Scopes of every throttled view, for get_stats
+SCOPES = set()
+
+
+class InvalidRate(ValueError):
+    pass
+
+
+def parse_rate(rate):
+    """'10/m' -> Rate(10, 60), '100/5m' -> Rate(100, 300); None stays None"""
+    if rate is None:
+        return None
+    match = RATE_RE.match(rate.replace(' ', ''))
+    if not match:
+        raise InvalidRate(f'Invalid rate "{rate}"; expected e.g. "10/m" or "100/5m"')
+    count, multiple, unit = match.groups()
+    return Rate(int(count), int(multiple or 1) * PERIODS[unit])
+
+
+def enabled():
+    return getattr(settings, 'POSTS_THROTTLE_ENABLED', True)
+
+
+def _cache():
+    return caches[getattr(settings, 'POSTS_THROTTLE_CACHE', 'default')]
+
+
+def rates_for(scope, defaults):
+    """{'user': Rate or None, 'ip': Rate or None} for ``scope``, with POSTS_THROTTLE_RATES applied"""
+    configured = {**defaults, **getattr(settings, 'POSTS_THROTTLE_RATES', {}).get(scope, {})}
+    return {kind: parse_rate(configured.get(kind)) for kind in ('user', 'ip')}
+
+
+def _count(buckets):
+    """
+    Increment the current counter of each (current key, previous key,
+    timeout) and read the previous one; returns [(current, previous)].
+    """
+    backend = _cache()
+    if isinstance(backend, RedisCache):
+        client = backend._cache.get_client(write=True)
+        pipeline = client.pipeline(transaction=False)
+        for current, previous, timeout in buckets:
+            current = backend.make_and_validate_key(current)
+            pipeline.incr(current)
+            pipeline.expire(current, timeout)
+            pipeline.get(backend.make_and_validate_key(previous))
+        results = pipeline.execute()
+        return [(results[i], int(results[i + 2] or 0)) for i in range(0, len(results), 3)]
+
+    previous_counts = backend.get_many([previous for _, previous, _ in buckets])
+    counts = []
+    for current, previous, timeout in buckets:
+        try:
+            count = backend.incr(current)
+        except ValueError:
+            # First request of the period (or the counter was evicted)
+            count = 1 if backend.add(current, 1, timeout) else backend.incr(current)
+        counts.append((count, previous_counts.get(previous, 0)))
+    return counts
+
+
+def _wait(rate, current, previous, elapsed):
+    """Seconds until the bucket admits a request again; 0 if it admits this one"""
+    weight = 1 - elapsed / rate.period
+    if previous * weight + current <= rate.count:
+        return 0
+    if current <= rate.count:
+        # Admitted again once enough of the previous period has slid out
+        return rate.period * (1 - (rate.count - current) / previous) - elapsed
+    # This period is over the limit on its own: wait for it to become the previous one and slide out
+    return rate.period - elapsed + rate.period * (1 - rate.count / current)
+
+
+def client_ip(request):
+    """
+    The address the IP limits count: REMOTE_ADDR, or behind proxies the
+    address POSTS_THROTTLE_IP_HEADER (a META key such as
+    'HTTP_X_FORWARDED_FOR') records for the client. Each proxy appends the
+    address it received the request from, so with
+    POSTS_THROTTLE_TRUSTED_PROXIES proxies in front of the app the client is
+    that many entries from the end; entries before it can be forged.
+    """
+    header = getattr(settings, 'POSTS_THROTTLE_IP_HEADER', None)
+    if header:
+        addresses = [address.strip() for address in request.META.get(header, '').split(',') if address.strip()]
+        proxies = max(getattr(settings, 'POSTS_THROTTLE_TRUSTED_PROXIES', 1), 1)
+        if len(addresses) >= proxies:
+            return addresses[-proxies]
+    return request.META.get('REMOTE_ADDR')
+
+
+def check_rates(scope, rates, user_id, ip):
+    """Count a request against its buckets; returns (limit that rejected it or None, seconds to wait)"""
+    now = time.time()
+    buckets, checks = [], []
+    for kind, identity in (('user', user_id), ('ip', ip)):
+        rate = rates[kind]
+        if rate is None or not identity:
+            continue
+        period, elapsed = divmod(now, rate.period)
+        period = int(period)
+        buckets.append((
+            BUCKET_KEY.format(scope, kind, identity, period),
+            BUCKET_KEY.format(scope, kind, identity, period - 1),
+            rate.period * 2,
+        ))
+        checks.append((kind, rate, elapsed))
+    if not buckets:
+        return None, 0
+
+    rejected, longest = None, 0
+    for (kind, rate, elapsed), (current, previous) in zip(checks, _count(buckets)):
+        wait = _wait(rate, current, previous, elapsed)
+        if wait > longest:
+            rejected, longest = kind, wait
+    return rejected, longest
+
+
+class _InFlight:
+    """Write requests in progress in this process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def enter(self):
+        limit = getattr(settings, 'POSTS_THROTTLE_MAX_CONCURRENT_PER_PROCESS', 32)
+        with self.lock:
+            if limit and self.count >= limit:
+                return False
+            self.count += 1
+            return True
+
+    def leave(self):
+        with self.lock:
+            self.count -= 1
+
+
+_in_flight = _InFlight()
+
+
+class _Stats:
+    """Per-process outcome counts, added to the cache at most every POSTS_THROTTLE_STATS_FLUSH_SECONDS"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = Counter()
+        self.last_flush = time.monotonic()
+
+    def add(self, scope, outcome):
+        with self.lock:
+            self.pending[scope, outcome] += 1
+            if time.monotonic() - self.last_flush < getattr(settings, 'POSTS_THROTTLE_STATS_FLUSH_SECONDS', 10):
+                return
+            pending, self.pending = self.pending, Counter()
+            self.last_flush = time.monotonic()
+        flush_stats(pending)
+
+
+def flush_stats(pending):
+    backend = _cache()
+    for (scope, outcome), value in pending.items():
+        key = STATS_KEY.format(scope, outcome)
+        backend.add(key, 0, None)
+        try:
+            backend.incr(key, value)
+        except ValueError:
+            # The counter was evicted between add() and incr()
+            backend.set(key, value, None)
+
+
+_stats = _Stats()
+
+
+def get_stats():
+    """Admitted and shed request totals per scope, with the share of requests shed"""
+    keys = {STATS_KEY.format(scope, outcome): (scope, outcome) for scope in sorted(SCOPES) for outcome in OUTCOMES}
+    values = _cache().get_many(keys)
+    stats = {scope: dict.fromkeys(OUTCOMES, 0) for scope in sorted(SCOPES)}
+    for key, (scope, outcome) in keys.items():
+        stats[scope][outcome] = values.get(key, 0)
+    for scope_stats in stats.values():
+        total = sum(scope_stats.values())
+        shed = total - scope_stats['admitted']
+        scope_stats['shed_ratio'] = round(shed / total, 4) if total else None
+    return stats
+
+
+def too_many_requests(request, retry_after):
+    retry_after = max(math.ceil(retry_after), 1)
+    message = f'Too many requests. Please try again in {retry_after} second{"s" if retry_after != 1 else ""}.'
+    if request.accepts('application/json') and not request.accepts('text/html'):
+        response = JsonResponse({'error': message, 'retry_after': retry_after}, status=429)
+    else:
+        response = HttpResponse(message, status=429, content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def _admit(scope, defaults, request, user):
+    """
+    Enter the request, or return the 429 response shedding it. An admitted
+    request must be left with _in_flight.leave().
+    """
+    if not _in_flight.enter():
+        _stats.add(scope, 'shed_concurrency')
+        return too_many_requests(request, getattr(settings, 'POSTS_THROTTLE_SHED_RETRY_AFTER', 1))
+    user_id = user.pk if user.is_authenticated else None
+    rejected, wait = check_rates(scope, rates_for(scope, defaults), user_id, client_ip(request))
+    if rejected:
+        _in_flight.leave()
+        _stats.add(scope, f'shed_{rejected}')
+        return too_many_requests(request, wait)
+    _stats.add(scope, 'admitted')
+    return None
+
+
+def throttle(scope, user=None, ip=None):
+    """
+    Limit the view's unsafe requests under ``scope``, by default to the
+    rates ``user`` and ``ip`` (e.g. '10/m'). Safe methods pass through.
+    """
+    defaults = {'user': user, 'ip': ip}
+    # Fail at import time on a malformed rate
+    rates_for(scope, defaults)
+    SCOPES.add(scope)
+
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method in SAFE_METHODS or not enabled():
+                    return await view_func(request, *args, **kwargs)
+                rejection = await sync_to_async(_admit)(scope, defaults, request, await request.auser())
+                if rejection is not None:
+                    return rejection
+                try:
+                    return await view_func(request, *args, **kwargs)
+                finally:
+                    _in_flight.leave()
+            return async_wrapper
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method in SAFE_METHODS or not enabled():
+                return view_func(request, *args, **kwargs)
+            rejection = _admit(scope, defaults, request, request.user)
+            if rejection is not None:
+                return rejection
+            try:
+                return view_func(request, *args, **kwargs)
+            finally:
+                _in_flight.leave()
+        return wrapper
+    return decorator
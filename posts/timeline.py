@@ -0,0 +1,175 @@
+"""
+Home timelines: the posts of the authors a user follows, newest first.
+
+Publishing a post fans it out on write: a TimelineEntry per follower, so a
+home page is one range read of the follower's own index however many
+authors they follow. Following an author copies their latest
+POSTS_TIMELINE_BACKFILL_POSTS posts in; unfollowing removes them. Entries
+of a deleted post go with it (CASCADE), in one DELETE by post, and the
+followers' cached totals are dropped.
+
+Authors with more than POSTS_TIMELINE_FANOUT_MAX_FOLLOWERS followers are
+not fanned out, since one post would write that many rows. Their followers
+pull their posts at read time instead, with a query on the author's feed
+index that HomeTimelinePaginator merges with the timeline entries. Posts an
+author published while above the limit are only pulled while they stay
+above it.
+"""
+from collections import namedtuple
+from itertools import chain
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+
+from .models import BlogPost, Follow, TimelineEntry, UserStats
+from .pagination import CursorPaginator, cursor_count_key
+
+HOME_COUNT_KEY = 'home:{}'
+
+# A post in a home timeline page: enough to order and page it; the view loads the posts
+TimelineItem = namedtuple('TimelineItem', ['created_at', 'post_id'])
+
+
+def fanout_max_followers():
+    return getattr(settings, 'POSTS_TIMELINE_FANOUT_MAX_FOLLOWERS', 5000)
+
+
+def follower_count(author_id):
+    count = UserStats.objects.filter(user_id=author_id).values_list('follower_count', flat=True).first()
+    if count is None:
+        count = UserStats.objects.rebuild([author_id])[0].follower_count
+    return count
+
+
+def fans_out(author_id):
+    """True if ``author_id``'s posts are written to their followers' timelines"""
+    return follower_count(author_id) <= fanout_max_followers()
+
+
+def fan_out_post(post_id, batch_size=1000):
+    """Add a post to the timelines of its author's followers; returns the number of entries written"""
+    post = BlogPost.objects.filter(pk=post_id).values('author_id', 'created_at').first()
+    if post is None or not fans_out(post['author_id']):
+        return 0
+    followers = Follow.objects.filter(author_id=post['author_id']).order_by('pk').values_list('pk', 'follower_id')
+    written, last_pk = 0, 0
+    while True:
+        # Seek by primary key so each batch is a cheap range scan
+        batch = list(followers.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return written
+        entries = [
+            TimelineEntry(user_id=follower_id, post_id=post_id, created_at=post['created_at'])
+            for _, follower_id in batch
+        ]
+        TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+        # Their cached totals no longer include the post
+        cache.delete_many([cursor_count_key(HOME_COUNT_KEY.format(follower_id)) for _, follower_id in batch])
+        written += len(batch)
+        last_pk = batch[-1][0]
+
+
+def forget_home_counts(author_id, batch_size=1000):
+    """Drop the cached home totals of ``author_id``'s followers, e.g. after one of their posts was deleted"""
+    followers = Follow.objects.filter(author_id=author_id).order_by('pk').values_list('pk', 'follower_id')
+    last_pk = 0
+    while True:
+        # Seek by primary key so each batch is a cheap range scan
+        batch = list(followers.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return
+        cache.delete_many([cursor_count_key(HOME_COUNT_KEY.format(follower_id)) for _, follower_id in batch])
+        last_pk = batch[-1][0]
+
+
+def follow(user, author):
+    """Make ``user`` follow ``author``; returns False if they already did"""
+    try:
+        with transaction.atomic():
+            Follow.objects.create(follower=user, author=author)
+            UserStats.objects.adjust(author.pk, followers=1)
+    except IntegrityError:
+        return False
+    if fans_out(author.pk):
+        recent = (
+            BlogPost.objects.filter(author=author).order_by('-created_at', '-id')
+            .values_list('pk', 'created_at')[:getattr(settings, 'POSTS_TIMELINE_BACKFILL_POSTS', 100)]
+        )
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user=user, post_id=post_id, created_at=created_at) for post_id, created_at in recent],
+            ignore_conflicts=True,
+        )
+    cache.delete(cursor_count_key(HOME_COUNT_KEY.format(user.pk)))
+    return True
+
+
+def unfollow(user, author):
+    """Make ``user`` stop following ``author``; returns False if they did not"""
+    with transaction.atomic():
+        deleted, _ = Follow.objects.filter(follower=user, author=author).delete()
+        if not deleted:
+            return False
+        UserStats.objects.adjust(author.pk, followers=-1)
+        TimelineEntry.objects.filter(user=user, post__author=author).delete()
+    cache.delete(cursor_count_key(HOME_COUNT_KEY.format(user.pk)))
+    return True
+
+
+def is_following(user, author_id):
+    return user.is_authenticated and Follow.objects.filter(follower=user, author_id=author_id).exists()
+
+
+def pulled_authors(user):
+    """Followed authors whose posts are not fanned out, so the home feed reads them directly"""
+    over_limit = UserStats.objects.filter(user=OuterRef('author_id'), follower_count__gt=fanout_max_followers())
+    return list(Follow.objects.filter(Exists(over_limit), follower=user).values_list('author_id', flat=True))
+
+
+class MergedRows:
+    """Rows of several sliced querysets of (created_at, post id), merged in page order without duplicates"""
+
+    def __init__(self, querysets, limit, descending):
+        self.querysets = querysets
+        self.limit = limit
+        self.descending = descending
+
+    def __iter__(self):
+        # A post fanned out before its author passed the limit is also pulled
+        rows = sorted(set(chain.from_iterable(self.querysets)), reverse=self.descending)
+        return (TimelineItem(*row) for row in rows[:self.limit])
+
+
+class HomeTimelinePaginator(CursorPaginator):
+    """
+    Cursor pagination over a user's timeline entries merged with the posts
+    of the authors they follow that are not fanned out. Pages hold
+    TimelineItems, ordered like BlogPost by (created_at, post id).
+    """
+
+    def __init__(self, user, per_page, count_timeout=300):
+        entries = TimelineEntry.objects.filter(user=user)
+        super().__init__(entries, per_page, count_cache_key=HOME_COUNT_KEY.format(user.pk), count_timeout=count_timeout)
+        # (queryset, field holding the post id)
+        self.sources = [(entries.values_list('created_at', 'post_id'), 'post_id')]
+        self.pulled = None
+        authors = pulled_authors(user)
+        if authors:
+            self.pulled = BlogPost.objects.filter(author__in=authors)
+            self.sources.append((self.pulled.values_list('created_at', 'pk'), 'pk'))
+
+    def cursor_key(self, obj):
+        return self.key_field.value_to_string(obj), obj.post_id
+
+    def _total(self):
+        total = self.object_list.count()
+        if self.pulled is not None:
+            # Posts fanned out before their author passed the limit are in both sources; count them once
+            in_timeline = self.object_list.filter(post=OuterRef('pk'))
+            total += self.pulled.exclude(Exists(in_timeline)).count()
+        return total
+
+    def _rows(self, bound, descending):
+        querysets = [self._seek(queryset, bound, descending, field) for queryset, field in self.sources]
+        return MergedRows(querysets, self.per_page + 1, descending)
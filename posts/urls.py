@@ -1,19 +1,36 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Under ASGI the async variants do not hold a worker thread while waiting on the database
+hot_views = async_views if getattr(settings, 'POSTS_ASYNC_VIEWS', False) else views
 
 urlpatterns = [
-    path('', views.post_list, name='post_list'),
-    path('post/<int:pk>/', views.post_detail, name='post_detail'),
+    path('', hot_views.post_list, name='post_list'),
+    path('hot/', views.ranked_posts, {'ranking': 'hot'}, name='hot_posts'),
+    path('top/', views.ranked_posts, {'ranking': 'top'}, name='top_posts'),
+    path('home/', views.home_timeline, name='home_timeline'),
+    path('search/', views.search, name='search'),
+    path('post/<int:pk>/', hot_views.post_detail, name='post_detail'),
     path('post/<int:pk>/comment/', views.add_comment, name='add_comment'),
-    path('post/<int:pk>/like-dislike/', views.like_dislike_post, name='like_dislike_post'),
+    path('post/<int:pk>/like-dislike/', hot_views.like_dislike_post, name='like_dislike_post'),
     
     # Post management URLs
     path('create/', views.create_post, name='create_post'),
     path('post/<int:pk>/edit/', views.edit_post, name='edit_post'),
     path('post/<int:pk>/delete/', views.delete_post, name='delete_post'),
     path('my-posts/', views.my_posts, name='my_posts'),
+    path('user/<int:pk>/follow/', views.follow_author, name='follow_author'),
     
     # Comment management URLs
     path('comment/<int:pk>/edit/', views.edit_comment, name='edit_comment'),
     path('comment/<int:pk>/delete/', views.delete_comment, name='delete_comment'),
+
+    # Data export
+    path('export.jsonl', views.export, name='export'),
+
+    # Monitoring
+    path('stats/page-cache/', views.page_cache_stats, name='page_cache_stats'),
+    path('stats/performance/', views.performance_stats, name='performance_stats'),
+    path('stats/throttle/', views.throttle_stats, name='throttle_stats'),
 ]
@@ -1,49 +1,157 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_POST
 from django.contrib.auth.models import User
-from django.core.paginator import Paginator
 from django.http import Http404
+from django.core.paginator import Paginator
+from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import url_has_allowed_host_and_scheme
 from django.utils.text import slugify
 from django.db import transaction
-from .models import BlogPost, Comment, LikeDislike, BlogPostImage
+from .models import BlogPost, Comment, BlogPostImage
 from .forms import BlogPostForm, CommentForm, BlogPostImageFormSet
+from .caching import attach_cache_versions, get_feed_version, get_post_version, get_ranking_version
+from .comments import load_comment_tree
+from .export import EXPORT_TYPES, InvalidWatermark, export_lines, parse_watermark
+from .page_cache import anonymous_page_cache, feed_version, get_stats, post_version, ranking_version
+from .pagination import CursorPaginator
+from .performance import get_histograms
+from .ranking import ranked_scores
+from .reactions import apply_reaction, buffered_mode, get_user_reaction, record_reaction
+from .search import rank_posts
+from .throttling import get_stats as get_throttle_stats, throttle
+from .timeline import HomeTimelinePaginator, follow, is_following, unfollow
 
 
+@anonymous_page_cache(feed_version)
 def post_list(request):
-    posts = BlogPost.objects.all()
-    paginator = Paginator(posts, 6)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Looked up first so replica reads are fresh enough for it (posts.routers)
+    get_feed_version()
+    posts = BlogPost.objects.with_card_data()
+    paginator = CursorPaginator(posts, 6, count_cache_key='post_list')
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    page_obj.object_list = attach_cache_versions(page_obj.object_list, posts)
     return render(request, 'posts/post_list.html', {'page_obj': page_obj})
 
 
+RANKED_FEEDS = {
+    'hot': ('Trending', 'fa-fire'),
+    'top': ('Top This Week', 'fa-trophy'),
+}
+
+
+@anonymous_page_cache(ranking_version)
+def ranked_posts(request, ranking):
+    """The hot or top feed: a page of PostScore in index order, then the card data of its posts"""
+    # Looked up first so replica reads are fresh enough for it (posts.routers)
+    get_ranking_version()
+    paginator = CursorPaginator(ranked_scores(ranking), 6, count_cache_key=f'{ranking}_feed', key=ranking)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+
+    ranked_ids = [score.pk for score in page_obj.object_list]
+    cards = BlogPost.objects.with_card_data()
+    posts = cards.in_bulk(ranked_ids)
+    page_obj.object_list = attach_cache_versions((posts[post_id] for post_id in ranked_ids if post_id in posts), cards)
+
+    heading, icon = RANKED_FEEDS[ranking]
+    return render(request, 'posts/post_list.html', {
+        'page_obj': page_obj,
+        'ranking': ranking,
+        'heading': heading,
+        'heading_icon': icon,
+    })
+
+
+@login_required
+def home_timeline(request):
+    """Posts of the authors the user follows: a page of their timeline (posts.timeline), then the card data"""
+    paginator = HomeTimelinePaginator(request.user, 6)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+
+    post_ids = [item.post_id for item in page_obj.object_list]
+    cards = BlogPost.objects.with_card_data()
+    posts = cards.in_bulk(post_ids)
+    page_obj.object_list = attach_cache_versions((posts[post_id] for post_id in post_ids if post_id in posts), cards)
+
+    return render(request, 'posts/post_list.html', {
+        'page_obj': page_obj,
+        'home': True,
+        'heading': 'Your Feed',
+        'heading_icon': 'fa-user-friends',
+    })
+
+
+@login_required
+@require_POST
+@throttle('follow', user='30/m', ip='120/m')
+def follow_author(request, pk):
+    author = get_object_or_404(User, pk=pk)
+    
+    if author == request.user:
+        messages.error(request, 'You cannot follow yourself.')
+    elif request.POST.get('action') == 'unfollow':
+        if unfollow(request.user, author):
+            messages.success(request, f'You are no longer following {author.username}.')
+    elif follow(request.user, author):
+        messages.success(request, f'You are now following {author.username}. Their posts will appear in your feed.')
+    
+    next_url = request.POST.get('next')
+    if not url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}, require_https=request.is_secure()):
+        next_url = reverse('home_timeline')
+    return redirect(next_url)
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    paginator = Paginator(rank_posts(query), 6)
+    page_obj = paginator.get_page(request.GET.get('page'))
+
+    # Fetch the card data for just the posts on this page, keeping rank order
+    ranked_ids = [row['post_id'] for row in page_obj.object_list]
+    cards = BlogPost.objects.with_card_data()
+    posts = cards.in_bulk(ranked_ids)
+    results = attach_cache_versions((posts[post_id] for post_id in ranked_ids if post_id in posts), cards)
+
+    return render(request, 'posts/search.html', {
+        'query': query,
+        'page_obj': page_obj,
+        'results': results,
+    })
+
+
+@anonymous_page_cache(post_version)
 def post_detail(request, pk):
-    post = get_object_or_404(BlogPost, pk=pk)
-    comments = post.comments.filter(parent=None, active=True)
+    # Looked up first so replica reads are fresh enough for it (posts.routers)
+    version = get_post_version(pk)
+    post = get_object_or_404(BlogPost.objects.select_related('author'), pk=pk)
+    post.cache_version = version
+    # Only loaded when the cached comment fragments have to be re-rendered
+    comments = SimpleLazyObject(lambda: load_comment_tree(post))
     comment_form = CommentForm()
     
     user_reaction = None
+    following = False
     if request.user.is_authenticated:
-        try:
-            reaction = LikeDislike.objects.get(user=request.user, post=post)
-            user_reaction = 'like' if reaction.is_like else 'dislike'
-        except LikeDislike.DoesNotExist:
-            user_reaction = None
+        user_reaction = get_user_reaction(request.user, post)
+        following = is_following(request.user, post.author_id)
     
     context = {
         'post': post,
         'comments': comments,
         'comment_form': comment_form,
         'user_reaction': user_reaction,
+        'following': following,
     }
     return render(request, 'posts/post_detail.html', context)
 
 
 @login_required
 @require_POST
+@throttle('comment', user='10/m', ip='30/m')
 def add_comment(request, pk):
     post = get_object_or_404(BlogPost, pk=pk)
     parent_id = request.POST.get('parent_id')
@@ -57,7 +165,7 @@ def add_comment(request, pk):
         
         if parent_id:
             try:
-                parent_comment = Comment.objects.get(id=parent_id)
+                parent_comment = Comment.objects.get(id=parent_id, post=post)
                 comment.parent = parent_comment
                 messages.success(request, 'Your reply has been added successfully!')
             except Comment.DoesNotExist:
@@ -75,36 +183,27 @@ def add_comment(request, pk):
 
 @login_required
 @require_POST
+@throttle('reaction', user='30/m', ip='120/m')
 def like_dislike_post(request, pk):
-    post = get_object_or_404(BlogPost, pk=pk)
     action = request.POST.get('action')
     
     if action not in ['like', 'dislike']:
         return JsonResponse({'error': 'Invalid action'}, status=400)
     
-    try:
-        existing_reaction = LikeDislike.objects.get(user=request.user, post=post)
-        
-        if (action == 'like' and existing_reaction.is_like) or \
-           (action == 'dislike' and not existing_reaction.is_like):
-            existing_reaction.delete()
-            user_reaction = None
-        else:
-            existing_reaction.is_like = (action == 'like')
-            existing_reaction.save()
-            user_reaction = action
-    
-    except LikeDislike.DoesNotExist:
-        LikeDislike.objects.create(
-            user=request.user,
-            post=post,
-            is_like=(action == 'like')
-        )
-        user_reaction = action
+    if buffered_mode():
+        # Append to the reaction log; totals catch up when the batch worker runs
+        result = record_reaction(request.user, pk, action)
+        if result is None:
+            raise Http404('No BlogPost matches the given query.')
+        user_reaction, likes_count, dislikes_count = result
+    else:
+        post = get_object_or_404(BlogPost, pk=pk)
+        user_reaction = apply_reaction(request.user, post, action)
+        likes_count, dislikes_count = post.likes_count, post.dislikes_count
     
     response_data = {
-        'likes_count': post.total_likes(),
-        'dislikes_count': post.total_dislikes(),
+        'likes_count': likes_count,
+        'dislikes_count': dislikes_count,
         'user_reaction': user_reaction
     }
     
@@ -112,6 +211,7 @@ def like_dislike_post(request, pk):
 
 
 @login_required
+@throttle('create_post', user='10/h', ip='30/h')
 def create_post(request):
     if request.method == 'POST':
         form = BlogPostForm(request.POST, request.FILES)
@@ -264,9 +364,57 @@ def delete_comment(request, pk):
 
 @login_required
 def my_posts(request):
-    posts = BlogPost.objects.filter(author=request.user).order_by('-created_at')
-    paginator = Paginator(posts, 6)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    posts = BlogPost.objects.with_card_data().filter(author=request.user)
+    paginator = CursorPaginator(posts, 6, count_cache_key=f'my_posts:{request.user.pk}')
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
     return render(request, 'posts/my_posts.html', {'page_obj': page_obj})
+
+
+@staff_member_required
+def page_cache_stats(request):
+    """Hit/miss counters of the anonymous page cache, for monitoring"""
+    return JsonResponse(get_stats())
+
+
+@staff_member_required
+def throttle_stats(request):
+    """Requests admitted and shed by the write throttles, per scope"""
+    return JsonResponse(get_throttle_stats())
+
+
+@staff_member_required
+def performance_stats(request):
+    """Rolling per-view response times and query counts recorded by PerformanceMiddleware"""
+    try:
+        minutes = max(int(request.GET.get('minutes', 0)), 0)
+    except ValueError:
+        minutes = 0
+    rows = get_histograms(minutes or None)
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'views': rows})
+    return render(request, 'posts/performance.html', {'rows': rows, 'minutes': minutes or None})
+
+
+@staff_member_required
+def export(request):
+    """
+    Stream posts, comments and reaction totals as JSON Lines.
+    ``?types=posts,comments`` limits the record types and ``?since=<ISO
+    date/time>`` (the ``watermark`` of a previous export) makes it incremental.
+    """
+    types = [name for name in request.GET.get('types', '').split(',') if name] or list(EXPORT_TYPES)
+    unknown = set(types) - set(EXPORT_TYPES)
+    if unknown:
+        return JsonResponse({'error': f'Unknown export type(s): {", ".join(sorted(unknown))}'}, status=400)
+    try:
+        since = parse_watermark(request.GET.get('since'))
+    except InvalidWatermark as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    response = StreamingHttpResponse(
+        export_lines(types, since=since, url_for=request.build_absolute_uri),
+        content_type='application/x-ndjson',
+    )
+    response['Content-Disposition'] = 'attachment; filename="blog-export.jsonl"'
+    return response